@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import collections
+import logging
+import random
+import threading
+import time
+import typing as t
+
+import medusa.utils
+from medusa.deep_verify import DeepVerification, DeepVerificationProgress
+from medusa.monitoring import Monitoring
+from medusa.storage import Storage
+from medusa.storage.abstract_storage import AbstractStorage
+from medusa.storage.bandwidth_limiter import bandwidth_limiter
+
+# how often (in seconds) the auditor lists the backups again, to pick up new ones and forget about purged ones
+BACKUPS_REFRESH_INTERVAL = 3600
+# confidence of the bound given on the fraction of corrupted bytes
+CONFIDENCE = 0.95
+
+AuditRound = collections.namedtuple('AuditRound', ['sampled_objects', 'verified_bytes', 'corrupted'])
+AuditedBackup = collections.namedtuple('AuditedBackup', ['fqdn', 'name', 'is_differential', 'size'])
+
+
+class AuditTotals(object):
+    """
+    What audit rounds found so far. Shared by the rounds of a long running audit, or by successive gRPC calls.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sampled_objects = 0
+        self.verified_bytes = 0
+        self.corrupted_objects = 0
+
+    def add(self, audit_round: AuditRound):
+        with self._lock:
+            self.sampled_objects += audit_round.sampled_objects
+            self.verified_bytes += audit_round.verified_bytes
+            self.corrupted_objects += len(audit_round.corrupted)
+
+    def max_corrupted_fraction(self) -> t.Optional[float]:
+        """
+        Upper bound of the fraction of backed up bytes that are corrupted, with CONFIDENCE, as long as no corrupted
+        object got found. Objects are sampled in proportion to their size, so each sample is a byte drawn at random.
+        """
+        if self.corrupted_objects > 0 or self.sampled_objects == 0:
+            return None
+        return 1 - (1 - CONFIDENCE) ** (1 / self.sampled_objects)
+
+
+class AuditedBackups(object):
+    """
+    The finished node backups audits sample objects from, with their sizes. Listed again every
+    BACKUPS_REFRESH_INTERVAL, so it can be shared by successive gRPC calls.
+
+    Only names and sizes are kept, not the node backups, so the manifests read while sampling do not pile up.
+    """
+
+    def __init__(self, clock: t.Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._backups = None
+        self._listed_at = None
+
+    def get(self, storage) -> t.List[AuditedBackup]:
+        with self._lock:
+            if self._backups is None or self._clock() - self._listed_at >= BACKUPS_REFRESH_INTERVAL:
+                node_backups = [node_backup for node_backup in storage.list_node_backups() if node_backup.finished]
+                storage.prefetch_node_backups(node_backups, stats=True)
+                self._backups = [
+                    AuditedBackup(node_backup.fqdn, node_backup.name, node_backup.is_differential, node_backup.size())
+                    for node_backup in node_backups if node_backup.size() > 0
+                ]
+                self._listed_at = self._clock()
+                logging.debug('Auditing {} node backups'.format(len(self._backups)))
+            return list(self._backups)
+
+    def forget(self, fqdn: str, name: str):
+        with self._lock:
+            if self._backups is not None:
+                self._backups = [backup for backup in self._backups if (backup.fqdn, backup.name) != (fqdn, name)]
+
+
+class BackupAuditor(object):
+    """
+    Checks random objects of all the finished backups against their manifest.
+
+    Objects get sampled in proportion to their size, without decoding every manifest: a node backup gets picked in
+    proportion to its size (which comes from its stats), then one of its tables, then one of the objects of the table.
+    Objects then get checked with HEAD requests, or get read back to check their MD5 when read_objects is set.
+
+    Auditors built for each gRPC call share the listing of the backups by getting the same AuditedBackups.
+    """
+
+    def __init__(
+            self,
+            storage,
+            totals: AuditTotals,
+            monitoring=None,
+            read_objects: bool = False,
+            enable_md5_checks: bool = False,
+            rng: t.Optional[random.Random] = None,
+            clock: t.Callable[[], float] = time.monotonic,
+            backups: t.Optional[AuditedBackups] = None
+    ):
+        self._storage = storage
+        self.totals = totals
+        self._monitoring = monitoring
+        self._read_objects = read_objects
+        self._enable_md5_checks = enable_md5_checks
+        self._rng = rng or random.Random()
+        self._backups = backups if backups is not None else AuditedBackups(clock)
+        self._deep_verification = DeepVerification(storage, DeepVerificationProgress()) if read_objects else None
+
+    def _forget(self, node_backup):
+        self._backups.forget(node_backup.fqdn, node_backup.name)
+
+    def _sample(self, num_samples: int) -> t.List[t.Tuple[t.Any, dict]]:
+        backups = self._backups.get(self._storage)
+        if not backups:
+            return []
+        picked = self._rng.choices(backups, weights=[backup.size for backup in backups], k=num_samples)
+        # the node backups only live for this round, and so do the manifests they cache
+        node_backups = {
+            backup: self._storage.get_node_backup(fqdn=backup.fqdn, name=backup.name,
+                                                  differential_mode=backup.is_differential)
+            for backup in set(picked)
+        }
+        self._storage.prefetch_node_backups(node_backups.values(), manifest=True)
+
+        samples = []
+        for node_backup in (node_backups[backup] for backup in picked):
+            manifest = node_backup.read_manifest()
+            if manifest is None:
+                # purged since we listed it
+                self._forget(node_backup)
+                continue
+            tables = [table for table in manifest.tables() if table.size > 0]
+            if not tables:
+                continue
+            table = self._rng.choices(tables, weights=[table.size for table in tables])[0]
+            objects = [
+                obj for obj in manifest.section(table.keyspace, table.columnfamily)['objects']
+                # Statistics.db files get re-uploaded by later backups, they can legitimately differ
+                if obj['size'] > 0 and '-Statistics.db' not in obj['path']
+            ]
+            if objects:
+                samples.append((node_backup, self._rng.choices(objects, weights=[obj['size'] for obj in objects])[0]))
+        return samples
+
+    def _object_key(self, object_in_manifest) -> str:
+        return '{}{}'.format(
+            self._storage.storage_driver.get_path_prefix(object_in_manifest['path']), object_in_manifest['path']
+        )
+
+    def _check(self, samples) -> t.Iterator[t.Tuple[t.Any, dict, t.Optional[str]]]:
+        driver = self._storage.storage_driver
+        if self._read_objects:
+            for node_backup, obj in samples:
+                errors = self._deep_verification.verify_object(obj)
+                yield node_backup, obj, ', '.join(errors) if errors else None
+            return
+
+        blobs = driver.get_blobs([self._object_key(obj) for _, obj in samples])
+        for node_backup, obj in samples:
+            blob = blobs[self._object_key(obj)]
+            if blob is None:
+                yield node_backup, obj, "doesn't exist"
+            elif not driver.blob_matches_manifest(blob, obj, self._enable_md5_checks):
+                yield node_backup, obj, 'mismatches the manifest (size {}, hash {})'.format(blob.size, blob.hash)
+            else:
+                yield node_backup, obj, None
+
+    def audit(self, num_samples: int) -> AuditRound:
+        """
+        Checks num_samples random objects, adds the outcome to the totals and sends them to the monitoring.
+        """
+        sampled_objects, verified_bytes, corrupted = 0, 0, []
+        for node_backup, obj, error in self._check(self._sample(num_samples)):
+            if error is not None and node_backup.manifest_content is not None and \
+                    self._storage.storage_driver.get_blob(node_backup.manifest_path) is None:
+                logging.debug('Backup {} of {} got purged while being audited'.format(
+                    node_backup.name, node_backup.fqdn
+                ))
+                self._forget(node_backup)
+                continue
+            sampled_objects += 1
+            if error is None:
+                verified_bytes += obj['size']
+            elif '-Summary.db' in obj['path']:
+                logging.warning('Summary.db file {} {}, Cassandra can rewrite it'.format(obj['path'], error))
+            else:
+                logging.error('[{}/{}] {} {}'.format(node_backup.name, node_backup.fqdn, obj['path'], error))
+                corrupted.append('[{}] {} {}'.format(node_backup.name, obj['path'], error))
+
+        audit_round = AuditRound(sampled_objects, verified_bytes, corrupted)
+        self.totals.add(audit_round)
+        self._send_metrics()
+        return audit_round
+
+    def _send_metrics(self):
+        if self._monitoring is None:
+            return
+        fqdn = self._storage.config.fqdn
+        self._monitoring.send(['medusa-audit', 'sampled-objects', fqdn], self.totals.sampled_objects)
+        self._monitoring.send(['medusa-audit', 'verified-bytes', fqdn], self.totals.verified_bytes)
+        self._monitoring.send(['medusa-audit', 'corrupted-objects', fqdn], self.totals.corrupted_objects)
+
+
+def audit_backups(config, samples, interval, rounds, read_objects, enable_md5_checks_flag, max_bandwidth=None,
+                  push_metrics=False):
+    """
+    Keeps auditing random objects of the backups, one round of samples every interval seconds, until rounds rounds
+    ran or forever if rounds is 0.
+
+    :return: the AuditTotals
+    """
+    enable_md5 = enable_md5_checks_flag or medusa.utils.evaluate_boolean(config.checks.enable_md5_checks)
+    monitoring = Monitoring(config=config.monitoring) if push_metrics else None
+    totals = AuditTotals()
+    with Storage(config=config.storage) as storage:
+        if max_bandwidth:
+            bandwidth_limiter.set_limits(download_rate=AbstractStorage._human_size_to_bytes(max_bandwidth))
+        auditor = BackupAuditor(storage, totals, monitoring, read_objects=read_objects, enable_md5_checks=enable_md5)
+        done = 0
+        while rounds == 0 or done < rounds:
+            if done > 0:
+                time.sleep(interval)
+            audit_round = auditor.audit(samples)
+            done += 1
+            bound = totals.max_corrupted_fraction()
+            logging.info('Audit round {}: {} objects, {} verified, {} corrupted. So far: {} objects, {} verified, '
+                         '{} corrupted{}'.format(
+                             done, audit_round.sampled_objects,
+                             AbstractStorage.human_readable_size(audit_round.verified_bytes),
+                             len(audit_round.corrupted), totals.sampled_objects,
+                             AbstractStorage.human_readable_size(totals.verified_bytes), totals.corrupted_objects,
+                             '' if bound is None else ', less than {:.4%} of the data is corrupted ({:.0%} confidence)'
+                             .format(bound, CONFIDENCE)
+                         ))
+    return totals
@@ -33,6 +33,9 @@ from medusa.index import add_backup_start_to_index, add_backup_finish_to_index,
 from medusa.monitoring import Monitoring
 from medusa.storage import Storage, format_bytes_str, NodeBackup
 from medusa.storage.abstract_storage import ManifestObject
+from medusa.storage.backup_stats import BackupStats
+from medusa.storage.digest_cache import DigestCache
+from medusa.storage.manifest import Manifest, serialize_manifest
 
 
 def throttle_backup():
@@ -183,15 +186,20 @@ def start_backup(storage, node_backup, cassandra, differential_mode, stagger_tim
     enable_md5 = enable_md5_checks_flag or medusa.utils.evaluate_boolean(config.checks.enable_md5_checks)
     configured_md5_check_concurrency = int(config.checks.md5_check_concurrency or 0)
     md5_check_concurrency = max(configured_md5_check_concurrency, 1)
-    num_files, num_replaced, num_kept = do_backup(
-        cassandra, node_backup, storage, enable_md5, md5_check_concurrency, backup_name, keep_snapshot,
-        use_existing_snapshot
-    )
+    digest_cache = DigestCache(config.checks.md5_cache_file) if enable_md5 and config.checks.md5_cache_file else None
+    try:
+        num_files, num_replaced, num_kept = do_backup(
+            cassandra, node_backup, storage, enable_md5, md5_check_concurrency, backup_name, keep_snapshot,
+            use_existing_snapshot, digest_cache
+        )
+    finally:
+        if digest_cache is not None:
+            digest_cache.close()
     end = datetime.datetime.now()
     actual_backup_duration = end - actual_start
 
     print_backup_stats(actual_backup_duration, actual_start, end, node_backup, num_files, num_replaced, num_kept, start)
-    update_monitoring(actual_backup_duration, backup_name, monitoring, node_backup)
+    update_monitoring(actual_backup_duration, backup_name, monitoring, node_backup, storage.transfer_concurrency)
     return {
         "actual_backup_duration": actual_backup_duration,
         "actual_start_time": actual_start,
@@ -223,7 +231,7 @@ def get_server_type_and_version(cassandra):
 
 
 def do_backup(cassandra, node_backup, storage, enable_md5_checks, md5_check_concurrency, backup_name,
-              keep_snapshot=False, use_existing_snapshot=False):
+              keep_snapshot=False, use_existing_snapshot=False, digest_cache=None):
 
     if use_existing_snapshot:
         logging.debug('Skipping snapshot creation')
@@ -238,24 +246,32 @@ def do_backup(cassandra, node_backup, storage, enable_md5_checks, md5_check_conc
     # this is not too good and we will use just one snapshot in the future
     with snapshot:
         manifest = []
-        num_files, num_replaced, num_kept = backup_snapshots(
-            storage, manifest, node_backup, snapshot, enable_md5_checks, md5_check_concurrency
+        num_files, num_replaced, num_kept, reused_size = backup_snapshots(
+            storage, manifest, node_backup, snapshot, enable_md5_checks, md5_check_concurrency, digest_cache
         )
 
     if node_backup.is_dse_6:
         logging.info('Creating DSE snapshot')
         with cassandra.create_dse_snapshot(backup_name) as snapshot:
-            dse_num_files, dse_replaced, dse_kept = backup_snapshots(
-                storage, manifest, node_backup, snapshot, enable_md5_checks, md5_check_concurrency
+            dse_num_files, dse_replaced, dse_kept, dse_reused_size = backup_snapshots(
+                storage, manifest, node_backup, snapshot, enable_md5_checks, md5_check_concurrency, digest_cache
             )
             num_files += dse_num_files
             num_replaced += dse_replaced
             num_kept += dse_kept
+            reused_size += dse_reused_size
 
     logging.info('Updating backup index')
-    node_backup.manifest = json.dumps(manifest)
+    manifest_content = serialize_manifest(manifest, storage.manifest_format)
+    node_backup.manifest = manifest_content
+    node_backup.cached_stats = BackupStats.from_manifest(Manifest(manifest_content), reused_size=reused_size)
     add_backup_finish_to_index(storage, node_backup)
     set_latest_backup_in_index(storage, node_backup)
+    try:
+        storage.backup_catalog.maybe_compact()
+    except Exception as e:
+        # the segments stay around, the next compaction will merge them
+        logging.warning('Could not compact the backup catalog: {}'.format(e))
     return num_files, num_replaced, num_kept
 
 
@@ -287,7 +303,7 @@ def print_backup_stats(
         ))
 
 
-def update_monitoring(actual_backup_duration, backup_name, monitoring, node_backup):
+def update_monitoring(actual_backup_duration, backup_name, monitoring, node_backup, transfer_concurrency):
     logging.debug('Emitting metrics')
 
     tags = ['medusa-node-backup', 'backup-duration', backup_name]
@@ -296,17 +312,22 @@ def update_monitoring(actual_backup_duration, backup_name, monitoring, node_back
     tags = ['medusa-node-backup', 'backup-size', backup_name]
     monitoring.send(tags, node_backup.size())
 
+    tags = ['medusa-node-backup', 'concurrent-transfers', backup_name]
+    monitoring.send(tags, transfer_concurrency)
+
     tags = ['medusa-node-backup', 'backup-error', backup_name]
     monitoring.send(tags, 0)
 
     logging.debug('Done emitting metrics')
 
 
-def backup_snapshots(storage, manifest, node_backup, snapshot, enable_md5_checks, md5_check_concurrency):
+def backup_snapshots(storage, manifest, node_backup, snapshot, enable_md5_checks, md5_check_concurrency,
+                     digest_cache=None):
     try:
         num_files = 0
         replaced = 0
         kept = 0
+        reused_size = 0
         multipart_threshold = storage.config.multi_part_upload_threshold
         multipart_chunksize = storage.config.multipart_chunksize
 
@@ -316,36 +337,53 @@ def backup_snapshots(storage, manifest, node_backup, snapshot, enable_md5_checks
         else:
             files_in_storage = {}
 
-        for snapshot_path in snapshot.find_dirs():
-            fqtn = f"{snapshot_path.keyspace}.{snapshot_path.columnfamily}"
-            logging.info(f"Backing up {fqtn}")
-
-            needs_backup, needs_reupload, already_backed_up = check_already_uploaded(
-                storage=storage,
-                node_backup=node_backup,
-                files_in_storage=files_in_storage,
-                multipart_threshold=multipart_threshold,
-                multipart_chunksize=multipart_chunksize,
-                enable_md5_checks=enable_md5_checks,
-                md5_check_concurrency=md5_check_concurrency,
-                keyspace=snapshot_path.keyspace,
-                srcs=list(snapshot_path.list_files()),
-                fqtn=fqtn)
-
-            replaced += len(needs_reupload)
-            kept += len(already_backed_up)
-            num_files += len(needs_backup) + len(needs_reupload)
-
-            dst_path = str(node_backup.datapath(
-                keyspace=snapshot_path.keyspace,
-                columnfamily=snapshot_path.columnfamily)
-            )
-            logging.debug("Snapshot destination path: {}".format(dst_path))
+        # tables whose files are queued for upload, in the order they got queued.
+        # their manifest sections are put together once all the uploads are done
+        queued_tables = []
+
+        def tables_to_upload():
+            nonlocal num_files, replaced, kept
+            for snapshot_path in snapshot.find_dirs():
+                fqtn = f"{snapshot_path.keyspace}.{snapshot_path.columnfamily}"
+                logging.info(f"Backing up {fqtn}")
+
+                needs_backup, needs_reupload, already_backed_up = check_already_uploaded(
+                    storage=storage,
+                    node_backup=node_backup,
+                    files_in_storage=files_in_storage,
+                    multipart_threshold=multipart_threshold,
+                    multipart_chunksize=multipart_chunksize,
+                    enable_md5_checks=enable_md5_checks,
+                    md5_check_concurrency=md5_check_concurrency,
+                    keyspace=snapshot_path.keyspace,
+                    srcs=list(snapshot_path.list_files()),
+                    fqtn=fqtn,
+                    digest_cache=digest_cache)
+
+                replaced += len(needs_reupload)
+                kept += len(already_backed_up)
+                num_files += len(needs_backup) + len(needs_reupload)
+
+                dst_path = str(node_backup.datapath(
+                    keyspace=snapshot_path.keyspace,
+                    columnfamily=snapshot_path.columnfamily)
+                )
+                logging.debug("Snapshot destination path: {}".format(dst_path))
+
+                srcs_to_upload = needs_backup + needs_reupload
+                queued_tables.append((snapshot_path, fqtn, srcs_to_upload, needs_reupload, already_backed_up))
+                yield srcs_to_upload, dst_path
+
+        # a single upload queue for all the tables, fed as soon as each table has been checked.
+        # this way concurrent_transfers applies to the whole node rather than to each table separately
+        uploaded_per_table = storage.storage_driver.upload_blobs_in_batches(tables_to_upload())
+
+        for (snapshot_path, fqtn, srcs_to_upload, needs_reupload, already_backed_up), uploaded in zip(
+                queued_tables, uploaded_per_table):
+            manifest_objects = list(uploaded)
 
-            manifest_objects = []
-            needs_upload = needs_backup + needs_reupload
-            if len(needs_upload) > 0:
-                manifest_objects += storage.storage_driver.upload_blobs(needs_upload, dst_path)
+            if node_backup.is_differential:
+                storage.record_uploaded_objects(manifest_objects)
 
             # inform about fixing backups
             if len(needs_reupload) > 0:
@@ -360,10 +398,11 @@ def backup_snapshots(storage, manifest, node_backup, snapshot, enable_md5_checks
                 )
                 for obj in already_backed_up:
                     manifest_objects.append(obj)
+                    reused_size += obj.size
 
             manifest.append(make_manifest_object(node_backup.fqdn, snapshot_path, manifest_objects, storage))
 
-        return num_files, replaced, kept
+        return num_files, replaced, kept, reused_size
     except Exception as e:
         logging.error('Error occurred during backup: {}'.format(str(e)))
         traceback.print_exc()
@@ -380,7 +419,8 @@ def check_already_uploaded(
         files_in_storage: t.Dict[str, t.Dict[str, t.Dict[str, ManifestObject]]],
         keyspace: str,
         srcs: t.List[pathlib.Path],
-        fqtn: str
+        fqtn: str,
+        digest_cache: t.Optional[DigestCache] = None
 ) -> tuple[t.List[pathlib.Path], t.List[pathlib.Path], t.List[ManifestObject]]:
 
     NEVER_BACKED_UP = ['manifest.json', 'schema.cql']
@@ -399,6 +439,7 @@ def check_already_uploaded(
     # enable_md5_checks is on) against the manifest. That's local disk/CPU work with no network
     # involved, so it's fanned out across threads rather than done one file at a time - with
     # differential backups that serial loop was a barrier blocking every upload for the table.
+    # With a digest cache, files that did not change since a previous backup are not even read again.
     to_compare = []
     for src in srcs:
         if src.name in NEVER_BACKED_UP:
@@ -425,7 +466,8 @@ def check_already_uploaded(
             futures = {
                 executor.submit(
                     storage_driver.file_matches_storage,
-                    src, item_in_storage, multipart_threshold, enable_md5_checks, multipart_chunksize
+                    src, item_in_storage, multipart_threshold, enable_md5_checks, multipart_chunksize,
+                    digest_cache=digest_cache
                 ): (src, item_in_storage)
                 for src, item_in_storage in to_compare
             }
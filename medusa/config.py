@@ -23,6 +23,7 @@ import sys
 
 import medusa.cassandra_utils
 import medusa.storage
+from medusa.storage.manifest import MANIFEST_FORMATS
 from medusa.utils import evaluate_boolean
 from medusa.network.hostname_resolver import HostnameResolver
 
@@ -30,10 +31,14 @@ StorageConfig = collections.namedtuple(
     'StorageConfig',
     ['bucket_name', 'key_file', 'prefix', 'fqdn', 'host_file_separator', 'storage_provider', 'storage_class',
      'base_path', 'max_backup_age', 'max_backup_count', 'api_profile', 'transfer_max_bandwidth',
-     'concurrent_transfers', 'multi_part_upload_threshold', 'multipart_chunksize', 'multipart_max_concurrency',
+     'transfer_max_upload_bandwidth', 'transfer_max_download_bandwidth',
+     'concurrent_transfers', 'adaptive_concurrency', 'max_concurrent_transfers', 'multi_part_upload_threshold',
+     'manifest_format',
+     'multipart_chunksize', 'multipart_max_concurrency',
      'host', 'region', 'port', 'secure',
      'ssl_verify', 'aws_cli_path', 'kms_id', 'sse_c_key', 'backup_grace_period_in_days', 'use_sudo_for_restore',
-     'k8s_mode', 'read_timeout', 's3_addressing_style']
+     'k8s_mode', 'read_timeout', 's3_addressing_style', 'uploaded_objects_cache_file',
+     'uploaded_objects_cache_reconcile_interval_in_hours']
 )
 
 CassandraConfig = collections.namedtuple(
@@ -52,7 +57,8 @@ SSHConfig = collections.namedtuple(
 
 ChecksConfig = collections.namedtuple(
     'ChecksConfig',
-    ['health_check', 'query', 'expected_rows', 'expected_result', 'enable_md5_checks', 'md5_check_concurrency']
+    ['health_check', 'query', 'expected_rows', 'expected_result', 'enable_md5_checks', 'md5_check_concurrency',
+     'md5_cache_file']
 )
 
 MonitoringConfig = collections.namedtuple(
@@ -111,7 +117,12 @@ def _build_default_config():
         'max_backup_count': '0',
         'api_profile': '',
         'transfer_max_bandwidth': '50MB/s',
+        'transfer_max_upload_bandwidth': '',
+        'transfer_max_download_bandwidth': '',
         'concurrent_transfers': '1',
+        'adaptive_concurrency': 'False',
+        'max_concurrent_transfers': '16',
+        'manifest_format': 'json',
         'multi_part_upload_threshold': '20MB',
         'secure': 'True',
         'ssl_verify': 'False',      # False until we work out how to specify custom certs
@@ -123,6 +134,8 @@ def _build_default_config():
         'multipart_chunksize': '50MB',
         'multipart_max_concurrency': '4',
         's3_addressing_style': 'auto',
+        'uploaded_objects_cache_file': '',
+        'uploaded_objects_cache_reconcile_interval_in_hours': '24',
     }
 
     config['logging'] = {
@@ -163,7 +176,8 @@ def _build_default_config():
         'expected_rows': '0',
         'expected_result': '',
         'enable_md5_checks': 'false',
-        'md5_check_concurrency': '1'
+        'md5_check_concurrency': '1',
+        'md5_cache_file': '',
     }
 
     config['monitoring'] = {
@@ -361,6 +375,12 @@ def load_config(args, config_file):
             logging.error('Required configuration "{}" is missing in [storage] section.'.format(field))
             sys.exit(2)
 
+    if medusa_config.storage.manifest_format not in MANIFEST_FORMATS:
+        logging.error('Configuration "manifest_format" of the [storage] section must be one of {}.'.format(
+            MANIFEST_FORMATS
+        ))
+        sys.exit(2)
+
     for field in ['start_cmd', 'stop_cmd']:
         if getattr(medusa_config.cassandra, field) is None:
             logging.error('Required configuration "{}" is missing in [cassandra] section.'.format(field))
@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import base64
+import binascii
+import collections
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import struct
+import time
+import typing as t
+import zlib
+
+from medusa.storage.abstract_storage import AbstractStorage, DEFAULT_MULTIPART_PART_SIZE_BYTES
+
+PROGRESS_VERSION = 1
+# how often (in seconds) the progress file gets written while a deep verification runs
+PROGRESS_SAVE_INTERVAL = 30
+MULTIPART_MD5_PATTERN = re.compile(r'^([0-9a-fA-F]{32})-(\d+)$')
+
+CompressionInfo = collections.namedtuple('CompressionInfo', ['compressor', 'chunk_length', 'data_length', 'offsets'])
+
+
+def parse_compression_info(content: bytes) -> CompressionInfo:
+    """
+    Parses the CompressionInfo.db component of an SSTable.
+
+    Its layout is the compressor class name, its options, the chunk length, the maximum compressed length (only
+    since the 'na' format of Cassandra 4.0), the uncompressed data length and the offsets of the chunks in Data.db.
+    The format version is not in the file, so both layouts are tried and the one accounting for every byte wins.
+
+    :raise ValueError: if the content matches none of the layouts
+    """
+    def read_utf(position):
+        (length,) = struct.unpack_from('>H', content, position)
+        end = position + 2 + length
+        if end > len(content):
+            raise struct.error('string goes past the end of the content')
+        return content[position + 2:end].decode('utf-8', errors='replace'), end
+
+    try:
+        compressor, position = read_utf(0)
+        (num_options,) = struct.unpack_from('>i', content, position)
+        position += 4
+        for _ in range(num_options):
+            _, position = read_utf(position)
+            _, position = read_utf(position)
+        (chunk_length,) = struct.unpack_from('>i', content, position)
+        position += 4
+    except struct.error as e:
+        raise ValueError('Malformed CompressionInfo: {}'.format(e))
+
+    for header in ['>qi', '>iqi']:
+        header_size = struct.calcsize(header)
+        if position + header_size > len(content):
+            continue
+        *_, data_length, chunk_count = struct.unpack_from(header, content, position)
+        offsets_position = position + header_size
+        if chunk_count < 0 or offsets_position + 8 * chunk_count != len(content):
+            continue
+        offsets = list(struct.unpack_from('>{}q'.format(chunk_count), content, offsets_position))
+        return CompressionInfo(compressor, chunk_length, data_length, offsets)
+
+    raise ValueError('Malformed CompressionInfo: the chunk offsets do not match the size of the file')
+
+
+class CompressedChunksChecker(object):
+    """
+    Checks the CRC32 stored after each chunk of a compressed Data.db, as the content of the file streams by.
+    """
+
+    def __init__(self, compression_info: CompressionInfo, data_size: int):
+        self.errors = []
+        self.num_corrupted_chunks = 0
+        offsets = compression_info.offsets
+        self._ends = offsets[1:] + [data_size]
+        if offsets and offsets[0] != 0:
+            self.errors.append('the first compressed chunk starts at {}'.format(offsets[0]))
+        if any(end - start < 4 for start, end in zip(offsets, self._ends)):
+            self.errors.append('the compressed chunk offsets do not fit the size of Data.db')
+        if compression_info.chunk_length > 0 and \
+                len(offsets) != math.ceil(compression_info.data_length / compression_info.chunk_length):
+            self.errors.append('{} compressed chunks can not hold {} bytes'.format(
+                len(offsets), compression_info.data_length
+            ))
+        # when the offsets make no sense, chunks would not be checked where they are
+        self._valid_offsets = not self.errors
+        self._chunk = 0
+        self._position = 0
+        self._partial = bytearray()
+
+    def update(self, data: bytes):
+        if not self._valid_offsets:
+            return
+        view = memoryview(data)
+        while view and self._chunk < len(self._ends):
+            needed = self._ends[self._chunk] - self._position - len(self._partial)
+            piece, view = view[:needed], view[needed:]
+            if len(piece) < needed:
+                self._partial += piece
+                return
+            chunk = self._partial + piece if self._partial else piece
+            (expected,) = struct.unpack('>I', chunk[-4:])
+            if zlib.crc32(chunk[:-4]) != expected:
+                if self.num_corrupted_chunks == 0:
+                    self.errors.append('compressed chunk at offset {} does not match its checksum'.format(
+                        self._position
+                    ))
+                self.num_corrupted_chunks += 1
+            self._position = self._ends[self._chunk]
+            self._partial = bytearray()
+            self._chunk += 1
+
+    def finish(self) -> t.List[str]:
+        if self.num_corrupted_chunks > 1:
+            self.errors.append('{} compressed chunks do not match their checksum'.format(self.num_corrupted_chunks))
+        return self.errors
+
+
+def multipart_part_sizes(size: int, num_parts: int, configured_part_size: t.Optional[int] = None) -> t.List[int]:
+    """
+    Guesses the part sizes a multipart upload could have used to split an object of the given size in num_parts.
+
+    The part size is not recorded anywhere, so this tries the configured one, the default one, and the smallest
+    multiple of a MiB giving that many parts. Part sizes giving one part less are kept when they divide the size,
+    because md5_multipart() then counts an empty last part.
+    """
+    mib = 1024 * 1024
+    candidates = [configured_part_size, DEFAULT_MULTIPART_PART_SIZE_BYTES]
+    if num_parts > 0:
+        candidates.append(max(math.ceil(size / num_parts / mib), 1) * mib)
+
+    part_sizes = []
+    for part_size in candidates:
+        if not part_size or part_size in part_sizes:
+            continue
+        if math.ceil(size / part_size) == num_parts or (size % part_size == 0 and size // part_size == num_parts - 1):
+            part_sizes.append(part_size)
+    return part_sizes
+
+
+class MultipartMD5(object):
+    """
+    Computes the multipart digests of a stream for a given part size, the way md5_multipart() and S3 ETags do.
+    """
+
+    def __init__(self, part_size: int):
+        self.part_size = part_size
+        self._part = hashlib.md5()
+        self._part_length = 0
+        self._digests = []
+
+    def update(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            piece, view = view[:self.part_size - self._part_length], view[self.part_size - self._part_length:]
+            self._part.update(piece)
+            self._part_length += len(piece)
+            if self._part_length == self.part_size:
+                self._digests.append(self._part.digest())
+                self._part = hashlib.md5()
+                self._part_length = 0
+
+    def hexdigests(self) -> t.List[str]:
+        digests = self._digests + ([self._part.digest()] if self._part_length > 0 or not self._digests else [])
+        hexdigests = ['{}-{}'.format(hashlib.md5(b''.join(digests)).hexdigest(), len(digests))]
+        if self._part_length == 0 and self._digests:
+            # md5_multipart() adds an empty part when the size is a multiple of the part size
+            digests = self._digests + [hashlib.md5().digest()]
+            hexdigests.append('{}-{}'.format(hashlib.md5(b''.join(digests)).hexdigest(), len(digests)))
+        return hexdigests
+
+
+class ObjectChecksums(object):
+    """
+    Recomputes the checksums of an object as its content streams by, to compare them with the expected ones.
+    """
+
+    def __init__(
+            self,
+            size: int,
+            expected_md5: t.Optional[str],
+            configured_part_size: t.Optional[int] = None,
+            expected_crc32: t.Optional[int] = None,
+            compression_info: t.Optional[CompressionInfo] = None,
+    ):
+        self.size = size
+        self.expected_md5 = expected_md5
+        self.expected_crc32 = expected_crc32
+        self._length = 0
+        self._md5 = None
+        self._multipart = []
+        self._crc32 = 0
+        self._chunks = CompressedChunksChecker(compression_info, size) if compression_info is not None else None
+
+        multipart = MULTIPART_MD5_PATTERN.match(expected_md5 or '')
+        if multipart is not None:
+            part_sizes = multipart_part_sizes(size, int(multipart.group(2)), configured_part_size)
+            self._multipart = [MultipartMD5(part_size) for part_size in part_sizes]
+            if not part_sizes:
+                logging.warning('Unable to guess the part size of a {} bytes object uploaded in {} parts'.format(
+                    size, multipart.group(2)
+                ))
+        elif self._is_md5(expected_md5):
+            self._md5 = hashlib.md5()
+
+    @staticmethod
+    def _is_md5(digest: t.Optional[str]) -> bool:
+        if not digest:
+            return False
+        if re.match(r'^[0-9a-fA-F]{32}$', digest):
+            return True
+        try:
+            return len(base64.b64decode(digest, validate=True)) == 16
+        except (binascii.Error, ValueError):
+            return False
+
+    def verifies_md5(self) -> bool:
+        """
+        Whether the expected MD5 is one this can recompute, as a plain or a multipart MD5.
+        """
+        return self._md5 is not None or bool(self._multipart)
+
+    def update(self, data: bytes):
+        self._length += len(data)
+        if self._md5 is not None:
+            self._md5.update(data)
+        for multipart in self._multipart:
+            multipart.update(data)
+        if self.expected_crc32 is not None:
+            self._crc32 = zlib.crc32(data, self._crc32)
+        if self._chunks is not None:
+            self._chunks.update(data)
+
+    def errors(self) -> t.List[str]:
+        if self._length != self.size:
+            return ['read {} bytes instead of {}'.format(self._length, self.size)]
+
+        errors = []
+        if self._md5 is not None and not AbstractStorage.hashes_match(self.expected_md5, self._md5.hexdigest()):
+            errors.append('MD5 is {} instead of {}'.format(self._md5.hexdigest(), self.expected_md5))
+        if self._multipart:
+            actual = [hexdigest for multipart in self._multipart for hexdigest in multipart.hexdigests()]
+            if self.expected_md5.lower() not in actual:
+                errors.append('multipart MD5 is {} instead of {}'.format(actual[0], self.expected_md5))
+        if self.expected_crc32 is not None and self._crc32 != self.expected_crc32:
+            errors.append('CRC32 is {} instead of {} from Digest.crc32'.format(self._crc32, self.expected_crc32))
+        if self._chunks is not None:
+            errors.extend(self._chunks.finish())
+        return errors
+
+
+class DeepVerificationProgress(object):
+    """
+    The objects of backups a deep verification already read, kept in a local file so the next verification of the
+    same backup picks up where the previous one stopped. Without a file, the progress only lasts for the run.
+    """
+
+    def __init__(self, path: t.Optional[str] = None, clock: t.Callable[[], float] = time.monotonic):
+        self._path = path
+        self._clock = clock
+        self._last_save = clock()
+        self._backups = {}
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as f:
+                progress = json.load(f)
+            if progress.get('version') != PROGRESS_VERSION:
+                raise ValueError('Unsupported deep verification progress version {}'.format(progress.get('version')))
+            self._backups = {name: set(paths) for name, paths in progress['backups'].items()}
+
+    def is_done(self, backup_name: str, path: str) -> bool:
+        return path in self._backups.get(backup_name, ())
+
+    def mark_done(self, backup_name: str, path: str):
+        self._backups.setdefault(backup_name, set()).add(path)
+        if self._clock() - self._last_save >= PROGRESS_SAVE_INTERVAL:
+            self.save()
+
+    def num_done(self, backup_name: str) -> int:
+        return len(self._backups.get(backup_name, ()))
+
+    def restart(self, backup_name: str):
+        """
+        Forgets about the objects of a backup, so its next deep verification reads them all again.
+        """
+        self._backups.pop(backup_name, None)
+
+    def save(self):
+        self._last_save = self._clock()
+        if self._path is None:
+            return
+        content = {
+            'version': PROGRESS_VERSION,
+            'backups': {name: sorted(paths) for name, paths in self._backups.items()},
+        }
+        # an interrupted write must not lose the progress made so far
+        tmp_path = '{}.tmp'.format(self._path)
+        with open(tmp_path, 'w') as f:
+            json.dump(content, f)
+        os.replace(tmp_path, self._path)
+
+
+class DeepVerification(object):
+    """
+    Reads back the objects of node backups and checks their content: MD5 against the manifest, and optionally the
+    Digest.crc32 and the compressed chunk checksums of SSTables.
+
+    Objects are read one at a time, each of them with several ranged requests in flight, under the download
+    bandwidth limit. Giving a max_size stops the verification once that many bytes were read, the progress then
+    tells where the next one should resume. Once every object of a backup got verified, its progress restarts.
+    """
+
+    def __init__(
+            self,
+            storage,
+            progress: DeepVerificationProgress,
+            check_sstables: bool = False,
+            max_size: t.Optional[int] = None
+    ):
+        self._storage = storage
+        self._progress = progress
+        self._check_sstables = check_sstables
+        self._max_size = max_size
+        self._connections = max(int(storage.config.concurrent_transfers), 1)
+        multipart_chunksize = getattr(storage.config, 'multipart_chunksize', None)
+        self._configured_part_size = AbstractStorage._human_size_to_bytes(str(multipart_chunksize)) \
+            if multipart_chunksize else None
+        self.num_objects = 0
+        self.size = 0
+        self.complete = False
+
+    def _object_key(self, object_in_manifest) -> str:
+        return '{}{}'.format(
+            self._storage.storage_driver.get_path_prefix(object_in_manifest['path']), object_in_manifest['path']
+        )
+
+    def verify(self, node_backups) -> t.Iterator[t.Tuple[t.Any, str]]:
+        """
+        Deep verifies node backups, one after the other.
+
+        :return: iterable of (node backup, error) as errors are found
+        """
+        node_backups = sorted(node_backups, key=lambda node_backup: node_backup.fqdn)
+        backup_name = node_backups[0].name if node_backups else None
+        try:
+            for node_backup in node_backups:
+                for error in self._verify_node_backup(node_backup):
+                    yield node_backup, error
+                if self._budget_exhausted():
+                    return
+            self.complete = True
+            logging.info('Every object of backup {} got deep verified, the next verification starts over'.format(
+                backup_name
+            ))
+            self._progress.restart(backup_name)
+        finally:
+            self._progress.save()
+
+    def _budget_exhausted(self) -> bool:
+        return self._max_size is not None and self.size >= self._max_size
+
+    def _verify_node_backup(self, node_backup) -> t.Iterator[str]:
+        try:
+            manifest = node_backup.read_manifest()
+        except Exception:
+            logging.error('Unable to read manifest of {} from storage'.format(node_backup.fqdn))
+            yield '  - [{}] Unable to read the manifest'.format(node_backup.fqdn)
+            return
+
+        objects = {}
+        for columnfamily_manifest in manifest:
+            for obj in columnfamily_manifest['objects']:
+                # Statistics.db files get re-uploaded by later backups, their content can legitimately change
+                if '-Statistics.db' not in obj['path']:
+                    objects[obj['path']] = obj
+
+        for path in sorted(objects):
+            if self._budget_exhausted():
+                return
+            if self._progress.is_done(node_backup.name, path):
+                continue
+            errors = self.verify_object(objects[path], objects)
+            self.num_objects += 1
+            self.size += objects[path]['size']
+            self._progress.mark_done(node_backup.name, path)
+            if errors and '-Summary.db' in path:
+                logging.warning('Summary.db file {} mismatches the manifest ({}), Cassandra can rewrite it'.format(
+                    path, ', '.join(errors)
+                ))
+                continue
+            for error in errors:
+                yield '  - [{}] {}'.format(path, error)
+
+    def _sstable_checksums(self, path: str, objects) -> t.Tuple[t.Optional[int], t.Optional[CompressionInfo]]:
+        """
+        Reads the Digest.crc32 and CompressionInfo.db of the SSTable of a Data.db, when they were backed up.
+
+        Digest.crc32 only exists since Cassandra 3.0, whose compressed chunks are all checksummed with CRC32, so
+        chunks only get checked for SSTables having one.
+        """
+        if not self._check_sstables or not path.endswith('-Data.db'):
+            return None, None
+        digest = objects.get(path[:-len('Data.db')] + 'Digest.crc32')
+        if digest is None:
+            return None, None
+        driver = self._storage.storage_driver
+        expected_crc32 = int(driver.get_blob_content_as_string(self._object_key(digest)).strip())
+        compression_info = objects.get(path[:-len('Data.db')] + 'CompressionInfo.db')
+        if compression_info is None:
+            return expected_crc32, None
+        return expected_crc32, parse_compression_info(
+            driver.get_blob_content_as_bytes(self._object_key(compression_info))
+        )
+
+    def verify_object(self, object_in_manifest, objects=None) -> t.List[str]:
+        """
+        Reads an object back and checks it, giving the problems found.
+
+        :param objects: the other objects of the node backup by path, where the checksum components of SSTables
+        get looked up
+        """
+        path = object_in_manifest['path']
+        objects = objects or {}
+        try:
+            expected_crc32, compression_info = self._sstable_checksums(path, objects)
+        except Exception as e:
+            logging.error('Unable to read the checksums of {}: {}'.format(path, e))
+            return ['unable to read the SSTable checksums: {}'.format(e)]
+
+        checksums = ObjectChecksums(
+            object_in_manifest['size'], object_in_manifest['MD5'], self._configured_part_size,
+            expected_crc32=expected_crc32, compression_info=compression_info
+        )
+        try:
+            for data in self._storage.storage_driver.stream_blob(
+                    self._object_key(object_in_manifest), object_in_manifest['size'], connections=self._connections
+            ):
+                checksums.update(data)
+        except Exception as e:
+            logging.error('Unable to read {}: {}'.format(path, e))
+            return ['unable to read: {}'.format(e)]
+        return checksums.errors()
@@ -14,7 +14,6 @@
 # limitations under the License.
 
 import logging
-import json
 import pathlib
 import shutil
 import sys
@@ -22,52 +21,70 @@ import sys
 from medusa.storage import Storage
 from medusa.storage.abstract_storage import AbstractStorage
 from medusa.filtering import filter_fqtns
+from medusa.storage.manifest import Manifest
 
 
-def download_data(storageconfig, backup, fqtns_to_restore, destination):
+def download_data(storageconfig, backup, fqtns_to_restore, destination, local_objects=None):
 
-    manifest = json.loads(backup.manifest)
+    manifest = backup.read_manifest()
 
     _check_available_space(manifest, destination)
 
     with Storage(config=storageconfig) as storage:
 
-        for section in manifest:
-
-            fqtn = "{}.{}".format(section['keyspace'], section['columnfamily'])
-            dst = destination / section['keyspace'] / section['columnfamily']
-            srcs = ['{}{}'.format(storage.storage_driver.get_path_prefix(backup.data_path), obj['path'])
-                    for obj in section['objects']]
-
-            if len(srcs) > 0 and (len(fqtns_to_restore) == 0 or fqtn in fqtns_to_restore):
-                logging.debug('Downloading  %s files to %s', len(srcs), dst)
-
-                dst.mkdir(parents=True)
-
-                # check for hidden sub-folders in the table directory
-                # (e.g. secondary indices which live in table/.table_idx)
-                dst_subfolders = {dst / src.parent.name
-                                  for src in map(pathlib.Path, srcs)
-                                  if src.parent.name.startswith('.')}
-                # create the sub-folders so the downloads actually work
-                for subfolder in dst_subfolders:
-                    subfolder.mkdir(parents=False)
-
-                storage.storage_driver.download_blobs(srcs, dst)
-
-            elif len(srcs) == 0 and (len(fqtns_to_restore) == 0 or fqtn in fqtns_to_restore):
-                logging.debug('There is nothing to download for {}'.format(fqtn))
-            else:
-                logging.debug('Download of {} was not requested, skipping'.format(fqtn))
-
-        logging.info('Downloading backup metadata...')
-        storage.storage_driver.download_blobs(
-            srcs=['{}'.format(path)
-                  for path in [backup.manifest_path,
-                               backup.schema_path,
-                               backup.tokenmap_path]],
-            dest=destination
-        )
+        # with a compact manifest, only the tables we download get decoded
+        for section in manifest.sections(fqtns_to_restore if len(fqtns_to_restore) > 0 else None):
+            download_section(storage, backup, section, destination / section['keyspace'] / section['columnfamily'],
+                             local_objects)
+
+        download_metadata(storage, backup, destination)
+
+
+def download_section(storage, backup, section, dst, local_objects=None):
+    """
+    Downloads the objects of a section of the manifest to the dst folder. With local_objects, the objects that have a
+    local copy get hard-linked from it instead, see LocalObjects.
+    """
+    fqtn = "{}.{}".format(section['keyspace'], section['columnfamily'])
+    objects = section['objects']
+
+    if len(objects) > 0:
+        dst.mkdir(parents=True, exist_ok=True)
+
+        # check for hidden sub-folders in the table directory
+        # (e.g. secondary indices which live in table/.table_idx)
+        dst_subfolders = {dst / src.parent.name
+                          for src in map(lambda obj: pathlib.Path(obj['path']), objects)
+                          if src.parent.name.startswith('.')}
+        # create the sub-folders so the downloads actually work
+        for subfolder in dst_subfolders:
+            subfolder.mkdir(parents=False, exist_ok=True)
+
+        if local_objects is not None:
+            objects = local_objects.link_section(section, dst)
+            if len(objects) < len(section['objects']):
+                logging.debug('Reused %s local files for %s', len(section['objects']) - len(objects), fqtn)
+
+    srcs = ['{}{}'.format(storage.storage_driver.get_path_prefix(backup.data_path), obj['path'])
+            for obj in objects]
+
+    if len(srcs) > 0:
+        logging.debug('Downloading  %s files to %s', len(srcs), dst)
+        storage.storage_driver.download_blobs(srcs, dst)
+
+    else:
+        logging.debug('There is nothing to download for {}'.format(fqtn))
+
+
+def download_metadata(storage, backup, destination):
+    logging.info('Downloading backup metadata...')
+    storage.storage_driver.download_blobs(
+        srcs=['{}'.format(path)
+              for path in [backup.manifest_path,
+                           backup.schema_path,
+                           backup.tokenmap_path]],
+        dest=destination
+    )
 
 
 def download_cmd(config, backup_name, download_destination, keyspaces, tables, ignore_system_keyspaces):
@@ -83,12 +100,12 @@ def download_cmd(config, backup_name, download_destination, keyspaces, tables, i
             logging.error('No such backup')
             sys.exit(1)
 
-        fqtns_to_download, _ = filter_fqtns(keyspaces, tables, node_backup.manifest, ignore_system_keyspaces)
+        fqtns_to_download, _ = filter_fqtns(keyspaces, tables, node_backup.read_manifest(), ignore_system_keyspaces)
         download_data(config.storage, node_backup, fqtns_to_download, download_destination)
 
 
-def _check_available_space(manifest, destination):
-    download_size = _get_download_size(manifest)
+def _check_available_space(manifest, destination, fqtns=None):
+    download_size = _get_download_size(manifest, fqtns)
     available_space = _get_available_size(destination)
     logging.debug(f'Download size: {download_size}, available space: {available_space}')
     if download_size > available_space:
@@ -104,8 +121,11 @@ def _check_available_space(manifest, destination):
         raise RuntimeError('Not enough space available')
 
 
-def _get_download_size(manifest):
-    return sum([int(obj['size']) for section in manifest for obj in section['objects']])
+def _get_download_size(manifest, fqtns=None):
+    if isinstance(manifest, Manifest):
+        return manifest.size(fqtns)
+    return sum([int(obj['size']) for section in manifest for obj in section['objects']
+                if fqtns is None or '{}.{}'.format(section['keyspace'], section['columnfamily']) in fqtns])
 
 
 def _get_available_size(destination_dir):
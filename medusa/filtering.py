@@ -14,22 +14,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
+from medusa.storage.manifest import Manifest
 
 
 def filter_fqtns(keep_keyspaces, keep_tables, manifest, ignore_system_keyspaces=False):
     retained = set()
     ignored = set()
-    manifest = json.loads(manifest)
+    # only the table index of the manifest is needed here, not the objects
+    if not isinstance(manifest, Manifest):
+        manifest = Manifest(manifest)
 
-    for section in manifest:
-        ks = section['keyspace']
+    for table in manifest.tables():
+        ks = table.keyspace
         # in manifest, the table names have cfids, but from CLI we get it without
         # we need to take care and use both
-        t = section['columnfamily'].split('-')[0]
+        t = table.columnfamily.split('-')[0]
 
         fqtn = '{}.{}'.format(ks, t)
-        fqtn_with_id = '{}.{}'.format(section['keyspace'], section['columnfamily'])
+        fqtn_with_id = '{}.{}'.format(table.keyspace, table.columnfamily)
 
         # if not keyspaces / tables were specified, we keep everything
         if len(keep_keyspaces) == 0 and len(keep_tables) == 0:
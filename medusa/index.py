@@ -21,6 +21,7 @@ import traceback
 import medusa.storage
 
 from medusa.cassandra_utils import Cassandra
+from medusa.storage.reference_index import ReferenceIndex
 
 
 def update_backup_index(storage, node_backup):
@@ -66,6 +67,9 @@ def build_indices(config, noop):
                     logging.debug('Latest backup {} is {}'.format(fqdn, node_backup.name))
                     set_latest_backup_in_index(storage, node_backup)
 
+                # picks up the index entries of nodes running older versions of Medusa too
+                storage.backup_catalog.compact(import_backup_index=True)
+
     except Exception:
         traceback.print_exc()
         sys.exit(1)
@@ -108,14 +112,39 @@ def add_backup_start_to_index(storage, node_backup):
         dst = '{}index/backup_index/{}/differential_{}'.format(storage.prefix_path, node_backup.name, node_backup.fqdn)
         storage.storage_driver.upload_blob_from_string(dst, 'differential')
 
+    storage.backup_catalog.record_started(node_backup)
+
 
 def add_backup_finish_to_index(storage, node_backup):
     dst = '{}index/backup_index/{}/manifest_{}.json'.format(storage.prefix_path, node_backup.name, node_backup.fqdn)
-    storage.storage_driver.upload_blob_from_string(dst, node_backup.manifest)
+    storage.storage_driver.upload_blob_from_string(dst, node_backup.manifest_content)
     dst = '{}index/backup_index/{}/finished_{}_{}.timestamp'.format(
         storage.prefix_path, node_backup.name, node_backup.fqdn, node_backup.finished
     )
     storage.storage_driver.upload_blob_from_string(dst, str(node_backup.finished))
+    try:
+        stats = node_backup.stats.to_json()
+    except ValueError as e:
+        # listing backups falls back to reading their manifest
+        logging.warning('Could not compute the stats of backup {} of {}: {}'.format(
+            node_backup.name, node_backup.fqdn, e
+        ))
+    else:
+        # kept out of backup_index, where older versions of Medusa would not know what to do with it
+        storage.storage_driver.upload_blob_from_string(node_backup.stats_path, stats)
+    if node_backup.is_differential:
+        try:
+            manifest = node_backup.read_manifest()
+            if manifest is not None:
+                ReferenceIndex(storage, node_backup.fqdn).record_added(
+                    node_backup.name, ReferenceIndex.manifest_paths(manifest)
+                )
+        except ValueError as e:
+            # purges then read the manifest of the backup themselves
+            logging.warning('Could not add backup {} of {} to the reference index: {}'.format(
+                node_backup.name, node_backup.fqdn, e
+            ))
+    storage.backup_catalog.record_finished(node_backup)
 
 
 def set_latest_backup_in_index(storage, node_backup):
@@ -128,10 +157,15 @@ def set_latest_backup_in_index(storage, node_backup):
 def clean_backup_from_index(storage, node_backup):
     index_files = storage.storage_driver.list_objects(
         "{}index/backup_index/{}".format(storage.prefix_path, node_backup.name))
-    for obj in index_files:
-        if "_" + node_backup.fqdn in obj.name:
-            logging.debug("Cleaning from backup index: {}".format(obj.name))
-            storage.storage_driver.delete_object(obj)
+    node_index_files = [obj for obj in index_files if "_" + node_backup.fqdn in obj.name]
+    stats_blob = storage.storage_driver.get_blob(node_backup.stats_path)
+    if stats_blob is not None:
+        node_index_files.append(stats_blob)
+    for obj in node_index_files:
+        logging.debug("Cleaning from backup index: {}".format(obj.name))
+    storage.storage_driver.delete_objects(node_index_files)
+    storage.backup_catalog.record_removed(node_backup)
+    ReferenceIndex(storage, node_backup.fqdn).record_removed(node_backup.name)
 
 
 def index_exists(storage):
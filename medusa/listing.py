@@ -29,11 +29,13 @@ def get_backups(storage, config, show_all):
         key=lambda b: b.started
     )
     if not show_all:
-        cluster_backups = filter(
+        cluster_backups = list(filter(
             lambda cluster_backup: config.storage.fqdn in cluster_backup.node_backups,
             cluster_backups
-        )
+        ))
 
+    # telling whether a backup is complete needs its tokenmap
+    storage.prefetch_cluster_backups(cluster_backups, tokenmap=True)
     return cluster_backups
 
 
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import concurrent.futures
+import errno
+import logging
+import os
+import pathlib
+import shutil
+import threading
+import typing as t
+
+from medusa.deep_verify import ObjectChecksums
+from medusa.storage.abstract_storage import AbstractStorage
+
+# how many local files get checksummed at once
+LOCAL_CHECK_WORKERS = 4
+READ_SIZE = 1024 * 1024
+
+
+class LocalObjects(object):
+    """
+    Finds local copies of the objects of a backup, so restores can hard-link them rather than downloading them. The
+    SSTables are immutable, so differential backups share most of their files with the live tables of the node and with
+    the snapshots Cassandra kept. A local file only stands in for an object when its name, its size and its MD5 match
+    the manifest. Generation numbers get reused across nodes, so the name and the size are not enough.
+
+    Each table gets indexed once by (relative path, size). The snapshot named after the backup comes first, as it most
+    likely holds the objects of the backup, then the live table, then the other snapshots.
+    """
+
+    def __init__(self, cassandra_data_dir: pathlib.Path, snapshot_tags: t.Iterable[str], backup_name: str,
+                 configured_part_size: t.Optional[int] = None, live_tables: bool = True,
+                 workers: int = LOCAL_CHECK_WORKERS):
+        backup_tag = 'medusa-{}'.format(backup_name)
+        tags = sorted(snapshot_tags, key=lambda tag: (tag != backup_tag, tag))
+        self._data_dir = cassandra_data_dir
+        self._tags = tags[:1] if tags and tags[0] == backup_tag else []
+        self._other_tags = tags[len(self._tags):]
+        self._live_tables = live_tables
+        self._configured_part_size = configured_part_size
+        self._workers = workers
+        self._lock = threading.Lock()
+        self.reused_objects = 0
+        self.reused_bytes = 0
+
+    def _table_folders(self, section) -> t.List[pathlib.Path]:
+        table_dir = self._data_dir / section['keyspace'] / section['columnfamily']
+        folders = [table_dir / 'snapshots' / tag for tag in self._tags]
+        if self._live_tables:
+            folders.append(table_dir)
+        folders.extend(table_dir / 'snapshots' / tag for tag in self._other_tags)
+        return folders
+
+    def index(self, section) -> t.Dict[t.Tuple[pathlib.Path, int], t.List[pathlib.Path]]:
+        """
+        Lists the local files of the table of a section, with the ones of hidden sub-folders (secondary indices).
+
+        :return: the paths of the files, by path relative to their table folder and size
+        """
+        files = {}
+        for folder in self._table_folders(section):
+            try:
+                entries = list(os.scandir(str(folder)))
+                entries.extend(
+                    sub_entry
+                    for entry in list(entries) if entry.name.startswith('.') and entry.is_dir(follow_symlinks=False)
+                    for sub_entry in os.scandir(entry.path)
+                )
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False):
+                        relative_path = pathlib.Path(entry.path).relative_to(folder)
+                        files.setdefault((relative_path, entry.stat().st_size), []).append(pathlib.Path(entry.path))
+            except OSError:
+                # missing or unreadable, nothing to reuse there
+                continue
+        return files
+
+    def matches(self, path: pathlib.Path, object_in_manifest) -> bool:
+        checksums = ObjectChecksums(int(object_in_manifest['size']), object_in_manifest['MD5'],
+                                    self._configured_part_size)
+        if not checksums.verifies_md5():
+            # without a digest to compare with, a file of the same name and size could still differ
+            return False
+        try:
+            with open(str(path), 'rb') as f:
+                for data in iter(lambda: f.read(READ_SIZE), b''):
+                    checksums.update(data)
+        except OSError:
+            return False
+        return not checksums.errors()
+
+    def find(self, object_in_manifest, candidates: t.Iterable[pathlib.Path]) -> t.Optional[pathlib.Path]:
+        for candidate in candidates:
+            if self.matches(candidate, object_in_manifest):
+                return candidate
+        return None
+
+    def link(self, object_in_manifest, dst: pathlib.Path, files) -> bool:
+        """
+        Hard-links a local copy of the object, from the files index() found, into the dst folder of its table. Copies
+        it when the folder is on another filesystem.
+
+        :return: whether there was a local copy
+        """
+        src_path = pathlib.Path(object_in_manifest['path'])
+        target = pathlib.Path(AbstractStorage.path_maybe_with_parent(str(dst), src_path))
+        candidates = files.get((target.relative_to(dst), int(object_in_manifest['size'])), [])
+        local_copy = self.find(object_in_manifest, candidates)
+        if local_copy is None:
+            return False
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            try:
+                os.link(str(local_copy), str(target))
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.copy2(str(local_copy), str(target))
+        except OSError as e:
+            # e.g. compacted away since the table got indexed
+            logging.debug('Unable to reuse {}, it will get downloaded: {}'.format(local_copy, e))
+            return False
+        with self._lock:
+            self.reused_objects += 1
+            self.reused_bytes += int(object_in_manifest['size'])
+        return True
+
+    def link_section(self, section, dst: pathlib.Path) -> t.List[dict]:
+        """
+        Links the local copies of the objects of a section into its dst folder.
+
+        :return: the objects that have no local copy, which still need downloading
+        """
+        files = self.index(section)
+        if not files:
+            return section['objects']
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._workers) as executor:
+            linked = list(executor.map(lambda obj: self.link(obj, dst, files), section['objects']))
+        return [obj for obj, was_linked in zip(section['objects'], linked) if not was_linked]
+
+
+def node_local_objects(storage, cassandra, backup_name) -> LocalObjects:
+    """
+    The LocalObjects of the live tables and the snapshots of this node.
+    """
+    snapshot_tags = cassandra.list_snapshotnames()
+    logging.info('Looking for the objects of the backup in the tables and {} snapshots of the node'.format(
+        len(snapshot_tags)))
+    multipart_chunksize = getattr(storage.config, 'multipart_chunksize', None)
+    configured_part_size = AbstractStorage._human_size_to_bytes(str(multipart_chunksize)) \
+        if multipart_chunksize else None
+    return LocalObjects(cassandra.root, snapshot_tags, backup_name, configured_part_size)
@@ -37,6 +37,7 @@ from pathlib import Path
 
 from medusa import backup_node
 from medusa.backup_manager import BackupMan
+import medusa.audit
 import medusa.backup_cluster
 import medusa.config
 import medusa.download
@@ -288,14 +289,31 @@ def restore_cluster(medusaconfig, backup_name, seed_target, temp_dir, host_list,
 @click.option('--use-sstableloader', help='Use the sstableloader to load the backup into the cluster',
               default=False, is_flag=True)
 @click.option('--version-target', help='Target Cassandra version', required=False, default="3.11.9")
+@click.option('--streaming', help='Stop Cassandra first, then download each table next to the data directory and '
+                                  'move it into place while the next ones download', default=False, is_flag=True)
+@click.option('--direct', help='Download each table to a hidden staging folder next to it in the data directory, '
+                               'then rename it into place', default=False, is_flag=True)
+@click.option('--reuse-local-files/--no-reuse-local-files', default=True,
+              help='Hard-link the files of the backup still found in the tables or the snapshots of the node '
+                   'instead of downloading them')
+@click.option('--sstableloader-download-workers', type=int, default=medusa.restore_node.SSTABLELOADER_DOWNLOAD_WORKERS,
+              help='With --use-sstableloader, how many source nodes get downloaded at once')
+@click.option('--sstableloader-workers', type=int, default=medusa.restore_node.SSTABLELOADER_WORKERS,
+              help='With --use-sstableloader, how many tables get loaded at once')
+@click.option('--sstableloader-disk-budget', default=None,
+              help='With --use-sstableloader, how much space the tables waiting to be loaded may take, e.g. 100GB. '
+                   'Defaults to the space available in --temp-dir')
 @pass_MedusaConfig
 def restore_node(medusaconfig, temp_dir, backup_name, in_place, keep_auth, seeds, verify, keyspaces, tables,
-                 use_sstableloader, version_target):
+                 use_sstableloader, version_target, streaming, direct, reuse_local_files,
+                 sstableloader_download_workers, sstableloader_workers, sstableloader_disk_budget):
     """
     Restore single Cassandra node
     """
     medusa.restore_node.restore_node(medusaconfig, Path(temp_dir), backup_name, in_place, keep_auth, seeds,
-                                     verify, set(keyspaces), set(tables), use_sstableloader, version_target)
+                                     verify, set(keyspaces), set(tables), use_sstableloader, version_target,
+                                     streaming, direct, reuse_local_files, sstableloader_download_workers,
+                                     sstableloader_workers, sstableloader_disk_budget)
 
 
 @cli.command(name='status')
@@ -315,18 +333,57 @@ def status(medusaconfig, backup_name, output):
 @click.option('--enable-md5-checks', help='During backups and verify, use md5 calculations to determine file integrity '
                                           '(in addition to size, which is used by default)',
               is_flag=True, default=False)
+@click.option('-o', '--output', type=click.Choice(['text', 'json']), default='text',
+              help='Output format (default: text)')
+@click.option('--deep', help='Also read the objects back to check their content against their MD5 from the manifest',
+              is_flag=True, default=False)
+@click.option('--check-sstables', help='With --deep, also check the Digest.crc32 and compressed chunk checksums of '
+                                       'SSTables', is_flag=True, default=False)
+@click.option('--max-bandwidth', help='With --deep, the most bandwidth to read objects with (eg. 50MB/s)',
+              default=None)
+@click.option('--max-size', help='With --deep, stop once this much data was read (eg. 100GB). Use with '
+                                 '--progress-file to verify a backup slice by slice', default=None)
+@click.option('--progress-file', help='With --deep, file keeping the objects already verified, so the next '
+                                      'verification of the backup resumes where the previous one stopped',
+              default=None)
 @pass_MedusaConfig
-def verify(medusaconfig, backup_name, enable_md5_checks):
+def verify(medusaconfig, backup_name, enable_md5_checks, output, deep, check_sstables, max_bandwidth, max_size,
+           progress_file):
     """
     Verify the integrity of a backup
     """
     try:
-        medusa.verify.verify(medusaconfig, backup_name, enable_md5_checks)
+        medusa.verify.verify(medusaconfig, backup_name, enable_md5_checks, output, deep, check_sstables,
+                             max_bandwidth, max_size, progress_file)
     except RuntimeError as e:
         logging.error(str(e))
         sys.exit(1)
 
 
+@cli.command(name='audit-backups')
+@click.option('--samples', help='How many objects to check per round (default: 100)', default=100, type=int)
+@click.option('--interval', help='Seconds to wait between rounds (default: 60)', default=60, type=int)
+@click.option('--rounds', help='How many rounds to run, 0 to keep auditing until interrupted (default: 0)', default=0,
+              type=int)
+@click.option('--read-objects', help='Read the sampled objects back to check their MD5, instead of checking what the '
+                                     'storage tells about them', is_flag=True, default=False)
+@click.option('--enable-md5-checks', help='Without --read-objects, also compare the hash the storage gives with the '
+                                          'manifest', is_flag=True, default=False)
+@click.option('--max-bandwidth', help='With --read-objects, the most bandwidth to read objects with (eg. 50MB/s)',
+              default=None)
+@click.option('--push-metrics', default=False, is_flag=True, help='Also push the audit totals via metrics')
+@pass_MedusaConfig
+def audit_backups(medusaconfig, samples, interval, rounds, read_objects, enable_md5_checks, max_bandwidth,
+                  push_metrics):
+    """
+    Keep checking random objects of all the backups against their manifest
+    """
+    totals = medusa.audit.audit_backups(medusaconfig, samples, interval, rounds, read_objects, enable_md5_checks,
+                                        max_bandwidth, push_metrics)
+    if totals.corrupted_objects > 0:
+        sys.exit(1)
+
+
 @cli.command(name='report-last-backup')
 @click.option('--push-metrics', default=False, is_flag=True, help='Also push the information via metrics')
 @pass_MedusaConfig
@@ -362,23 +419,30 @@ def build_index(medusa_config, noop):
 
 
 @cli.command(name='purge')
+@click.option('--dry-run', help='Only print how much each node would reclaim, without deleting anything',
+              default=False, is_flag=True)
 @pass_MedusaConfig
-def purge(medusaconfig):
+def purge(medusaconfig, dry_run):
     """
     Delete obsolete backups
     """
     medusa.purge.main(medusaconfig,
                       max_backup_age=int(medusaconfig.storage.max_backup_age),
-                      max_backup_count=int(medusaconfig.storage.max_backup_count))
+                      max_backup_count=int(medusaconfig.storage.max_backup_count),
+                      dry_run=dry_run)
 
 
 @cli.command(name='purge-decommissioned')
+@click.option('--max-workers', help='Number of nodes to purge at once', type=int,
+              default=medusa.purge.MAX_CONCURRENT_NODE_PURGES)
+@click.option('--dry-run', help='Only print how much each node would reclaim, without deleting anything',
+              default=False, is_flag=True)
 @pass_MedusaConfig
-def purge_decommissioned(medusaconfig):
+def purge_decommissioned(medusaconfig, max_workers, dry_run):
     """
     Delete obsolete backups of decommissioned nodes
     """
-    medusa.purge_decommissioned.main(medusaconfig)
+    medusa.purge_decommissioned.main(medusaconfig, max_workers=max_workers, dry_run=dry_run)
 
 
 @cli.command(name='delete-backup')
@@ -386,9 +450,13 @@ def purge_decommissioned(medusaconfig):
 @click.option('-a/-c', '--all-nodes/--current-node',
               help='Delete backups on all nodes (Default is current node only)',
               default=False, is_flag=True)
+@click.option('--max-workers', help='Number of nodes to purge at once', type=int,
+              default=medusa.purge.MAX_CONCURRENT_NODE_PURGES)
+@click.option('--dry-run', help='Only print how much each node would reclaim, without deleting anything',
+              default=False, is_flag=True)
 @pass_MedusaConfig
-def delete_backup(medusaconfig, backup_name, all_nodes):
+def delete_backup(medusaconfig, backup_name, all_nodes, max_workers, dry_run):
     """
     Delete the given backup on the current node (or on all nodes)
     """
-    medusa.purge.delete_backup(medusaconfig, backup_name, all_nodes)
+    medusa.purge.delete_backup(medusaconfig, backup_name, all_nodes, max_workers=max_workers, dry_run=dry_run)
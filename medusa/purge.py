@@ -14,7 +14,9 @@
 # limitations under the License.
 
 
-import json
+import asyncio
+import collections
+import concurrent.futures
 import logging
 import sys
 import traceback
@@ -25,9 +27,17 @@ import medusa.utils
 from medusa.index import clean_backup_from_index
 from medusa.monitoring import Monitoring
 from medusa.storage import Storage, format_bytes_str
+from medusa.storage.reference_index import ReferenceIndex
 
+# how many nodes get purged at once by default, each with its own connection to the storage
+MAX_CONCURRENT_NODE_PURGES = 8
 
-def main(config, max_backup_age=0, max_backup_count=0):
+NodePurge = collections.namedtuple(
+    'NodePurge', ['fqdn', 'nb_backups_purged', 'nb_objects_purged', 'total_purged_size', 'nb_objects_within_grace']
+)
+
+
+def main(config, max_backup_age=0, max_backup_count=0, dry_run=False):
     backups_to_purge = set()
     monitoring = Monitoring(config=config.monitoring)
 
@@ -36,21 +46,22 @@ def main(config, max_backup_age=0, max_backup_count=0):
         with Storage(config=config.storage) as storage:
             # Get all backups for the local node
             logging.info('Listing backups for {}'.format(config.storage.fqdn))
-            backup_index = storage.list_backup_index_blobs()
-            backups = list(storage.list_node_backups(fqdn=config.storage.fqdn, backup_index_blobs=backup_index))
+            backups = list(storage.list_node_backups(fqdn=config.storage.fqdn))
             # list all backups to purge based on date conditions
             backups_to_purge |= set(backups_to_purge_by_age(backups, max_backup_age))
             # list all backups to purge based on count conditions
             backups_to_purge |= set(backups_to_purge_by_count(backups, max_backup_count))
             # purge all candidate backups
             object_counts = purge_backups(
-                storage, backups_to_purge, config.storage.backup_grace_period_in_days, config.storage.fqdn
+                storage, backups_to_purge, config.storage.backup_grace_period_in_days, config.storage.fqdn,
+                listed_backups=backups, dry_run=dry_run
             )
             nb_objects_purged, total_purged_size, total_objects_within_grace = object_counts
 
-            logging.debug('Emitting metrics')
-            tags = ['medusa-node-backup', 'purge-error', 'PURGE-ERROR']
-            monitoring.send(tags, 0)
+            if not dry_run:
+                logging.debug('Emitting metrics')
+                tags = ['medusa-node-backup', 'purge-error', 'PURGE-ERROR']
+                monitoring.send(tags, 0)
 
         return nb_objects_purged, total_purged_size, total_objects_within_grace, len(backups_to_purge)
 
@@ -82,37 +93,54 @@ def backups_to_purge_by_count(backups, max_backup_count):
     return []
 
 
-def purge_backups(storage, backups, backup_grace_period_in_days, local_fqdn):
+def purge_backups(storage, backups, backup_grace_period_in_days, local_fqdn, fqdns=(), listed_backups=None,
+                  max_workers=1, dry_run=False):
     """
     Core function to purge a set of node_backups
     Used for node purge and backup delete (using a specific backup_name)
+
+    Obsolete files get cleaned up on the nodes of the purged backups, and on the given fqdns. Up to max_workers nodes
+    get purged at once. When the caller already listed the backups of these nodes, it gives them as listed_backups
+    so the nodes do not list them again.
+    A dry run deletes nothing, the counts are what a purge would delete.
     """
     logging.info("{} backups are candidate to be purged".format(len(backups)))
-    fqdns = set()
-    nb_objects_purged = 0
-    total_purged_size = 0
-    total_objects_within_grace = 0
-
+    backups_by_fqdn = {fqdn: [] for fqdn in fqdns}
     for backup in backups:
-        (purged_objects, purged_size) = purge_backup(storage, backup)
-        nb_objects_purged += purged_objects
-        total_purged_size += purged_size
-        fqdns.add(backup.fqdn)
+        backups_by_fqdn.setdefault(backup.fqdn, []).append(backup)
 
-    if len(fqdns) == 0:
+    if len(backups_by_fqdn) == 0:
         # If we didn't purge any backup, we still want to cleanup obsolete files for the local node
-        fqdns.add(local_fqdn)
-
-    for fqdn in fqdns:
-        (cleaned_objects_count, cleaned_objects_size, nb_objects_within_grace) \
-            = cleanup_obsolete_files(storage,
-                                     fqdn,
-                                     backup_grace_period_in_days)
-        nb_objects_purged += cleaned_objects_count
-        total_purged_size += cleaned_objects_size
-        total_objects_within_grace += nb_objects_within_grace
-
-    logging.info("Purged {} objects with a total size of {}".format(
+        backups_by_fqdn[local_fqdn] = []
+
+    remaining_backups_by_fqdn = collections.defaultdict(list)
+    if listed_backups is not None:
+        purged = {(backup.fqdn, backup.name) for backup in backups}
+        for backup in listed_backups:
+            if (backup.fqdn, backup.name) not in purged:
+                remaining_backups_by_fqdn[backup.fqdn].append(backup)
+
+    def node_args(fqdn):
+        remaining_backups = remaining_backups_by_fqdn[fqdn] if listed_backups is not None else None
+        return fqdn, backups_by_fqdn[fqdn], backup_grace_period_in_days, remaining_backups, dry_run
+
+    fqdns_to_purge = sorted(backups_by_fqdn)
+    if max_workers <= 1 or len(fqdns_to_purge) == 1:
+        node_purges = [purge_node(storage, *node_args(fqdn)) for fqdn in fqdns_to_purge]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(fqdns_to_purge))) as executor:
+            futures = [
+                executor.submit(_purge_node_with_own_storage, storage.config, *node_args(fqdn))
+                for fqdn in fqdns_to_purge
+            ]
+            node_purges = [future.result() for future in futures]
+
+    nb_objects_purged = sum(node_purge.nb_objects_purged for node_purge in node_purges)
+    total_purged_size = sum(node_purge.total_purged_size for node_purge in node_purges)
+    total_objects_within_grace = sum(node_purge.nb_objects_within_grace for node_purge in node_purges)
+
+    logging.info("{} {} objects with a total size of {}".format(
+        "Would purge" if dry_run else "Purged",
         nb_objects_purged,
         format_bytes_str(total_purged_size)))
     if total_objects_within_grace > 0:
@@ -124,56 +152,165 @@ def purge_backups(storage, backups, backup_grace_period_in_days, local_fqdn):
     return (nb_objects_purged, total_purged_size, total_objects_within_grace)
 
 
-def purge_backup(storage, backup):
+def purge_node(storage, fqdn, backups, backup_grace_period_in_days, remaining_backups=None, dry_run=False):
+    """
+    Purges the given backups of a node, then cleans up its obsolete files.
+    remaining_backups are the backups of the node which do not get purged, they get listed if not given.
+    """
+    nb_objects_purged = 0
+    total_purged_size = 0
+    for backup in backups:
+        (purged_objects, purged_size) = purge_backup(storage, backup, dry_run)
+        nb_objects_purged += purged_objects
+        total_purged_size += purged_size
+
+    (cleaned_objects_count, cleaned_objects_size, nb_objects_within_grace) \
+        = cleanup_obsolete_files(storage,
+                                 fqdn,
+                                 backup_grace_period_in_days,
+                                 backups=remaining_backups,
+                                 purged_backup_names={backup.name for backup in backups},
+                                 dry_run=dry_run)
+
+    node_purge = NodePurge(fqdn, len(backups), nb_objects_purged + cleaned_objects_count,
+                           total_purged_size + cleaned_objects_size, nb_objects_within_grace)
+    logging.info("[{}] {} {} backups and {} objects, reclaiming {}".format(
+        fqdn,
+        "Would purge" if dry_run else "Purged",
+        node_purge.nb_backups_purged,
+        node_purge.nb_objects_purged,
+        format_bytes_str(node_purge.total_purged_size)))
+    return node_purge
+
+
+def _purge_node_with_own_storage(storage_config, fqdn, backups, backup_grace_period_in_days, remaining_backups,
+                                 dry_run):
+    # storage drivers are bound to the event loop of the thread that uses them, so each node gets its own
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        with Storage(config=storage_config) as storage:
+            def rebind(node_backups):
+                return [
+                    storage.get_node_backup(fqdn=nb.fqdn, name=nb.name, differential_mode=nb.is_differential)
+                    for nb in node_backups
+                ]
+
+            return purge_node(storage, fqdn, rebind(backups), backup_grace_period_in_days,
+                              None if remaining_backups is None else rebind(remaining_backups), dry_run)
+    finally:
+        loop.close()
+
+
+def purge_backup(storage, backup, dry_run=False):
     purged_objects = 0
     purged_size = 0
-    logging.info("Purging backup {} from node {}..."
-                 .format(backup.name, backup.fqdn))
+    logging.info("{} backup {} from node {}..."
+                 .format("Planning the purge of" if dry_run else "Purging", backup.name, backup.fqdn))
     objects = storage.storage_driver.list_objects(backup.backup_path)
+    if dry_run:
+        return len(objects), sum(int(obj.size) for obj in objects)
 
+    failures = storage.storage_driver.delete_objects(objects)
     for obj in objects:
-        logging.debug("Purging {}".format(obj.name))
-        purged_objects += 1
-        purged_size += obj.size
-        storage.storage_driver.delete_object(obj)
+        if obj.name not in failures:
+            logging.debug("Purged {}".format(obj.name))
+            purged_objects += 1
+            purged_size += obj.size
 
     clean_backup_from_index(storage, backup)
 
     return (purged_objects, purged_size)
 
 
-def cleanup_obsolete_files(storage, fqdn, backup_grace_period_in_days):
+def cleanup_obsolete_files(storage, fqdn, backup_grace_period_in_days, backups=None, purged_backup_names=frozenset(),
+                           dry_run=False):
+    """
+    Deletes the objects of the data folder of a node which no backup references anymore.
+    The backups of the node get listed if not given. The purged backups are only needed by dry runs, which must not
+    count on the index knowing they got purged.
+    """
     logging.info("Cleaning up orphaned files for {}...".format(fqdn))
     nb_objects_purged = 0
     total_purged_size = 0
 
-    backups = storage.list_node_backups(fqdn=fqdn)
-    paths_in_manifest = get_file_paths_from_manifests_for_complete_differential_backups(backups)
-    paths_in_storage = get_file_paths_from_storage(storage, fqdn)
+    if backups is None:
+        backups = list(storage.list_node_backups(fqdn=fqdn))
+    paths_in_manifest = get_referenced_paths(storage, fqdn, backups, purged_backup_names, dry_run)
+    # only the blobs not referenced by any manifest are kept in memory, not the whole listing
+    paths_in_storage = get_file_paths_from_storage(storage, fqdn, paths_to_skip=paths_in_manifest)
 
-    deletion_candidates = set(paths_in_storage.keys()) - paths_in_manifest
+    deletion_candidates = set(paths_in_storage.keys())
     objects_to_delete = filter_files_within_gc_grace(storage,
                                                      deletion_candidates,
                                                      paths_in_storage,
                                                      backup_grace_period_in_days)
-    for path in objects_to_delete:
-        logging.debug("  - [{}] exists in storage, but not in manifest".format(path))
-        obj = storage.storage_driver.get_blob(path)
-        if obj is not None:
+    # the listing already gave us the blobs, so there is no need to fetch them again before deleting them
+    blobs_to_delete = [paths_in_storage[path] for path in objects_to_delete]
+    nb_objects_within_grace = len(set(deletion_candidates) - set(objects_to_delete))
+    if dry_run:
+        return len(blobs_to_delete), sum(int(obj.size) for obj in blobs_to_delete), nb_objects_within_grace
+
+    # forget the objects before deleting them: if the deletion fails, the next backup uploads them again. the cache
+    # only holds the objects of the node the purge runs on, others notice through their reference index
+    if fqdn == storage.config.fqdn:
+        storage.forget_uploaded_objects(objects_to_delete)
+    failures = storage.storage_driver.delete_objects(blobs_to_delete)
+    for obj in blobs_to_delete:
+        logging.debug("  - [{}] exists in storage, but not in manifest".format(obj.name))
+        if obj.name not in failures:
             nb_objects_purged += 1
             total_purged_size += int(obj.size)
-            storage.storage_driver.delete_object(obj)
-
-    nb_objects_within_grace = len(set(deletion_candidates) - set(objects_to_delete))
 
     return nb_objects_purged, total_purged_size, nb_objects_within_grace
 
 
-def get_file_paths_from_storage(storage, fqdn):
+def get_referenced_paths(storage, fqdn, backups, purged_backup_names=frozenset(), dry_run=False):
+    """
+    Gets the paths referenced by the complete differential backups of a node from its reference index, which gets
+    reconciled with the listed backups (and compacted, unless in a dry run) along the way:
+      - backups missing from the index, like the ones taken by older versions of Medusa, have their manifest read;
+      - backups the index knows about but which got purged without telling it are dropped from it.
+    """
+    reference_index = ReferenceIndex(storage, fqdn)
+    references, segments = reference_index.read()
+    for backup_name in purged_backup_names:
+        references.remove_backup(backup_name)
+
+    differential_backups = {backup.name: backup for backup in filter_differential_backups(backups)}
+    missing_backups = [backup for name, backup in differential_backups.items() if name not in references.backups]
+    if missing_backups:
+        logging.info('Reading the manifests of {} backups missing from the reference index'.format(
+            len(missing_backups)
+        ))
+        storage.prefetch_node_backups(missing_backups, manifest=True)
+    for backup in missing_backups:
+        manifest = backup.read_manifest()
+        # unfinished backups get their objects protected by the grace period, like before
+        if manifest is not None:
+            references.add_backup(backup.name, ReferenceIndex.manifest_paths(manifest))
+
+    # only drop the backups we know are gone, the backup index can miss some which still exist
+    unlisted_backups = [
+        storage.get_node_backup(fqdn=fqdn, name=name) for name in references.backups - differential_backups.keys()
+    ]
+    storage.check_node_backups_exist(unlisted_backups)
+    for backup in unlisted_backups:
+        if not backup.exists():
+            logging.debug('Dropping backup {} of {} from the reference index'.format(backup.name, fqdn))
+            references.remove_backup(backup.name)
+
+    if not dry_run:
+        reference_index.compact(references, segments)
+    return references.referenced_paths()
+
+
+def get_file_paths_from_storage(storage, fqdn, paths_to_skip=frozenset()):
     data_directory = "{}{}/data".format(storage.prefix_path, fqdn)
     data_files = {
         blob.name: blob
-        for blob in storage.storage_driver.list_objects(str(data_directory))
+        for blob in storage.storage_driver.iter_blobs(str(data_directory))
+        if blob.name not in paths_to_skip
     }
 
     return data_files
@@ -191,27 +328,6 @@ def is_older_than_gc_grace(blob_datetime, gc_grace) -> bool:
     return datetime.timestamp(blob_datetime) <= datetime.timestamp(datetime.now()) - (int(gc_grace) * 86400)
 
 
-def get_file_paths_from_manifests_for_complete_differential_backups(backups):
-    differential_backups = filter_differential_backups(backups)
-    complete_differential_backups = list(filter(lambda backup: backup.manifest is not None, differential_backups))
-
-    manifests = [json.loads(backup.manifest) for backup in complete_differential_backups]
-
-    objects_in_manifests = [
-        obj
-        for manifest in manifests
-        for columnfamily_manifest in manifest
-        for obj in columnfamily_manifest['objects']
-    ]
-
-    paths_in_manifest = {
-        "{}".format(obj['path'])
-        for obj in objects_in_manifests
-    }
-
-    return paths_in_manifest
-
-
 def filter_differential_backups(backups):
     return list(filter(lambda backup: backup.is_differential is True, backups))
 
@@ -240,20 +356,23 @@ def backups_to_purge_by_name(storage, cluster_backups, backup_names_to_purge, al
     return backups_to_purge
 
 
-def delete_backup(config, backup_names, all_nodes):
+def delete_backup(config, backup_names, all_nodes, max_workers=1, dry_run=False):
     monitoring = Monitoring(config=config.monitoring)
 
     try:
         with Storage(config=config.storage) as storage:
-            cluster_backups = storage.list_cluster_backups()
+            cluster_backups = list(storage.list_cluster_backups())
             backups_to_purge = backups_to_purge_by_name(storage, cluster_backups, backup_names, all_nodes)
+            listed_backups = [nb for cluster_backup in cluster_backups for nb in cluster_backup.node_backups.values()]
 
             logging.info('Deleting Backup(s) {}...'.format(",".join(backup_names)))
-            purge_backups(storage, backups_to_purge, config.storage.backup_grace_period_in_days, storage.config.fqdn)
+            purge_backups(storage, backups_to_purge, config.storage.backup_grace_period_in_days, storage.config.fqdn,
+                          listed_backups=listed_backups, max_workers=max_workers, dry_run=dry_run)
 
-            logging.debug('Emitting metrics')
-            tags = ['medusa-node-backup', 'delete-error', 'DELETE-ERROR']
-            monitoring.send(tags, 0)
+            if not dry_run:
+                logging.debug('Emitting metrics')
+                tags = ['medusa-node-backup', 'delete-error', 'DELETE-ERROR']
+                monitoring.send(tags, 0)
     except Exception as e:
         tags = ['medusa-node-backup', 'delete-error', 'DELETE-ERROR']
         monitoring.send(tags, 1)
@@ -4,11 +4,11 @@ import traceback
 from medusa.cassandra_utils import CqlSessionProvider
 
 from medusa.monitoring import Monitoring
-from medusa.purge import purge_backups
+from medusa.purge import MAX_CONCURRENT_NODE_PURGES, purge_backups
 from medusa.storage import Storage
 
 
-def main(config):
+def main(config, max_workers=MAX_CONCURRENT_NODE_PURGES, dry_run=False):
     monitoring = Monitoring(config=config.monitoring)
     try:
         logging.info('Starting decommissioned purge')
@@ -22,18 +22,26 @@ def main(config):
 
             # Get decommissioned nodes
             decommissioned_nodes = get_decommissioned_nodes(all_nodes, live_nodes)
-
-            for node in decommissioned_nodes:
-                logging.info('Decommissioned node backups to purge: {}'.format(node))
-                backups = set(storage.list_node_backups(fqdn=node))
-                (nb_objects_purged, total_purged_size, total_objects_within_grace) \
-                    = purge_backups(storage, backups, config.storage.backup_grace_period_in_days, node)
-
-            logging.debug('Emitting metrics')
-            tags = ['medusa-decommissioned-node-backup', 'purge-error', 'PURGE-ERROR']
-            monitoring.send(tags, 0)
-
-            object_counts = (nb_objects_purged, total_purged_size, total_objects_within_grace, len(backups))
+            if not decommissioned_nodes:
+                logging.info('No decommissioned nodes to purge')
+                return decommissioned_nodes, (0, 0, 0, 0)
+            logging.info('Decommissioned nodes to purge: {}'.format(', '.join(sorted(decommissioned_nodes))))
+
+            # one listing for all the nodes
+            listed_backups = [
+                node_backup for node_backup in storage.list_node_backups() if node_backup.fqdn in decommissioned_nodes
+            ]
+            (nb_objects_purged, total_purged_size, total_objects_within_grace) = purge_backups(
+                storage, listed_backups, config.storage.backup_grace_period_in_days, config.storage.fqdn,
+                fqdns=decommissioned_nodes, listed_backups=listed_backups, max_workers=max_workers, dry_run=dry_run
+            )
+
+            if not dry_run:
+                logging.debug('Emitting metrics')
+                tags = ['medusa-decommissioned-node-backup', 'purge-error', 'PURGE-ERROR']
+                monitoring.send(tags, 0)
+
+            object_counts = (nb_objects_purged, total_purged_size, total_objects_within_grace, len(listed_backups))
             return decommissioned_nodes, object_counts
 
     except Exception as e:
@@ -37,7 +37,8 @@ def report_latest(config, push_metrics):
             ))
             with Storage(config=config.storage) as storage:
                 fqdn = config.storage.fqdn
-                backup_index = storage.list_backup_index_blobs()
+                # without a backup catalog, the index gets listed once for both checks
+                backup_index = None if storage.backup_catalog.exists() else storage.list_backup_index_blobs()
                 check_node_backup(config, storage, fqdn, push_metrics, monitoring)
                 check_complete_cluster_backup(storage, push_metrics, monitoring, backup_index)
                 check_latest_cluster_backup(storage, push_metrics, monitoring, backup_index)
@@ -13,32 +13,45 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import collections
+import concurrent.futures
 import json
 import logging
 import os
 import shlex
+import shutil
 import subprocess
 import sys
+import threading
 import time
 import uuid
 
 import medusa.config
 import medusa.utils
 from medusa.cassandra_utils import Cassandra, is_node_up, wait_for_node_to_go_down
-from medusa.download import download_data
+from medusa.download import _check_available_space, download_data, download_metadata, download_section
 from medusa.filtering import filter_fqtns
 from medusa.host_man import HostMan
+from medusa.local_objects import node_local_objects
 from medusa.network.hostname_resolver import HostnameResolver
 from medusa.storage import Storage
+from medusa.storage.abstract_storage import AbstractStorage
 from medusa.verify_restore import verify_restore
 
 A_MINUTE = 60
 MAX_ATTEMPTS = 60
+# how many tables get moved into place (and chowned) at once by streaming restores
+PLACEMENT_WORKERS = 4
+# how many source nodes get downloaded, and how many sstableloader processes run, at once by default
+SSTABLELOADER_DOWNLOAD_WORKERS = 1
+SSTABLELOADER_WORKERS = 1
 
 
 def restore_node(config, temp_dir, backup_name, in_place, keep_auth, seeds, verify, keyspaces, tables,
-                 use_sstableloader=False, version_target=None):
+                 use_sstableloader=False, version_target=None, streaming=False, direct=False, reuse_local_files=True,
+                 sstableloader_download_workers=SSTABLELOADER_DOWNLOAD_WORKERS,
+                 sstableloader_workers=SSTABLELOADER_WORKERS, sstableloader_disk_budget=None):
     if in_place and keep_auth:
         logging.error('Cannot keep system_auth when restoring in-place. It would be overwritten')
         sys.exit(1)
@@ -48,10 +61,12 @@ def restore_node(config, temp_dir, backup_name, in_place, keep_auth, seeds, veri
 
         if not use_sstableloader:
             restore_node_locally(config, temp_dir, backup_name, in_place, keep_auth, seeds, storage,
-                                 keyspaces, tables)
+                                 keyspaces, tables, streaming, direct, reuse_local_files)
         else:
             restore_node_sstableloader(config, temp_dir, backup_name, in_place, keep_auth, seeds, storage,
-                                       keyspaces, tables)
+                                       keyspaces, tables, sstableloader_download_workers, sstableloader_workers,
+                                       AbstractStorage._human_size_to_bytes(str(sstableloader_disk_budget))
+                                       if sstableloader_disk_budget else None)
 
         if verify:
             hostname_resolver = HostnameResolver(medusa.config.evaluate_boolean(config.cassandra.resolve_ip_addresses),
@@ -60,7 +75,22 @@ def restore_node(config, temp_dir, backup_name, in_place, keep_auth, seeds, veri
             verify_restore([hostname_resolver.resolve_fqdn()], config)
 
 
-def restore_node_locally(config, temp_dir, backup_name, in_place, keep_auth, seeds, storage, keyspaces, tables):
+def restore_node_locally(config, temp_dir, backup_name, in_place, keep_auth, seeds, storage, keyspaces, tables,
+                         streaming=False, direct=False, reuse_local_files=True):
+    """
+    Restores the backup on this node. By default the whole backup gets downloaded to temp_dir before Cassandra gets
+    stopped and the tables get moved into place.
+
+    With streaming, Cassandra gets stopped first, then each table gets downloaded to a staging folder next to the data
+    directory and moved into place while the next ones download, see restore_sections_streaming(). temp_dir is not
+    used then.
+
+    With direct, each table gets downloaded to a hidden staging folder next to it in the data directory, then renamed
+    into place. Only the backup metadata goes to temp_dir.
+
+    With reuse_local_files, the objects of the backup still sitting in the tables or the snapshots of the node get
+    hard-linked rather than downloaded, see LocalObjects.
+    """
     differential_blob = storage.storage_driver.get_blob(
         os.path.join(config.storage.fqdn, backup_name, 'meta', 'differential'))
 
@@ -74,7 +104,7 @@ def restore_node_locally(config, temp_dir, backup_name, in_place, keep_auth, see
         logging.error('No such backup')
         sys.exit(1)
 
-    fqtns_to_restore, ignored_fqtns = filter_fqtns(keyspaces, tables, node_backup.manifest)
+    fqtns_to_restore, ignored_fqtns = filter_fqtns(keyspaces, tables, node_backup.read_manifest())
     for fqtns in ignored_fqtns:
         logging.info('Skipping restore of {}'.format(fqtns))
 
@@ -83,11 +113,32 @@ def restore_node_locally(config, temp_dir, backup_name, in_place, keep_auth, see
         sys.exit(0)
 
     cassandra = Cassandra(config)
+    use_sudo = medusa.utils.evaluate_boolean(config.storage.use_sudo_for_restore)
+    local_objects = node_local_objects(storage, cassandra, backup_name) if reuse_local_files else None
 
-    # Download the backup
-    download_dir = temp_dir / 'medusa-restore-{}'.format(uuid.uuid4())
-    logging.info('Downloading data from backup to {}'.format(download_dir))
-    download_data(config.storage, node_backup, fqtns_to_restore, destination=download_dir)
+    if direct:
+        # only the metadata lands there
+        download_dir = temp_dir / 'medusa-restore-{}'.format(uuid.uuid4())
+        download_dir.mkdir(parents=True)
+        # the tables get renamed into place, so they only need space on the data volume
+        _check_available_space(node_backup.read_manifest(), cassandra.root, fqtns_to_restore)
+        if not streaming:
+            logging.info('Downloading data from backup to staging folders in {}'.format(cassandra.root))
+            for section in node_backup.read_manifest().sections(fqtns_to_restore):
+                stage_section(storage, node_backup, section, download_dir, cassandra.root, in_place, keep_auth,
+                              use_sudo, direct=True, local_objects=local_objects)
+            download_metadata(storage, node_backup, download_dir)
+    elif streaming:
+        download_dir = cassandra.root.parent / '.medusa-restore-{}'.format(uuid.uuid4())
+        logging.info('Staging data from backup in {}'.format(download_dir))
+        make_staging_dir(download_dir, cassandra.root, use_sudo)
+        _check_available_space(node_backup.read_manifest(), download_dir, fqtns_to_restore)
+    else:
+        # Download the backup
+        download_dir = temp_dir / 'medusa-restore-{}'.format(uuid.uuid4())
+        logging.info('Downloading data from backup to {}'.format(download_dir))
+        download_data(config.storage, node_backup, fqtns_to_restore, destination=download_dir,
+                      local_objects=local_objects)
 
     if not medusa.utils.evaluate_boolean(config.kubernetes.enabled if config.kubernetes else False):
         logging.info('Stopping Cassandra')
@@ -96,7 +147,6 @@ def restore_node_locally(config, temp_dir, backup_name, in_place, keep_auth, see
 
     # Clean the commitlogs, the saved cache to prevent any kind of conflict
     # especially around system tables.
-    use_sudo = medusa.utils.evaluate_boolean(config.storage.use_sudo_for_restore)
     clean_path(cassandra.commit_logs_path, use_sudo, keep_folder=True)
 
     if node_backup.is_dse:
@@ -104,15 +154,19 @@ def restore_node_locally(config, temp_dir, backup_name, in_place, keep_auth, see
             clean_path(cassandra.dse_metadata_path, use_sudo, keep_folder=True)
         clean_path(cassandra.dse_search_path, use_sudo, keep_folder=True)
 
-    # move backup data to Cassandra data directory according to system table
-    logging.info('Moving backup data to Cassandra data directory')
-    manifest = json.loads(node_backup.manifest)
-    for section in manifest:
-        fqtn = "{}.{}".format(section['keyspace'], section['columnfamily'])
-        if fqtn not in fqtns_to_restore:
-            logging.debug('Skipping restore for {}'.format(fqtn))
-            continue
-        maybe_restore_section(section, download_dir, cassandra.root, in_place, keep_auth, use_sudo)
+    if streaming:
+        logging.info('Downloading backup data and moving it to Cassandra data directory table by table')
+        restore_sections_streaming(storage, node_backup, fqtns_to_restore, download_dir, cassandra.root, in_place,
+                                   keep_auth, use_sudo, direct, local_objects=local_objects)
+    elif direct:
+        logging.info('Renaming backup data into place in Cassandra data directory')
+        place_staged_sections(node_backup.read_manifest().sections(fqtns_to_restore), download_dir, cassandra.root,
+                              in_place, keep_auth, use_sudo, direct=True)
+    else:
+        # move backup data to Cassandra data directory according to system table
+        logging.info('Moving backup data to Cassandra data directory')
+        for section in node_backup.read_manifest().sections(fqtns_to_restore):
+            maybe_restore_section(section, download_dir, cassandra.root, in_place, keep_auth, use_sudo)
 
     node_fqdn = storage.config.fqdn
     token_map_file = download_dir / 'tokenmap.json'
@@ -150,14 +204,23 @@ def restore_node_locally(config, temp_dir, backup_name, in_place, keep_auth, see
 
     # Clean the restored data from local temporary folder
     clean_path(download_dir, use_sudo, keep_folder=False)
+    if local_objects is not None and local_objects.reused_objects > 0:
+        logging.info('Reused {} local files ({}) instead of downloading them'.format(
+            local_objects.reused_objects, AbstractStorage.human_readable_size(local_objects.reused_bytes)))
     return node_backup
 
 
-def restore_node_sstableloader(config, temp_dir, backup_name, in_place, keep_auth, seeds, storage, keyspaces, tables):
+def restore_node_sstableloader(config, temp_dir, backup_name, in_place, keep_auth, seeds, storage, keyspaces, tables,
+                               download_workers=SSTABLELOADER_DOWNLOAD_WORKERS, loader_workers=SSTABLELOADER_WORKERS,
+                               disk_budget=None):
+    """
+    Loads the backup of each node of the --fqdn list into the cluster with sstableloader, see load_sections().
+    disk_budget defaults to the space available in temp_dir.
+    """
     cassandra = Cassandra(config)
     node_backup = None
     fqdns = config.storage.fqdn.split(",")
-    download_dir = None
+    jobs = []
 
     for fqdn in fqdns:
         differential_blob = storage.storage_driver.get_blob(
@@ -173,7 +236,7 @@ def restore_node_sstableloader(config, temp_dir, backup_name, in_place, keep_aut
             logging.error('No such backup')
             sys.exit(1)
 
-        fqtns_to_restore, ignored_fqtns = filter_fqtns(keyspaces, tables, node_backup.manifest)
+        fqtns_to_restore, ignored_fqtns = filter_fqtns(keyspaces, tables, node_backup.read_manifest())
 
         for fqtns in ignored_fqtns:
             logging.info('Skipping restore of {}'.format(fqtns))
@@ -182,14 +245,25 @@ def restore_node_sstableloader(config, temp_dir, backup_name, in_place, keep_aut
             logging.error('There is nothing to restore')
             sys.exit(0)
 
-        # Download the backup
-        download_dir = temp_dir / 'medusa-restore-{}'.format(uuid.uuid4())
-        logging.info('Downloading data from backup to {}'.format(download_dir))
-        download_data(config.storage, node_backup, fqtns_to_restore, destination=download_dir)
-        invoke_sstableloader(config, download_dir, keep_auth, fqtns_to_restore, cassandra.storage_port,
-                             cassandra.native_port)
-        logging.info('Finished loading backup from {}'.format(fqdn))
+        # tables sstableloader would skip don't get downloaded at all
+        sections = [
+            section for section in node_backup.read_manifest().sections(fqtns_to_restore)
+            if section['objects']
+            and keyspace_is_allowed_to_restore(section['keyspace'], keep_auth, fqtns_to_restore)
+            and table_is_allowed_to_restore(section['keyspace'], section['columnfamily'], fqtns_to_restore)
+        ]
+        jobs.append((node_backup, sections))
 
+    download_dir = temp_dir / 'medusa-restore-{}'.format(uuid.uuid4())
+    download_dir.mkdir(parents=True)
+    if disk_budget is None:
+        disk_budget = shutil.disk_usage(str(download_dir)).free
+    logging.info('Downloading data from backup to {}, using up to {} at once'.format(
+        download_dir, AbstractStorage.human_readable_size(disk_budget)))
+    try:
+        load_sections(config, jobs, download_dir, DiskBudget(disk_budget), cassandra.storage_port,
+                      cassandra.native_port, download_workers, loader_workers)
+    finally:
         # Clean the restored data from local temporary folder
         use_sudo = medusa.utils.evaluate_boolean(config.cassandra.use_sudo)
         clean_path(download_dir, use_sudo, keep_folder=False)
@@ -197,50 +271,174 @@ def restore_node_sstableloader(config, temp_dir, backup_name, in_place, keep_aut
     return node_backup
 
 
-def invoke_sstableloader(config, download_dir, keep_auth, fqtns_to_restore, storage_port, native_port):
+class DiskBudget(object):
+    """
+    How many bytes the downloads of a restore may take at once. A download larger than the whole budget still goes
+    through, on its own.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size):
+        with self._condition:
+            self._condition.wait_for(lambda: self.used == 0 or self.used + size <= self.size)
+            self.used += size
+
+    def release(self, size):
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+class LoadProgress(object):
+    """
+    Counts the tables sstableloader is done with, and logs how far the restore got.
+    """
+
+    def __init__(self, jobs):
+        self.total_tables = sum(len(sections) for _, sections in jobs)
+        self.total_size = sum(section_size(section) for _, sections in jobs for section in sections)
+        self.loaded_tables = 0
+        self.loaded_size = 0
+        self._lock = threading.Lock()
+
+    def loaded(self, fqdn, section):
+        with self._lock:
+            self.loaded_tables += 1
+            self.loaded_size += section_size(section)
+            logging.info('Loaded {}.{} from {} ({}/{} tables, {} of {})'.format(
+                section['keyspace'], section['columnfamily'], fqdn, self.loaded_tables, self.total_tables,
+                AbstractStorage.human_readable_size(self.loaded_size),
+                AbstractStorage.human_readable_size(self.total_size)))
+
+
+def section_size(section):
+    return sum(int(obj['size']) for obj in section['objects'])
+
+
+def load_sections(config, jobs, download_dir, budget, storage_port, native_port,
+                  download_workers=SSTABLELOADER_DOWNLOAD_WORKERS, loader_workers=SSTABLELOADER_WORKERS):
+    """
+    Loads the sections of each (node_backup, sections) job with sstableloader. Up to download_workers nodes get
+    downloaded at once, one table after the other, and each table gets loaded by a pool of loader_workers
+    sstableloader processes as soon as it is downloaded. A table gets deleted once loaded, and the tables downloaded
+    but not loaded yet never take more than the disk budget.
+    """
+    progress = LoadProgress(jobs)
+    failed = threading.Event()
+
+    def load(node_backup, section, table_dir):
+        try:
+            if not failed.is_set():
+                load_table(config, table_dir, storage_port, native_port)
+                progress.loaded(node_backup.fqdn, section)
+        except Exception:
+            failed.set()
+            raise
+        finally:
+            shutil.rmtree(str(table_dir), ignore_errors=True)
+            budget.release(section_size(section))
+
+    loads = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=loader_workers) as loaders:
+        def download_node(node_backup, sections):
+            try:
+                download_node_with_own_storage(
+                    config.storage, node_backup, sections, download_dir, budget, failed,
+                    lambda section, table_dir: loads.append(loaders.submit(load, node_backup, section, table_dir))
+                )
+            except Exception:
+                failed.set()
+                raise
+            logging.info('Finished downloading backup from {}'.format(node_backup.fqdn))
+
+        # a download worker moves on to the next node without waiting for the tables of the previous one to load
+        with concurrent.futures.ThreadPoolExecutor(max_workers=download_workers) as downloaders:
+            nodes = [downloaders.submit(download_node, node_backup, sections) for node_backup, sections in jobs]
+            concurrent.futures.wait(nodes)
+        concurrent.futures.wait(loads)
+        # a failed load stops the downloads, so it comes first
+        for future in loads + nodes:
+            future.result()
+
+
+def download_node_with_own_storage(storage_config, node_backup, sections, download_dir, budget, failed, on_download):
+    """
+    Downloads the sections of a node backup one after the other, within the disk budget, and hands each one over to
+    on_download(section, table_dir). Stops early once failed gets set.
+    """
+    # storage drivers are bound to the event loop of the thread that uses them, so each node gets its own
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        with Storage(config=storage_config) as storage:
+            node_backup = storage.get_node_backup(fqdn=node_backup.fqdn, name=node_backup.name,
+                                                  differential_mode=node_backup.is_differential)
+            for section in sections:
+                budget.acquire(section_size(section))
+                table_dir = download_dir / node_backup.fqdn / section['keyspace'] / section['columnfamily']
+                try:
+                    if failed.is_set():
+                        raise RuntimeError('Stopping the download of {}, a table failed to load'.format(
+                            node_backup.fqdn))
+                    download_section(storage, node_backup, section, table_dir)
+                except Exception:
+                    shutil.rmtree(str(table_dir), ignore_errors=True)
+                    budget.release(section_size(section))
+                    raise
+                on_download(section, table_dir)
+    finally:
+        loop.close()
+
+
+def load_table(config, table_path, storage_port, native_port):
+    """
+    Runs sstableloader on a table folder, logging its output as it comes.
+    """
+    logging.debug('Restoring table {} with sstableloader...'.format(table_path))
+    sstableloader_args = get_sstableloader_args(config, table_path, storage_port, native_port)
+    with subprocess.Popen(sstableloader_args, stdout=subprocess.PIPE) as process:
+        for line in process.stdout:
+            logging.debug(line.decode('utf-8').rstrip('\n'))
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, sstableloader_args)
+
+
+def get_sstableloader_args(config, table_path, storage_port, native_port):
     hostname_resolver = HostnameResolver(medusa.utils.evaluate_boolean(config.cassandra.resolve_ip_addresses),
                                          medusa.utils.evaluate_boolean(
                                              config.kubernetes.enabled if config.kubernetes else False))
     cassandra_is_ccm = int(shlex.split(config.cassandra.is_ccm)[0])
-    keyspaces = os.listdir(str(download_dir))
-    for keyspace in keyspaces:
-        ks_path = os.path.join(str(download_dir), keyspace)
-        if os.path.isdir(ks_path) and keyspace_is_allowed_to_restore(keyspace, keep_auth, fqtns_to_restore):
-            logging.info('Restoring keyspace {} with sstableloader...'.format(ks_path))
-            for table in os.listdir(str(ks_path)):
-                table_path = os.path.join(str(ks_path), table)
-                if os.path.isdir(table_path) and table_is_allowed_to_restore(keyspace, table, fqtns_to_restore):
-                    logging.debug('Restoring table {} with sstableloader...'.format(table))
-                    cql_username = 'foo' if config.cassandra.cql_username is None else config.cassandra.cql_username
-                    cql_password = 'foo' if config.cassandra.cql_password is None else config.cassandra.cql_password
-                    sstableloader_args = [config.cassandra.sstableloader_bin,
-                                          '-d', hostname_resolver.resolve_fqdn() if cassandra_is_ccm == 0
-                                          else '127.0.0.1',
-                                          '--conf-path', config.cassandra.config_file,
-                                          '--username', cql_username,
-                                          '--password', cql_password,
-                                          '--no-progress',
-                                          '--port', str(native_port),
-                                          os.path.join(ks_path, table)]
-                    if storage_port != 7000:
-                        sstableloader_args.append("--storage-port")
-                        sstableloader_args.append(str(storage_port))
-                    if config.cassandra.sstableloader_ts is not None and \
-                            config.cassandra.sstableloader_tspw is not None and \
-                            config.cassandra.sstableloader_ks is not None and \
-                            config.cassandra.sstableloader_kspw is not None:
-                        sstableloader_args.append("-ts")
-                        sstableloader_args.append(config.cassandra.sstableloader_ts)
-                        sstableloader_args.append("-tspw")
-                        sstableloader_args.append(config.cassandra.sstableloader_tspw)
-                        sstableloader_args.append("-ks")
-                        sstableloader_args.append(config.cassandra.sstableloader_ks)
-                        sstableloader_args.append("-kspw")
-                        sstableloader_args.append(config.cassandra.sstableloader_kspw)
-
-                    output = subprocess.check_output(sstableloader_args)
-                    for line in output.decode('utf-8').split('\n'):
-                        logging.debug(line)
+    cql_username = 'foo' if config.cassandra.cql_username is None else config.cassandra.cql_username
+    cql_password = 'foo' if config.cassandra.cql_password is None else config.cassandra.cql_password
+    sstableloader_args = [config.cassandra.sstableloader_bin,
+                          '-d', hostname_resolver.resolve_fqdn() if cassandra_is_ccm == 0
+                          else '127.0.0.1',
+                          '--conf-path', config.cassandra.config_file,
+                          '--username', cql_username,
+                          '--password', cql_password,
+                          '--no-progress',
+                          '--port', str(native_port),
+                          str(table_path)]
+    if storage_port != 7000:
+        sstableloader_args.append("--storage-port")
+        sstableloader_args.append(str(storage_port))
+    if config.cassandra.sstableloader_ts is not None and \
+            config.cassandra.sstableloader_tspw is not None and \
+            config.cassandra.sstableloader_ks is not None and \
+            config.cassandra.sstableloader_kspw is not None:
+        sstableloader_args.append("-ts")
+        sstableloader_args.append(config.cassandra.sstableloader_ts)
+        sstableloader_args.append("-tspw")
+        sstableloader_args.append(config.cassandra.sstableloader_tspw)
+        sstableloader_args.append("-ks")
+        sstableloader_args.append(config.cassandra.sstableloader_ks)
+        sstableloader_args.append("-kspw")
+        sstableloader_args.append(config.cassandra.sstableloader_kspw)
+    return sstableloader_args
 
 
 def keyspace_is_allowed_to_restore(keyspace, keep_auth, fqtns_to_restore):
@@ -290,34 +488,16 @@ def clean_path(p, use_sudo, keep_folder=False):
                 subprocess.check_output(['rm', '-rf', path])
 
 
-def maybe_restore_section(section, download_dir, cassandra_data_dir, in_place, keep_auth, use_sudo=True):
+def maybe_restore_section(section, download_dir, cassandra_data_dir, in_place, keep_auth, use_sudo=True,
+                          direct=False):
     # decide whether to restore files for this table or not
 
     # we restore everything from all keyspaces when restoring in_place
-
-    # when restoring not in_place (i.e. doing a restore test), we skip restoring system.local and system.peers tables
-    # but we delete the ones that are present.
-    # if --keep-auth is set, we won't touch the existing system_auth (won't delete nor overwrite from the backup)
-
-    restore_section = True
-
-    if not in_place:
-        if section['keyspace'] == 'system' and section['columnfamily'].startswith('local-') \
-                or section['columnfamily'].startswith('peers'):
-            restore_section = False
-        if section['keyspace'] == 'system_auth' and keep_auth:
-            logging.info('Keeping section {}.{} untouched'.format(section['keyspace'], section['columnfamily']))
-            return
-
-    # the 'dse' is an arbitrary name we gave to folders that don't sit in the regular place for keyspaces
-    # this is mostly DSE internal files
-    if section['keyspace'] != 'dse':
-        src = download_dir / section['keyspace'] / section['columnfamily']
-        # not appending the column family name because mv later on copies the whole folder
-        dst = cassandra_data_dir / section['keyspace'] / section['columnfamily']
-    else:
-        src = download_dir / section['keyspace'] / section['columnfamily']
-        dst = cassandra_data_dir.parent / section['columnfamily']
+    if keeps_section(section, in_place, keep_auth):
+        logging.info('Keeping section {}.{} untouched'.format(section['keyspace'], section['columnfamily']))
+        return
+    restore_section = restores_section(section, in_place)
+    src, dst = section_paths(section, download_dir, cassandra_data_dir, direct)
 
     # prepare the destination folder
     if dst.exists():
@@ -355,6 +535,179 @@ def maybe_restore_section(section, download_dir, cassandra_data_dir, in_place, k
         subprocess.check_output(['chown', '-R', file_ownership, str(dst)])
 
 
+def keeps_section(section, in_place, keep_auth):
+    # if --keep-auth is set, we won't touch the existing system_auth (won't delete nor overwrite from the backup)
+    return not in_place and section['keyspace'] == 'system_auth' and keep_auth
+
+
+def restores_section(section, in_place):
+    # when restoring not in_place (i.e. doing a restore test), we skip restoring system.local and system.peers tables
+    # but we delete the ones that are present.
+    if not in_place:
+        if section['keyspace'] == 'system' and section['columnfamily'].startswith('local-') \
+                or section['columnfamily'].startswith('peers'):
+            return False
+    return True
+
+
+def section_paths(section, download_dir, cassandra_data_dir, direct=False):
+    # the 'dse' is an arbitrary name we gave to folders that don't sit in the regular place for keyspaces
+    # this is mostly DSE internal files
+    if section['keyspace'] != 'dse':
+        # not appending the column family name because mv later on copies the whole folder
+        dst = cassandra_data_dir / section['keyspace'] / section['columnfamily']
+    else:
+        dst = cassandra_data_dir.parent / section['columnfamily']
+    if direct:
+        # hidden so Cassandra does not take it for a table, and next to the table so it gets renamed into place
+        src = dst.parent / '.{}.medusa-restore'.format(dst.name)
+    else:
+        src = download_dir / section['keyspace'] / section['columnfamily']
+    return src, dst
+
+
+def make_staging_dir(staging_dir, cassandra_data_dir, use_sudo):
+    """
+    Creates an empty staging folder we can download to, on the data volume. The missing folders above it get created
+    for the owner of the data directory.
+    """
+    if use_sudo and os.geteuid() != 0:
+        # the folders of the data volume usually belong to cassandra, but we download to the staging folder
+        owner = cassandra_data_dir.owner()
+        subprocess.check_output(['sudo', '-u', owner, 'mkdir', '-p', str(staging_dir.parent)])
+        subprocess.check_output(['sudo', 'rm', '-rf', str(staging_dir)])
+        subprocess.check_output(['sudo', 'mkdir', str(staging_dir)])
+        subprocess.check_output(['sudo', 'chown', '{}:{}'.format(os.geteuid(), os.getegid()), str(staging_dir)])
+    else:
+        make_dirs(staging_dir.parent, data_dir_ownership(cassandra_data_dir))
+        # left over by a restore that failed
+        shutil.rmtree(str(staging_dir), ignore_errors=True)
+        staging_dir.mkdir()
+
+
+def data_dir_ownership(cassandra_data_dir):
+    data_dir_stat = cassandra_data_dir.stat()
+    return data_dir_stat.st_uid, data_dir_stat.st_gid
+
+
+def make_dirs(path, ownership):
+    missing = []
+    while not path.exists():
+        missing.append(path)
+        path = path.parent
+    for folder in reversed(missing):
+        folder.mkdir()
+        chown_tree(folder, *ownership)
+
+
+def stage_section(storage, node_backup, section, staging_dir, cassandra_data_dir, in_place, keep_auth, use_sudo,
+                  direct=False, local_objects=None):
+    """
+    Downloads a section of the manifest to where place_staged_section() expects it, linking the objects local_objects
+    has a copy of.
+    """
+    if keeps_section(section, in_place, keep_auth) or not restores_section(section, in_place) \
+            or not section['objects']:
+        # nothing to download, placing the section only cleans its folder
+        return
+    src, _ = section_paths(section, staging_dir, cassandra_data_dir, direct)
+    if direct:
+        make_staging_dir(src, cassandra_data_dir, use_sudo)
+    download_section(storage, node_backup, section, src, local_objects)
+
+
+def place_staged_section(section, staging_dir, cassandra_data_dir, in_place, keep_auth, use_sudo, direct=False):
+    # tables get moved and chowned in process, unless only sudo can do it
+    if not use_sudo or os.geteuid() == 0:
+        place_section(section, staging_dir, cassandra_data_dir, in_place, keep_auth,
+                      data_dir_ownership(cassandra_data_dir), direct)
+    else:
+        maybe_restore_section(section, staging_dir, cassandra_data_dir, in_place, keep_auth, use_sudo, direct)
+
+
+def place_staged_sections(sections, staging_dir, cassandra_data_dir, in_place, keep_auth, use_sudo, direct=False,
+                          workers=PLACEMENT_WORKERS):
+    """
+    Moves the sections downloaded by stage_section() into place, with a pool of workers. Cassandra must be stopped
+    already.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        placements = [
+            executor.submit(place_staged_section, section, staging_dir, cassandra_data_dir, in_place, keep_auth,
+                            use_sudo, direct)
+            for section in sections
+        ]
+        for placement in placements:
+            placement.result()
+
+
+def restore_sections_streaming(storage, node_backup, fqtns_to_restore, staging_dir, cassandra_data_dir, in_place,
+                               keep_auth, use_sudo, direct=False, workers=PLACEMENT_WORKERS, local_objects=None):
+    """
+    Downloads the tables one after the other to staging folders on the same filesystem as the data directory: under
+    staging_dir, or next to each table when direct. Each table gets moved into place by a pool of workers as soon as
+    it is downloaded, while the next ones download, so a restore takes about as long as the longest of the two.
+
+    The backup metadata gets downloaded to staging_dir. Cassandra must be stopped already.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        placements = []
+        for section in node_backup.read_manifest().sections(fqtns_to_restore):
+            # fail early rather than downloading the rest of the backup for nothing
+            for placement in placements:
+                if placement.done():
+                    placement.result()
+            stage_section(storage, node_backup, section, staging_dir, cassandra_data_dir, in_place, keep_auth,
+                          use_sudo, direct, local_objects)
+            placements.append(executor.submit(place_staged_section, section, staging_dir, cassandra_data_dir,
+                                              in_place, keep_auth, use_sudo, direct))
+        for placement in placements:
+            placement.result()
+
+    download_metadata(storage, node_backup, staging_dir)
+
+
+def place_section(section, staging_dir, cassandra_data_dir, in_place, keep_auth, ownership, direct=False):
+    """
+    Does what maybe_restore_section() does, in process: the table gets renamed from its staging folder to the data
+    directory, then gets chowned to the given (uid, gid).
+    """
+    if keeps_section(section, in_place, keep_auth):
+        logging.info('Keeping section {}.{} untouched'.format(section['keyspace'], section['columnfamily']))
+        return
+    src, dst = section_paths(section, staging_dir, cassandra_data_dir, direct)
+
+    previous = dst.parent / '.{}.medusa-previous'.format(dst.name)
+    if dst.exists():
+        logging.debug('Cleaning directory {}'.format(dst))
+        shutil.rmtree(str(previous), ignore_errors=True)
+        # the table gets swapped with renames, so it is always either the previous one or the restored one
+        os.rename(str(dst), str(previous))
+    else:
+        logging.debug('Creating directory {}'.format(dst.parent))
+        make_dirs(dst.parent, ownership)
+
+    if restores_section(section, in_place) and section['objects']:
+        logging.debug('Restoring {} -> {}'.format(src, dst))
+        # a rename, unless the staging folder ends up on another filesystem
+        shutil.move(str(src), str(dst))
+        chown_tree(dst, *ownership)
+    elif not section['objects']:
+        logging.debug("Skipping the actual restore of {} - table empty".format(section['columnfamily']))
+    else:
+        logging.debug("Skipping the actual restore of {}".format(section['columnfamily']))
+    shutil.rmtree(str(previous), ignore_errors=True)
+
+
+def chown_tree(path, uid, gid):
+    for root, _, files in os.walk(str(path)):
+        for file_path in [root] + [os.path.join(root, name) for name in files]:
+            file_stat = os.lstat(file_path)
+            # chowning to ourselves does not need privileges, but only root can give files away
+            if file_stat.st_uid != uid or file_stat.st_gid != gid:
+                os.chown(file_path, uid, gid, follow_symlinks=False)
+
+
 def get_node_tokens(node_fqdn, token_map_file):
     token_map = json.load(token_map_file)
     token = token_map[node_fqdn]['tokens']
@@ -124,3 +124,24 @@ class Client:
         except grpc.RpcError as e:
             logging.error("Failed to purge backups due to error: {}".format(e))
             return None
+
+    async def set_bandwidth_limits(self, upload_max_bandwidth='', download_max_bandwidth=''):
+        try:
+            stub = medusa_pb2_grpc.MedusaStub(self.channel)
+            request = medusa_pb2.SetBandwidthLimitsRequest(
+                uploadMaxBandwidth=upload_max_bandwidth,
+                downloadMaxBandwidth=download_max_bandwidth,
+            )
+            return await stub.SetBandwidthLimits(request)
+        except grpc.RpcError as e:
+            logging.error("Failed to set bandwidth limits due to error: {}".format(e))
+            return None
+
+    async def audit_backups(self, samples=0, read_objects=False):
+        try:
+            stub = medusa_pb2_grpc.MedusaStub(self.channel)
+            request = medusa_pb2.AuditBackupsRequest(samples=samples, readObjects=read_objects)
+            return await stub.AuditBackups(request)
+        except grpc.RpcError as e:
+            logging.error("Failed to audit backups due to error: {}".format(e))
+            return None
@@ -54,6 +54,16 @@ class MedusaStub(object):
                 request_serializer=medusa__pb2.PrepareRestoreRequest.SerializeToString,
                 response_deserializer=medusa__pb2.PrepareRestoreResponse.FromString,
                 )
+        self.SetBandwidthLimits = channel.unary_unary(
+                '/Medusa/SetBandwidthLimits',
+                request_serializer=medusa__pb2.SetBandwidthLimitsRequest.SerializeToString,
+                response_deserializer=medusa__pb2.SetBandwidthLimitsResponse.FromString,
+                )
+        self.AuditBackups = channel.unary_unary(
+                '/Medusa/AuditBackups',
+                request_serializer=medusa__pb2.AuditBackupsRequest.SerializeToString,
+                response_deserializer=medusa__pb2.AuditBackupsResponse.FromString,
+                )
 
 
 class MedusaServicer(object):
@@ -107,6 +117,18 @@ class MedusaServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def SetBandwidthLimits(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def AuditBackups(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_MedusaServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -150,6 +172,16 @@ def add_MedusaServicer_to_server(servicer, server):
                     request_deserializer=medusa__pb2.PrepareRestoreRequest.FromString,
                     response_serializer=medusa__pb2.PrepareRestoreResponse.SerializeToString,
             ),
+            'SetBandwidthLimits': grpc.unary_unary_rpc_method_handler(
+                    servicer.SetBandwidthLimits,
+                    request_deserializer=medusa__pb2.SetBandwidthLimitsRequest.FromString,
+                    response_serializer=medusa__pb2.SetBandwidthLimitsResponse.SerializeToString,
+            ),
+            'AuditBackups': grpc.unary_unary_rpc_method_handler(
+                    servicer.AuditBackups,
+                    request_deserializer=medusa__pb2.AuditBackupsRequest.FromString,
+                    response_serializer=medusa__pb2.AuditBackupsResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'Medusa', rpc_method_handlers)
@@ -295,3 +327,37 @@ class Medusa(object):
             medusa__pb2.PrepareRestoreResponse.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def SetBandwidthLimits(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Medusa/SetBandwidthLimits',
+            medusa__pb2.SetBandwidthLimitsRequest.SerializeToString,
+            medusa__pb2.SetBandwidthLimitsResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def AuditBackups(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Medusa/AuditBackups',
+            medusa__pb2.AuditBackupsRequest.SerializeToString,
+            medusa__pb2.AuditBackupsResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
@@ -31,20 +31,26 @@ from grpc_health.v1 import health_pb2_grpc
 
 from medusa import backup_node
 from medusa import purge
+from medusa.audit import AuditedBackups, AuditTotals, BackupAuditor
 from medusa.backup_manager import BackupMan
 from medusa.config import load_config
 from medusa.listing import get_backups
+from medusa.monitoring import Monitoring
 from medusa.purge import delete_backup
 from medusa.restore_cluster import RestoreJob
 from medusa.service.grpc import medusa_pb2
 from medusa.service.grpc import medusa_pb2_grpc
 from medusa.storage import Storage
+from medusa.storage.abstract_storage import AbstractStorage
+from medusa.storage.bandwidth_limiter import bandwidth_limiter
+from medusa.utils import evaluate_boolean
 
 TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
 BACKUP_MODE_DIFFERENTIAL = "differential"
 BACKUP_MODE_FULL = "full"
 RESTORE_MAPPING_LOCATION = "/var/lib/cassandra/.restore_mapping"
 RESTORE_MAPPING_ENV = "RESTORE_MAPPING"
+DEFAULT_AUDIT_SAMPLES = 100
 
 
 class Server:
@@ -130,6 +136,8 @@ class MedusaService(medusa_pb2_grpc.MedusaServicer):
         logging.info("Init service")
         self.config = config
         self.storage_config = config.storage
+        self.audit_totals = AuditTotals()
+        self.audited_backups = AuditedBackups()
 
     async def AsyncBackup(self, request, context):
         # TODO pass the staggered arg
@@ -346,6 +354,53 @@ class MedusaService(medusa_pb2_grpc.MedusaServicer):
             logging.exception("Failed restore prep {} for backup {}".format(request.restoreKey, request.backupName))
         return response
 
+    def SetBandwidthLimits(self, request, context):
+        logging.info("Setting bandwidth limits to '{}' for uploads and '{}' for downloads"
+                     .format(request.uploadMaxBandwidth, request.downloadMaxBandwidth))
+        response = medusa_pb2.SetBandwidthLimitsResponse()
+        try:
+            bandwidth_limiter.set_limits(
+                upload_rate=to_bytes_per_second(request.uploadMaxBandwidth),
+                download_rate=to_bytes_per_second(request.downloadMaxBandwidth),
+            )
+        except ValueError as e:
+            context.set_details("invalid bandwidth limit: {}".format(e))
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+        response.uploadBytesPerSecond = bandwidth_limiter.upload.rate
+        response.downloadBytesPerSecond = bandwidth_limiter.download.rate
+        return response
+
+    def AuditBackups(self, request, context):
+        samples = request.samples or DEFAULT_AUDIT_SAMPLES
+        logging.info("Auditing {} random objects of the backups".format(samples))
+        response = medusa_pb2.AuditBackupsResponse()
+        try:
+            with Storage(config=self.storage_config) as connected_storage:
+                auditor = BackupAuditor(
+                    connected_storage, self.audit_totals, Monitoring(config=self.config.monitoring),
+                    read_objects=request.readObjects,
+                    enable_md5_checks=evaluate_boolean(self.config.checks.enable_md5_checks),
+                    backups=self.audited_backups
+                )
+                audit_round = auditor.audit(samples)
+            response.sampledObjects = audit_round.sampled_objects
+            response.verifiedBytes = audit_round.verified_bytes
+            response.corruptedObjects.extend(audit_round.corrupted)
+        except Exception as e:
+            context.set_details("auditing backups failed: {}".format(e))
+            context.set_code(grpc.StatusCode.INTERNAL)
+            logging.exception("Auditing backups failed")
+        response.totalSampledObjects = self.audit_totals.sampled_objects
+        response.totalVerifiedBytes = self.audit_totals.verified_bytes
+        response.totalCorruptedObjects = self.audit_totals.corrupted_objects
+        return response
+
+
+def to_bytes_per_second(bandwidth):
+    if not bandwidth:
+        return None
+    return AbstractStorage._human_size_to_bytes(bandwidth)
+
 
 def set_overall_status(get_backups_response):
     get_backups_response.overallStatus = medusa_pb2.StatusType.UNKNOWN
@@ -35,6 +35,8 @@ def status(config, backup_name, output):
                 print(json.dumps({}))
             sys.exit(1)
 
+        storage.prefetch_cluster_backups([cluster_backup], tokenmap=True, stats=True)
+
         if output == 'json':
             status_json = cluster_backup.to_json_dict()
             print(json.dumps(status_json, ensure_ascii=False, sort_keys=True))
@@ -74,3 +76,11 @@ def status(config, backup_name, output):
             cluster_backup.num_objects(),
             format_bytes_str(cluster_backup.size())
         ))
+
+        node_stats = [node_backup.stats for node_backup in complete_nodes]
+        if cluster_backup.backup_type == 'differential' and node_stats \
+                and all(stats.reused_size is not None for stats in node_stats):
+            print('- {} uploaded, {} reused from previous backups'.format(
+                format_bytes_str(sum(stats.new_size for stats in node_stats)),
+                format_bytes_str(sum(stats.reused_size for stats in node_stats))
+            ))
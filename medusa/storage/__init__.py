@@ -29,13 +29,18 @@ import medusa.index
 
 from medusa.storage.cluster_backup import ClusterBackup
 from medusa.storage.node_backup import NodeBackup
-from medusa.storage.abstract_storage import ManifestObject, AbstractBlob
+from medusa.storage.abstract_storage import AbstractStorage, ManifestObject, AbstractBlob
 from medusa.storage.google_storage import GoogleStorage
 from medusa.storage.local_storage import LocalStorage
 from medusa.storage.s3_storage import S3Storage
 from medusa.storage.s3_rgw import S3RGWStorage
 from medusa.storage.azure_storage import AzureStorage
+from medusa.storage.backup_catalog import BackupCatalog
+from medusa.storage.reference_index import ReferenceIndex
+from medusa.storage.bandwidth_limiter import bandwidth_limiter
+from medusa.storage.manifest import MANIFEST_FORMAT_JSON
 from medusa.storage.s3_base_storage import S3BaseStorage
+from medusa.storage.uploaded_objects_cache import UploadedObjectsCache
 from medusa.utils import evaluate_boolean
 
 
@@ -45,6 +50,10 @@ from medusa.utils import evaluate_boolean
 INDEX_BLOB_NAME_PATTERN = re.compile('.*(tokenmap|schema|manifest|differential|incremental)_(.*)$')
 INDEX_BLOB_WITH_TIMESTAMP_PATTERN = re.compile('.*(started|finished)_(.*)_([0-9]+).timestamp$')
 
+# list_node_backups checks if node backups exist by batches, starting with this many and doubling each time
+EXISTENCE_CHECKS_FIRST_BATCH = 10
+EXISTENCE_CHECKS_MAX_BATCH = 1000
+
 
 def divide_chunks(values, step):
     """
@@ -73,6 +82,9 @@ class Storage(object):
         self.prefix_path = str(self._prefix) + '/' if len(str(self._prefix)) > 1 else ''
         self.storage_driver = self._load_storage()
         self.storage_provider = self._config.storage_provider
+        self.uploaded_objects_cache = self._load_uploaded_objects_cache()
+        self.backup_catalog = BackupCatalog(self)
+        self._configure_bandwidth_limiter()
 
     def __enter__(self):
         self.storage_driver.connect()
@@ -105,10 +117,46 @@ class Storage(object):
 
         raise NotImplementedError("Unsupported storage provider")
 
+    def _load_uploaded_objects_cache(self) -> t.Optional[UploadedObjectsCache]:
+        if not self._config.uploaded_objects_cache_file:
+            return None
+        data_prefix = self._get_table_prefix(self._config.prefix, self._config.fqdn)
+        reconcile_interval_in_hours = float(self._config.uploaded_objects_cache_reconcile_interval_in_hours or 0)
+        return UploadedObjectsCache(
+            path=self._config.uploaded_objects_cache_file,
+            scope='{}://{}/{}'.format(self._config.storage_provider, self._config.bucket_name, data_prefix),
+            reconcile_interval_seconds=reconcile_interval_in_hours * 3600
+        )
+
+    def _configure_bandwidth_limiter(self):
+        def to_bytes_per_second(value):
+            return AbstractStorage._human_size_to_bytes(str(value)) if value else None
+
+        default_rate = to_bytes_per_second(self._config.transfer_max_bandwidth) or 0
+        upload_rate = to_bytes_per_second(self._config.transfer_max_upload_bandwidth)
+        download_rate = to_bytes_per_second(self._config.transfer_max_download_bandwidth)
+        bandwidth_limiter.configure(
+            upload_rate=default_rate if upload_rate is None else upload_rate,
+            download_rate=default_rate if download_rate is None else download_rate,
+        )
+
     @property
     def config(self):
         return self._config
 
+    @property
+    def transfer_concurrency(self) -> int:
+        """
+        How many files the storage currently transfers at once, which changes over time with adaptive_concurrency.
+        """
+        return self.storage_driver.transfer_concurrency.limit
+
+    @property
+    def manifest_format(self) -> str:
+        if 'manifest_format' in dir(self._config) and self._config.manifest_format:
+            return self._config.manifest_format
+        return MANIFEST_FORMAT_JSON
+
     @retry(stop=stop_after_attempt(7), wait=wait_exponential(multiplier=10, max=120))
     def get_node_backup(self, *, fqdn, name, differential_mode=False):
         return NodeBackup(
@@ -161,10 +209,138 @@ class Storage(object):
 
     def list_node_backups(self, *, fqdn=None, backup_index_blobs=None):
         """
-        Lists node backups using the index.
+        Lists node backups using the backup catalog, or the index if there is no catalog yet or if the index blobs
+        are given.
         If there is no backup index, no backups will be found.
         Use discover_node_backups to discover backups from the data folders.
         """
+        catalog_entries = self.backup_catalog.entries() if backup_index_blobs is None else None
+
+        if catalog_entries is not None:
+            node_backups = [
+                NodeBackup(storage=self, fqdn=entry.fqdn, name=entry.name,
+                           started_timestamp=entry.started, finished_timestamp=entry.finished,
+                           differential_mode=entry.differential)
+                for entry in catalog_entries
+                if fqdn is None or entry.fqdn == fqdn
+            ]
+        else:
+            if backup_index_blobs is None:
+                backup_index_blobs = self.list_backup_index_blobs()
+            node_backups = self.node_backups_from_index(backup_index_blobs, fqdn=fqdn)
+
+        if len(node_backups) == 0:
+            logging.info('No backups found in index. Consider running "medusa build-index" if you have some backups')
+
+        # once we have all the backups, we sort them by their start time. we get oldest ones first
+        sorted_node_backups = sorted(
+            # before sorting the backups, ensure we can work out at least their start time
+            filter(lambda nb: nb.started is not None, node_backups),
+            key=lambda nb: nb.started
+        )
+
+        # then, before returning the backups, we pick only the existing ones
+        previous_existed = False
+        to_check = sorted_node_backups
+        batch_size = EXISTENCE_CHECKS_FIRST_BATCH
+        while to_check:
+            batch, to_check = to_check[:batch_size], to_check[batch_size:]
+            # we check a growing batch of backups at once, which usually ends at the first batch
+            if not previous_existed:
+                self.check_node_backups_exist(batch)
+                batch_size = min(batch_size * 2, EXISTENCE_CHECKS_MAX_BATCH)
+            for node_backup in batch:
+                # we try to be smart here - once we have seen an existing one, we assume all later ones exist too
+                if previous_existed:
+                    yield node_backup
+                    continue
+
+                # the idea is to save .exist() calls as they actually go to the storage backend and cost something
+                # this is mostly meant to handle the transition period when backups expire before the index does,
+                # which is a consequence of the transition period and running the build-index command
+
+                if node_backup.exists():
+                    previous_existed = True
+                    yield node_backup
+                else:
+                    logging.debug('Backup {} for fqdn {} present only in index'.format(
+                        node_backup.name, node_backup.fqdn
+                    ))
+                    # if a backup doesn't exist, we should remove its entry from the index too
+                    try:
+                        self.remove_backup_from_index(node_backup)
+                    except Exception:
+                        logging.debug(
+                            'This account cannot perform the cleanup_storage'
+                            '{} for fqdn {} present only in index.'
+                            'Ignoring and continuing...'
+                            .format(node_backup.name, node_backup.fqdn))
+
+    def check_node_backups_exist(self, node_backups):
+        """
+        Finds out which of the node backups exist, with concurrent requests, so node_backup.exists() does not have to.
+        """
+        schema_blobs = self.storage_driver.get_blobs([node_backup.schema_path for node_backup in node_backups])
+        for node_backup in node_backups:
+            node_backup.cache_blob(node_backup.schema_path, schema_blobs[str(node_backup.schema_path)])
+
+    def prefetch_node_backups(self, node_backups, *, manifest=False, tokenmap=False, server_version=False,
+                              stats=False):
+        """
+        Reads the requested meta blobs of all the node backups with concurrent requests, and caches them in the node
+        backups. What is already cached does not get read again.
+
+        Reading the stats also reads the manifests of the backups that have no stats, which is where the stats then
+        come from.
+        """
+        node_backups = list(node_backups)
+        self._prefetch([
+            (node_backup, path)
+            for node_backup in node_backups
+            for path, wanted in [
+                (node_backup.manifest_path, manifest and node_backup.cached_manifest_content is None),
+                (node_backup.tokenmap_path, tokenmap),
+                (node_backup.server_version_path, server_version),
+                (node_backup.stats_path, stats and node_backup.cached_stats is None),
+            ]
+            if wanted and not node_backup.is_cached(path)
+        ])
+        if stats:
+            self._prefetch([
+                (node_backup, node_backup.manifest_path)
+                for node_backup in node_backups
+                if node_backup.cached_stats is None and node_backup.is_missing(node_backup.stats_path)
+                and node_backup.cached_manifest_content is None and not node_backup.is_cached(node_backup.manifest_path)
+            ])
+
+    def prefetch_cluster_backups(self, cluster_backups, *, manifest=False, tokenmap=False, server_version=False,
+                                 stats=False):
+        """
+        Same as prefetch_node_backups(), for all the node backups of the cluster backups. The tokenmap only gets read
+        from the node backup the cluster backup takes it from.
+        """
+        cluster_backups = list(cluster_backups)
+        self.prefetch_node_backups(
+            [node_backup for cluster_backup in cluster_backups for node_backup in cluster_backup.node_backups.values()],
+            manifest=manifest, server_version=server_version, stats=stats
+        )
+        if tokenmap:
+            self.prefetch_node_backups(
+                [cluster_backup.first_node_backup for cluster_backup in cluster_backups], tokenmap=True
+            )
+
+    def _prefetch(self, requests):
+        if not requests:
+            return
+        logging.debug('Prefetching {} meta blobs'.format(len(requests)))
+        contents = self.storage_driver.get_blobs_contents([path for _, path in requests])
+        for node_backup, path in requests:
+            node_backup.cache_content(path, contents[str(path)])
+
+    def node_backups_from_index(self, backup_index_blobs, *, fqdn=None):
+        """
+        Builds the node backups found in the given backup index blobs, without checking they exist.
+        """
 
         def is_tokenmap_file(blob):
             return "tokenmap" in blob.name
@@ -180,16 +356,10 @@ class Storage(object):
         def get_blobs_for_fqdn(blobs, fqdn):
             return list(filter(lambda b: f'_{fqdn}.' in b, blobs))
 
-        if backup_index_blobs is None:
-            backup_index_blobs = self.list_backup_index_blobs()
-
         blobs_by_backup = self.group_backup_index_by_backup_and_node(backup_index_blobs)
 
         all_backup_blob_names = get_all_backup_blob_names(backup_index_blobs)
 
-        if len(all_backup_blob_names) == 0:
-            logging.info('No backups found in index. Consider running "medusa build-index" if you have some backups')
-
         # possibly filter out backups only for given fqdn
         if fqdn is not None:
             relevant_backup_names = get_blobs_for_fqdn(all_backup_blob_names, fqdn)
@@ -236,39 +406,7 @@ class Storage(object):
                             differential_blob=differential_blob if differential_blob is not None else incremental_blob)
             node_backups.append(nb)
 
-        # once we have all the backups, we sort them by their start time. we get oldest ones first
-        sorted_node_backups = sorted(
-            # before sorting the backups, ensure we can work out at least their start time
-            filter(lambda nb: nb.started is not None, node_backups),
-            key=lambda nb: nb.started
-        )
-
-        # then, before returning the backups, we pick only the existing ones
-        previous_existed = False
-        for node_backup in sorted_node_backups:
-            # we try to be smart here - once we have seen an existing one, we assume all later ones exist too
-            if previous_existed:
-                yield node_backup
-                continue
-
-            # the idea is to save .exist() calls as they actually go to the storage backend and cost something
-            # this is mostly meant to handle the transition period when backups expire before the index does,
-            # which is a consequence of the transition period and running the build-index command
-
-            if node_backup.exists():
-                previous_existed = True
-                yield node_backup
-            else:
-                logging.debug('Backup {} for fqdn {} present only in index'.format(node_backup.name, node_backup.fqdn))
-                # if a backup doesn't exist, we should remove its entry from the index too
-                try:
-                    self.remove_backup_from_index(node_backup)
-                except Exception:
-                    logging.debug(
-                        'This account cannot perform the cleanup_storage'
-                        '{} for fqdn {} present only in index.'
-                        'Ignoring and continuing...'
-                        .format(node_backup.name, node_backup.fqdn))
+        return node_backups
 
     def list_backup_index_blobs(self):
         path = '{}index/backup_index'.format(self.prefix_path)
@@ -444,11 +582,10 @@ class Storage(object):
         Then we can call the delete object on the results.
         """
         markers = self.storage_driver.list_objects('{}index/latest_backup/{}/'.format(self.prefix_path, fqdn))
-        for marker in markers:
-            self.storage_driver.delete_object(marker)
+        self.storage_driver.delete_objects(markers)
 
     def delete_objects(self, objects, concurrent_transfers=None):
-        self.storage_driver.delete_objects(objects, concurrent_transfers)
+        return self.storage_driver.delete_objects(objects, concurrent_transfers)
 
     @staticmethod
     def sanitize_keyspace_and_table_name(path: pathlib.Path) -> t.Tuple[str, str]:
@@ -498,16 +635,39 @@ class Storage(object):
             prefix = ""
         return f"{prefix}{fqdn}/data/"
 
-    def list_files_per_table(self) -> t.Dict[str, t.Dict[str, t.Set[ManifestObject]]]:
+    def list_files_per_table(self) -> t.Dict[str, t.Dict[str, t.Dict[str, ManifestObject]]]:
         fdns_data_prefix = self._get_table_prefix(self.config.prefix, self.config.fqdn)
-        all_blobs: t.List[AbstractBlob] = self.storage_driver.list_blobs(prefix=fdns_data_prefix)
-        all_files = [ManifestObject(blob.name, blob.size, blob.hash) for blob in all_blobs]
-        keyspace_table_mo_tuples = map(Storage.get_keyspace_and_table, all_files)
+
+        if self._uploaded_objects_cache_is_fresh():
+            logging.debug('Using the uploaded objects cache instead of listing {}'.format(fdns_data_prefix))
+            manifest_objects = self.uploaded_objects_cache.objects()
+        else:
+            # the listing of a node's data folder can be huge, so we stream it instead of materialising it first
+            all_blobs: t.Iterator[AbstractBlob] = self.storage_driver.iter_blobs(prefix=fdns_data_prefix)
+            if self.uploaded_objects_cache is not None:
+                all_blobs = self.uploaded_objects_cache.reconcile(all_blobs)
+            manifest_objects = (ManifestObject(blob.name, blob.size, blob.hash) for blob in all_blobs)
 
         files_by_keyspace_and_table = dict()
-        for ks, ks_files in itertools.groupby(keyspace_table_mo_tuples, lambda t: t[0]):
-            files_by_keyspace_and_table[ks] = dict()
-            for tt, t_files in itertools.groupby(ks_files, lambda tf: tf[1]):
-                files_by_keyspace_and_table[ks][tt] = {pathlib.Path(tf[2].path).name: tf[2] for tf in t_files}
+        for manifest_object in manifest_objects:
+            ks, tt, mo = Storage.get_keyspace_and_table(manifest_object)
+            files_by_keyspace_and_table.setdefault(ks, dict()).setdefault(tt, dict())[pathlib.Path(mo.path).name] = mo
 
         return files_by_keyspace_and_table
+
+    def _uploaded_objects_cache_is_fresh(self) -> bool:
+        if self.uploaded_objects_cache is None or not self.uploaded_objects_cache.is_fresh():
+            return False
+        # purges running on other hosts delete objects of this node without updating its cache. they remove backups
+        # from the reference index of the node or compact it first, so the cache is stale if that happened since
+        # the last listing. segment timestamps are truncated to the second, hence the floor
+        last_removal = ReferenceIndex(self, self.config.fqdn).last_removal()
+        return last_removal is None or last_removal < int(self.uploaded_objects_cache.reconciled_at())
+
+    def record_uploaded_objects(self, objects: t.Iterable[ManifestObject]):
+        if self.uploaded_objects_cache is not None:
+            self.uploaded_objects_cache.add(objects)
+
+    def forget_uploaded_objects(self, paths: t.Iterable[str]):
+        if self.uploaded_objects_cache is not None:
+            self.uploaded_objects_cache.forget(paths)
@@ -21,12 +21,18 @@ import datetime
 import hashlib
 import io
 import logging
+import os
 import pathlib
+import time
 import typing as t
 
 from pathlib import Path
 from tenacity import retry, stop_after_attempt, wait_exponential, wait_fixed
 
+from medusa.storage.bandwidth_limiter import bandwidth_limiter
+from medusa.storage.concurrency_controller import ConcurrencyController
+from medusa.utils import evaluate_boolean
+
 
 BLOCK_SIZE_BYTES = 65536
 MULTIPART_BLOCK_SIZE_BYTES = 65536
@@ -34,6 +40,10 @@ MULTIPART_BLOCK_SIZE_BYTES = 65536
 # when the storage backend doesn't have a configured chunk size to pass in
 DEFAULT_MULTIPART_PART_SIZE_BYTES = 8 * 1024 * 1024
 MAX_UP_DOWN_LOAD_RETRIES = 5
+# how many blobs iter_blobs() pulls from the storage backend at a time
+LIST_PAGE_SIZE = 1000
+# how many small requests (HEAD, GET of metadata files, list pages, deletes...) can be in flight at once
+MAX_CONCURRENT_METADATA_REQUESTS = 10
 
 
 AbstractBlob = collections.namedtuple('AbstractBlob', ['name', 'size', 'hash', 'last_modified', 'storage_class'])
@@ -43,20 +53,71 @@ AbstractBlobMetadata = collections.namedtuple('AbstractBlobMetadata',
 
 ManifestObject = collections.namedtuple('ManifestObject', ['path', 'size', 'MD5'])
 
+# a page of the listing of one of the prefixes given to iter_blobs_concurrently(). started is the time.monotonic()
+# at which the listing of the prefix started, last tells the listing of the prefix is over
+ListingPage = collections.namedtuple('ListingPage', ['prefix', 'blobs', 'started', 'last'])
+
 
 class ObjectDoesNotExistError(Exception):
     pass
 
 
+def note_throttled_attempt(retry_state):
+    """
+    tenacity before_sleep hook for the transfer methods of the storage drivers, which tells the concurrency
+    controller about the attempts the storage rejected because we sent too much.
+    """
+    storage, exception = retry_state.args[0], retry_state.outcome.exception()
+    if exception is not None and storage._is_throttling_error(exception):
+        storage.transfer_concurrency.throttled()
+
+
 class AbstractStorage(abc.ABC):
 
     # still not certain what precisely this is used for
     # sometimes we store Cassandra version in this it seems
     api_version = None
 
+    # whether the listings of the storage come sorted by blob name, which is the case for the cloud storages
+    listings_are_sorted = True
+
     def __init__(self, config):
         self.config = config
         self.bucket_name = config.bucket_name
+        self._transfer_concurrency = None
+
+    @staticmethod
+    def _uses_adaptive_concurrency(config) -> bool:
+        return 'adaptive_concurrency' in dir(config) and evaluate_boolean(config.adaptive_concurrency or 'False')
+
+    @staticmethod
+    def max_concurrent_transfers(config) -> int:
+        """
+        The most transfers that can run at once, which the thread and connection pools of the drivers are sized for.
+        """
+        concurrent_transfers = int(config.concurrent_transfers)
+        if AbstractStorage._uses_adaptive_concurrency(config) and config.max_concurrent_transfers:
+            return max(int(config.max_concurrent_transfers), concurrent_transfers)
+        return concurrent_transfers
+
+    @property
+    def transfer_concurrency(self) -> ConcurrencyController:
+        """
+        Decides how many files get uploaded or downloaded at once, see ConcurrencyController.
+        """
+        if self._transfer_concurrency is None:
+            self._transfer_concurrency = ConcurrencyController(
+                initial=int(self.config.concurrent_transfers),
+                maximum=AbstractStorage.max_concurrent_transfers(self.config),
+                adaptive=AbstractStorage._uses_adaptive_concurrency(self.config),
+            )
+        return self._transfer_concurrency
+
+    def _is_throttling_error(self, exception: Exception) -> bool:
+        """
+        Tells if an error means the storage wants us to slow down. Drivers override this for their own errors.
+        """
+        return False
 
     @abc.abstractmethod
     def connect(self):
@@ -87,6 +148,100 @@ class AbstractStorage(abc.ABC):
     async def _list_blobs(self, prefix=None):
         raise NotImplementedError()
 
+    def iter_blobs(self, prefix=None) -> t.Iterator[AbstractBlob]:
+        """
+        Lists the blobs having the given prefix lazily, one page at a time.
+
+        Unlike list_blobs(), this never holds more than a page of blobs in memory, so it should be preferred for
+        listings that can get big (such as the data folder of a node doing differential backups) whenever each blob
+        only needs to be looked at once.
+        """
+        loop = self.get_or_create_event_loop()
+        blobs = self._iter_blobs(prefix)
+        try:
+            while True:
+                page = loop.run_until_complete(self._next_blobs_page(blobs, LIST_PAGE_SIZE))
+                if len(page) == 0:
+                    return
+                yield from page
+        finally:
+            loop.run_until_complete(blobs.aclose())
+
+    def iter_blobs_concurrently(
+            self,
+            prefixes: t.Iterable[t.Union[Path, str]],
+            concurrency: int = MAX_CONCURRENT_METADATA_REQUESTS
+    ) -> t.Iterator[ListingPage]:
+        """
+        Lists several prefixes at once, giving the pages of their listings as they come.
+
+        The pages of a prefix come in order and their blobs are sorted by name, but the pages of different prefixes
+        are interleaved. Each listing ends with a page whose last is True. Listings only move on as fast as their
+        pages get consumed, so this never holds more than a few pages per prefix in memory.
+        """
+        prefixes = [str(prefix) for prefix in prefixes]
+        loop = self.get_or_create_event_loop()
+        pages = asyncio.Queue(maxsize=concurrency)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def list_prefix(prefix: str):
+            try:
+                async with semaphore:
+                    started = time.monotonic()
+                    blobs = self._iter_blobs(prefix)
+                    if not self.listings_are_sorted:
+                        blobs = self._sorted_blobs(blobs)
+                    try:
+                        while len(page := await self._next_blobs_page(blobs, LIST_PAGE_SIZE)) > 0:
+                            await pages.put(ListingPage(prefix, page, started, False))
+                    finally:
+                        await blobs.aclose()
+                    await pages.put(ListingPage(prefix, [], started, True))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await pages.put(e)
+
+        tasks = [loop.create_task(list_prefix(prefix)) for prefix in prefixes]
+        remaining = len(tasks)
+        try:
+            while remaining > 0:
+                page = loop.run_until_complete(pages.get())
+                if isinstance(page, Exception):
+                    raise page
+                if page.last:
+                    remaining -= 1
+                yield page
+        finally:
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+
+    @staticmethod
+    async def _sorted_blobs(blobs: t.AsyncIterator[AbstractBlob]) -> t.AsyncIterator[AbstractBlob]:
+        # for storages whose listings are not sorted, which means holding the whole listing
+        for blob in sorted([blob async for blob in blobs], key=lambda b: b.name):
+            yield blob
+
+    @staticmethod
+    async def _next_blobs_page(
+            blobs: t.AsyncIterator[AbstractBlob],
+            page_size: int
+    ) -> t.List[AbstractBlob]:
+        page = []
+        # breaking out of the loop leaves the generator open, so the next page resumes where this one stopped
+        async for blob in blobs:
+            page.append(blob)
+            if len(page) >= page_size:
+                break
+        return page
+
+    async def _iter_blobs(self, prefix=None) -> t.AsyncIterator[AbstractBlob]:
+        # storage drivers able to page through their listings override this,
+        # the default is to get the whole listing at once
+        for blob in await self._list_blobs(prefix):
+            yield blob
+
     def upload_blobs_from_strings(
             self,
             key_content_pairs: t.List[t.Tuple[str, str]],
@@ -122,9 +277,11 @@ class AbstractStorage(abc.ABC):
     def upload_blob_from_string(self, path, content, encoding="utf-8"):
         headers = self.additional_upload_headers()
 
-        # Upload a string content to the provided path in the bucket
+        # Upload a string (or bytes) content to the provided path in the bucket
+        if not isinstance(content, bytes):
+            content = bytes(content, encoding)
         obj = self.upload_object_via_stream(
-            data=io.BytesIO(bytes(content, encoding)),
+            data=io.BytesIO(content),
             object_name=str(path),
             headers=headers,
         )
@@ -152,17 +309,150 @@ class AbstractStorage(abc.ABC):
         loop.run_until_complete(self._download_blobs(srcs, dest))
 
     async def _download_blobs(self, srcs: t.List[t.Union[Path, str]], dest: t.Union[Path, str]):
-        chunk_size = int(self.config.concurrent_transfers)
-        # split srcs into chunk-sized chunks
-        chunks = [srcs[i:i + chunk_size] for i in range(0, len(srcs), chunk_size)]
-        for chunk in chunks:
-            coros = [self._download_blob(src, dest) for src in map(str, chunk)]
-            await asyncio.gather(*coros)
+        async def bounded_download(src: str):
+            async with self.transfer_concurrency.slot() as transfer:
+                await self._download_blob(src, dest)
+                transfer.completed(AbstractStorage._downloaded_size(src, dest))
+
+        await asyncio.gather(*(bounded_download(src) for src in map(str, srcs)))
+
+    @staticmethod
+    def _downloaded_size(src: str, dest: t.Union[Path, str]) -> t.Optional[int]:
+        try:
+            return os.path.getsize(AbstractStorage.path_maybe_with_parent(str(dest), Path(src)))
+        except OSError:
+            return None
 
     @abc.abstractmethod
     async def _download_blob(self, src: str, dest: str):
         raise NotImplementedError()
 
+    def _read_blob_range(self, object_key: str, start: int, end: int) -> t.AsyncIterator[bytes]:
+        """
+        Streams a byte range of an object. Storage backends able to do ranged reads implement this, which lets them
+        download big objects with _download_blob_in_ranges(), and read them back with stream_blob().
+
+        :param object_key: the object to read
+        :param start: offset of the first byte to read
+        :param end: offset of the last byte to read, inclusive
+        :return: the bytes of the range, chunk by chunk
+        """
+        raise NotImplementedError()
+
+    async def _download_blob_in_ranges(
+            self,
+            object_key: str,
+            size: int,
+            file_path: str,
+            range_size: int,
+            connections: asyncio.Semaphore
+    ):
+        """
+        Downloads an object over several connections, each of them fetching a different byte range.
+
+        The file gets preallocated and each range is written in place, so ranges can complete in any order. Every range
+        holds one of the connections while it downloads, so a big object uses the connections other transfers leave.
+
+        :param object_key: the object to download
+        :param size: the size of the object
+        :param file_path: where to write the object
+        :param range_size: how many bytes to fetch per request
+        :param connections: the connection budget, shared with the other transfers
+        """
+        loop = asyncio.get_event_loop()
+        Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except (AttributeError, OSError):
+                # not every platform or file system supports it, we then just size the file
+                os.ftruncate(fd, size)
+
+            async def download_range(start: int, end: int):
+                async with connections:
+                    offset = start
+                    chunks = bandwidth_limiter.download.throttle(self._read_blob_range(object_key, start, end))
+                    async for chunk in chunks:
+                        await loop.run_in_executor(None, AbstractStorage._pwrite_all, fd, chunk, offset)
+                        offset += len(chunk)
+                if offset != end + 1:
+                    raise IOError('Got {} bytes instead of {} for range {}-{} of {}'.format(
+                        offset - start, end + 1 - start, start, end, object_key
+                    ))
+
+            tasks = [
+                asyncio.ensure_future(download_range(start, min(start + range_size, size) - 1))
+                for start in range(0, size, range_size)
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            except Exception:
+                # make sure no range is still writing once we close the file
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+        finally:
+            os.close(fd)
+
+    def stream_blob(
+            self,
+            object_key: str,
+            size: int,
+            range_size: int = DEFAULT_MULTIPART_PART_SIZE_BYTES,
+            connections: int = MAX_CONCURRENT_METADATA_REQUESTS
+    ) -> t.Iterator[bytes]:
+        """
+        Reads an object back, in order, while fetching up to `connections` of its byte ranges at once.
+
+        Ranges are buffered until their turn comes, so this holds up to connections * range_size bytes in memory.
+        Reads are throttled by the download bandwidth limit.
+
+        :param object_key: the object to read
+        :param size: the size of the object
+        :param range_size: how many bytes to fetch per request
+        :param connections: how many ranges to fetch concurrently
+        :return: the content of the object, range by range
+        """
+        loop = self.get_or_create_event_loop()
+
+        async def read_range(start: int, end: int) -> bytes:
+            chunks = [
+                chunk
+                async for chunk in bandwidth_limiter.download.throttle(self._read_blob_range(object_key, start, end))
+            ]
+            data = b''.join(chunks)
+            if len(data) != end + 1 - start:
+                raise IOError('Got {} bytes instead of {} for range {}-{} of {}'.format(
+                    len(data), end + 1 - start, start, end, object_key
+                ))
+            return data
+
+        ranges = ((start, min(start + range_size, size) - 1) for start in range(0, size, range_size))
+        pending = collections.deque()
+        try:
+            for start, end in ranges:
+                pending.append(loop.create_task(read_range(start, end)))
+                if len(pending) < max(connections, 1):
+                    continue
+                yield loop.run_until_complete(pending.popleft())
+            while pending:
+                yield loop.run_until_complete(pending.popleft())
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+
+    @staticmethod
+    def _pwrite_all(fd: int, data: bytes, offset: int):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+
     def upload_blobs(self, srcs: t.List[t.Union[Path, str]], dest: str) -> t.List[ManifestObject]:
         """
         Uploads a list of files from the local storage into the remote storage system
@@ -175,13 +465,54 @@ class AbstractStorage(abc.ABC):
         return manifest_objects
 
     async def _upload_blobs(self, srcs: t.List[t.Union[Path, str]], dest: str) -> t.List[ManifestObject]:
-        semaphore = asyncio.Semaphore(int(self.config.concurrent_transfers))
+        return await asyncio.gather(*(self._bounded_upload(src, dest) for src in map(str, srcs)))
 
-        async def bounded_upload(src: str) -> ManifestObject:
-            async with semaphore:
-                return await self._upload_blob(src, dest)
+    async def _bounded_upload(self, src: str, dest: str) -> ManifestObject:
+        async with self.transfer_concurrency.slot() as transfer:
+            manifest_object = await self._upload_blob(src, dest)
+            transfer.completed(manifest_object.size)
+            return manifest_object
+
+    def upload_blobs_in_batches(
+            self,
+            batches: t.Iterable[t.Tuple[t.List[t.Union[Path, str]], str]]
+    ) -> t.List[t.List[ManifestObject]]:
+        """
+        Uploads several batches of files, each going to its own destination, through a single transfer queue.
+
+        Unlike calling upload_blobs() once per batch, concurrent_transfers applies to all the batches together, so
+        a batch with a few big files does not hold back the ones after it. The batches iterable is consumed in a
+        worker thread while the uploads are running, which lets the caller do blocking work (such as checking what
+        is already in storage) to produce the next batch without stalling the transfers already queued.
+
+        :param batches: an iterable of (srcs, dest) tuples, with the same meaning as in upload_blobs()
+        :return: a list with the ManifestObjects of each batch, in the order the batches were produced
+        """
+        loop = self.get_or_create_event_loop()
+        return loop.run_until_complete(self._upload_blobs_in_batches(batches))
+
+    async def _upload_blobs_in_batches(
+            self,
+            batches: t.Iterable[t.Tuple[t.List[t.Union[Path, str]], str]]
+    ) -> t.List[t.List[ManifestObject]]:
+        loop = asyncio.get_event_loop()
+        batches_iterator = iter(batches)
 
-        return await asyncio.gather(*(bounded_upload(src) for src in map(str, srcs)))
+        batch_futures = []
+        try:
+            while True:
+                batch = await loop.run_in_executor(None, next, batches_iterator, None)
+                if batch is None:
+                    break
+                srcs, dest = batch
+                batch_futures.append(
+                    asyncio.gather(*(self._bounded_upload(src, dest) for src in map(str, srcs)))
+                )
+            return [list(manifest_objects) for manifest_objects in await asyncio.gather(*batch_futures)]
+        except BaseException:
+            for future in batch_futures:
+                future.cancel()
+            raise
 
     @abc.abstractmethod
     async def _upload_blob(self, src: str, dest: str) -> ManifestObject:
@@ -195,6 +526,58 @@ class AbstractStorage(abc.ABC):
         except ObjectDoesNotExistError:
             return None
 
+    def get_blobs(self, paths: t.Iterable[t.Union[Path, str]]) -> t.Dict[str, t.Optional[AbstractBlob]]:
+        """
+        Gets several objects at once, without reading their contents.
+
+        :return: a dict mapping each path to its blob, or to None if there is no such object
+        """
+        paths = [str(path) for path in paths]
+        logging.debug("[Storage] Getting {} objects".format(len(paths)))
+        loop = self.get_or_create_event_loop()
+        blobs = loop.run_until_complete(self._get_blobs(paths))
+        return dict(zip(paths, blobs))
+
+    async def _get_blobs(self, paths: t.List[str]) -> t.List[t.Optional[AbstractBlob]]:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_METADATA_REQUESTS)
+
+        async def bounded_get(path: str) -> t.Optional[AbstractBlob]:
+            async with semaphore:
+                return await self._get_blob_or_none(path)
+
+        return await asyncio.gather(*(bounded_get(path) for path in paths))
+
+    def get_blobs_contents(self, paths: t.Iterable[t.Union[Path, str]]) -> t.Dict[str, t.Optional[bytes]]:
+        """
+        Reads several small objects at once, as many at a time as concurrent_transfers allows.
+
+        :return: a dict mapping each path to the content of its object, or to None if there is no such object
+        """
+        paths = [str(path) for path in paths]
+        logging.debug("[Storage] Reading {} objects".format(len(paths)))
+        loop = self.get_or_create_event_loop()
+        contents = loop.run_until_complete(self._get_blobs_contents(paths))
+        return dict(zip(paths, contents))
+
+    async def _get_blobs_contents(self, paths: t.List[str]) -> t.List[t.Optional[bytes]]:
+        semaphore = asyncio.Semaphore(int(self.config.concurrent_transfers))
+
+        async def bounded_read(path: str) -> t.Optional[bytes]:
+            async with semaphore:
+                blob = await self._get_blob_or_none(path)
+                if blob is None:
+                    return None
+                return await self._read_blob_as_bytes(blob)
+
+        return await asyncio.gather(*(bounded_read(path) for path in paths))
+
+    @retry(stop=stop_after_attempt(MAX_UP_DOWN_LOAD_RETRIES), wait=wait_fixed(5))
+    async def _get_blob_or_none(self, path: str) -> t.Optional[AbstractBlob]:
+        try:
+            return await self._get_object(path)
+        except ObjectDoesNotExistError:
+            return None
+
     def get_object(self, object_key: t.Union[Path, str]):
         # Doesn't actually read the contents, just lists the thing
         try:
@@ -239,6 +622,9 @@ class AbstractStorage(abc.ABC):
                 blob.name, blob.last_modified
             )
         )
+        # object stores report UTC times, which timestamp() would read as local ones if they came without a timezone
+        if blob.last_modified.tzinfo is None:
+            return blob.last_modified.replace(tzinfo=datetime.timezone.utc)
         return blob.last_modified
 
     @staticmethod
@@ -281,20 +667,44 @@ class AbstractStorage(abc.ABC):
         loop = self.get_or_create_event_loop()
         loop.run_until_complete(self._delete_object(object))
 
-    def delete_objects(self, objects: t.List[AbstractBlob], concurrent_transfers: int = None):
+    def delete_objects(self, objects: t.List[AbstractBlob], concurrent_transfers: int = None) -> t.Dict[str, str]:
+        """
+        Deletes a list of objects, using the bulk delete API of the storage backend if it has one.
+
+        Failing to delete some objects does not prevent the others from being deleted.
+
+        :param objects: the blobs to delete
+        :param concurrent_transfers: how many deletions to run at once, defaults to the one from medusa's config
+        :return: a dict with the name of each object that could not be deleted, mapped to the reason why
+        """
         loop = self.get_or_create_event_loop()
-        loop.run_until_complete(self._delete_objects(objects, concurrent_transfers))
+        failures = loop.run_until_complete(self._delete_objects(list(objects), concurrent_transfers))
+        for name, error in failures.items():
+            logging.error('Failed to delete {}: {}'.format(name, error))
+        return failures
 
-    async def _delete_objects(self, objects: t.List[AbstractBlob], concurrent_transfers: int = None):
+    async def _delete_objects(
+            self,
+            objects: t.List[AbstractBlob],
+            concurrent_transfers: int = None
+    ) -> t.Dict[str, str]:
+        # storage backends having a bulk delete API override this. the default is to delete objects one by one
 
         # if we get the concurrent_transfers provided, use those instead of the ones from the config
-        chunk_size = concurrent_transfers if concurrent_transfers else int(self.config.concurrent_transfers)
+        semaphore = asyncio.Semaphore(
+            concurrent_transfers if concurrent_transfers else int(self.config.concurrent_transfers)
+        )
+        failures = {}
 
-        # split objects into chunk-sized chunks
-        chunks = [objects[i:i + chunk_size] for i in range(0, len(objects), chunk_size)]
-        for chunk in chunks:
-            coros = [self._delete_object(obj) for obj in chunk]
-            await asyncio.gather(*coros)
+        async def bounded_delete(obj: AbstractBlob):
+            async with semaphore:
+                try:
+                    await self._delete_object(obj)
+                except Exception as e:
+                    failures[obj.name] = str(e)
+
+        await asyncio.gather(*(bounded_delete(obj) for obj in objects))
+        return failures
 
     @abc.abstractmethod
     async def _delete_object(self, obj: AbstractBlob):
@@ -326,7 +736,11 @@ class AbstractStorage(abc.ABC):
         return AbstractBlobMetadata(blob_key, False, None, None)
 
     @staticmethod
-    def generate_md5_hash(src, block_size=BLOCK_SIZE_BYTES):
+    def generate_md5_hash(src, block_size=BLOCK_SIZE_BYTES, digest_cache=None):
+        if digest_cache is not None:
+            return digest_cache.digest(
+                src, digest_cache.SINGLE_PART, lambda: AbstractStorage.generate_md5_hash(src, block_size)
+            )
 
         checksum = hashlib.md5()
         with open(str(src), 'rb') as f:
@@ -345,8 +759,13 @@ class AbstractStorage(abc.ABC):
         return base64_md5
 
     @staticmethod
-    def md5_multipart(src, part_size_bytes=None):
+    def md5_multipart(src, part_size_bytes=None, digest_cache=None):
         part_size_bytes = part_size_bytes or DEFAULT_MULTIPART_PART_SIZE_BYTES
+        if digest_cache is not None:
+            return digest_cache.digest(
+                src, part_size_bytes, lambda: AbstractStorage.md5_multipart(src, part_size_bytes)
+            )
+
         eof = False
         hash_list = []
         with open(str(src), 'rb') as f:
@@ -410,7 +829,7 @@ class AbstractStorage(abc.ABC):
     @staticmethod
     @abc.abstractmethod
     def file_matches_storage(src: pathlib.Path, cached_item: ManifestObject, threshold=None, enable_md5_checks=False,
-                             chunk_size=None):
+                             chunk_size=None, digest_cache=None):
         """
         Compares a local file with its version in the storage backend. This happens when doing an actual backup.
 
@@ -424,6 +843,7 @@ class AbstractStorage(abc.ABC):
                 found in the manifest (only applicable to some cloud storage implementations that compare md5 hashes)
         :param chunk_size: size of the chunks used to digest files bigger than the threshold. Must match the
                 multipart chunk size the storage backend actually uploaded with, or the digest won't match.
+        :param digest_cache: a DigestCache to reuse the digests of files that did not change since a previous backup
         :return: boolean informing if the files match or not
         """
         pass
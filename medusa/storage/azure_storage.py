@@ -14,8 +14,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import base64
 import collections
+import hashlib
 import io
 import json
 import logging
@@ -30,6 +32,7 @@ from azure.identity import DefaultAzureCredential
 from azure.storage.blob.aio import BlobServiceClient
 from azure.storage.blob import BlobProperties, StandardBlobTier
 from medusa.storage.abstract_storage import AbstractStorage, AbstractBlob, AbstractBlobMetadata, ObjectDoesNotExistError
+from medusa.storage.bandwidth_limiter import bandwidth_limiter
 from pathlib import Path
 from tenacity import retry, stop_after_attempt, wait_fixed
 
@@ -37,6 +40,10 @@ from tenacity import retry, stop_after_attempt, wait_fixed
 ManifestObject = collections.namedtuple('ManifestObject', ['path', 'size', 'MD5'])
 
 MAX_UP_DOWN_LOAD_RETRIES = 5
+# the most sub-requests a single blob batch request accepts
+AZURE_MAX_BLOBS_PER_BATCH = 256
+# blobs up to this size get uploaded with a single Put Blob request, for which the service computes their MD5
+AZURE_MAX_SINGLE_PUT_SIZE = 64 * 1024 * 1024
 
 
 class AzureStorage(AbstractStorage):
@@ -97,9 +104,16 @@ class AzureStorage(AbstractStorage):
             # this is library specific, other storage providers have different interface altogether
             max_block_size=self.multipart_chunksize_bytes,
             max_chunk_get_size=self.multipart_chunksize_bytes,
+            max_single_put_size=AZURE_MAX_SINGLE_PUT_SIZE,
+            # the SDK retries throttled requests on its own, this hook lets us hear about them
+            raw_response_hook=self._note_throttled_response,
         )
         self.azure_container_client = self.azure_blob_service.get_container_client(self.bucket_name)
 
+    def _note_throttled_response(self, response):
+        if response.http_response.status_code in (429, 503):
+            self.transfer_concurrency.throttled()
+
     def disconnect(self):
         logging.debug('Disconnecting from Azure Storage')
         loop = self.get_or_create_event_loop()
@@ -110,7 +124,10 @@ class AzureStorage(AbstractStorage):
         await self.azure_blob_service.close()
 
     async def _list_blobs(self, prefix=None) -> t.List[AbstractBlob]:
-        blobs = []
+        return [blob async for blob in self._iter_blobs(prefix)]
+
+    async def _iter_blobs(self, prefix=None) -> t.AsyncIterator[AbstractBlob]:
+        # the SDK fetches the listing one page at a time as we iterate over it
         async for b_props in self.azure_container_client.list_blobs(
                 name_starts_with=str(prefix),
                 include=['metadata'],
@@ -121,14 +138,13 @@ class AzureStorage(AbstractStorage):
             # and would otherwise show up as spurious entries in listings. See #595.
             if (b_props.metadata or {}).get('hdi_isfolder', '').lower() == 'true':
                 continue
-            blobs.append(AbstractBlob(
+            yield AbstractBlob(
                 b_props.name,
                 b_props.size,
                 self._get_blob_hash(b_props),
                 b_props.last_modified,
-                b_props.blob_tier)
+                b_props.blob_tier
             )
-        return blobs
 
     def _get_blob_hash(self, bp: BlobProperties) -> str:
         md5_hash = bp.get('content_settings', {}).get('content_md5', bp.etag)
@@ -186,13 +202,21 @@ class AzureStorage(AbstractStorage):
             )
         )
 
+        # the SDK would write the blob to the file itself. we fetch its ranges on our own instead,
+        # so the bytes go through the bandwidth limiter
+        range_size = self.multipart_chunksize_bytes if workers > 1 else max(blob.size, 1)
+        connections = asyncio.Semaphore(max(workers, 1))
+        await self._download_blob_in_ranges(object_key, blob.size, file_path, range_size, connections)
+
+    async def _read_blob_range(self, object_key: str, start: int, end: int) -> t.AsyncIterator[bytes]:
         downloader = await self.azure_container_client.download_blob(
             blob=object_key,
-            max_concurrency=workers,
+            offset=start,
+            length=end - start + 1,
             timeout=self.read_timeout,
         )
-        Path(file_path).parent.mkdir(parents=True, exist_ok=True)
-        await downloader.readinto(open(file_path, "wb"))
+        async for chunk in downloader.chunks():
+            yield chunk
 
     async def _stat_blob(self, object_key: str) -> AbstractBlob:
 
@@ -219,6 +243,12 @@ class AzureStorage(AbstractStorage):
                     break
                 yield chunk
 
+    @staticmethod
+    async def _digest_chunks(chunks: t.AsyncIterator[bytes], digest) -> t.AsyncIterator[bytes]:
+        async for chunk in chunks:
+            digest.update(chunk)
+            yield chunk
+
     @retry(stop=stop_after_attempt(MAX_UP_DOWN_LOAD_RETRIES), wait=wait_fixed(5))
     async def _upload_blob(self, src: str, dest: str) -> ManifestObject:
         src_path = Path(src)
@@ -233,21 +263,32 @@ class AzureStorage(AbstractStorage):
             )
         )
         storage_class = self.get_storage_class()
-        blob_client = await self.azure_container_client.upload_blob(
-            name=object_key,
-            data=self._file_chunks(src, chunk_size=self.multipart_chunksize_bytes),
+        # we digest the file as it streams to the service, so we don't need to ask for the blob properties afterwards
+        md5 = hashlib.md5()
+        blob_client = self.azure_container_client.get_blob_client(object_key)
+        response = await blob_client.upload_blob(
+            data=bandwidth_limiter.upload.throttle(
+                self._digest_chunks(self._file_chunks(src, chunk_size=self.multipart_chunksize_bytes), md5)
+            ),
             length=file_size,
             overwrite=True,
             max_concurrency=16,
             standard_blob_tier=StandardBlobTier(storage_class.capitalize()) if storage_class else None,
         )
-        blob_properties = await blob_client.get_blob_properties()
-        mo = ManifestObject(
-            blob_properties.name,
-            blob_properties.size,
-            self._get_blob_hash(blob_properties),
-        )
-        return mo
+
+        # the service only keeps the MD5 of blobs uploaded with a single Put Blob request. for the ones committed
+        # from a block list, the hash in the manifest has to be whatever the blob properties report
+        if file_size > AZURE_MAX_SINGLE_PUT_SIZE or response.get('content_md5') is None:
+            blob_properties = await blob_client.get_blob_properties()
+            return ManifestObject(
+                blob_properties.name,
+                blob_properties.size,
+                self._get_blob_hash(blob_properties),
+            )
+
+        if bytes(response['content_md5']) != md5.digest():
+            raise IOError('MD5 of azure://{}/{} does not match the one of {}'.format(self.bucket_name, object_key, src))
+        return ManifestObject(object_key, file_size, base64.encodebytes(md5.digest()).decode('UTF-8').strip())
 
     async def _get_object(self, object_key: str) -> AbstractBlob:
         blob = await self._stat_blob(object_key)
@@ -265,6 +306,48 @@ class AzureStorage(AbstractStorage):
     async def _delete_object(self, obj: AbstractBlob):
         await self.azure_container_client.delete_blob(obj.name, delete_snapshots='include')
 
+    async def _delete_objects(
+            self,
+            objects: t.List[AbstractBlob],
+            concurrent_transfers: int = None
+    ) -> t.Dict[str, str]:
+        names = [obj.name for obj in objects]
+        batches = [names[i:i + AZURE_MAX_BLOBS_PER_BATCH] for i in range(0, len(names), AZURE_MAX_BLOBS_PER_BATCH)]
+        # if we get the concurrent_transfers provided, use those instead of the ones from the config
+        semaphore = asyncio.Semaphore(
+            concurrent_transfers if concurrent_transfers else int(self.config.concurrent_transfers)
+        )
+
+        async def bounded_delete_batch(batch: t.List[str]) -> t.Dict[str, str]:
+            async with semaphore:
+                return await self._delete_batch(batch)
+
+        failures = {}
+        for batch_failures in await asyncio.gather(*(bounded_delete_batch(batch) for batch in batches)):
+            failures.update(batch_failures)
+        return failures
+
+    async def _delete_batch(self, names: t.List[str]) -> t.Dict[str, str]:
+        logging.debug('[Azure Storage] Deleting {} blobs from azure://{}'.format(len(names), self.bucket_name))
+        try:
+            responses = await self.azure_container_client.delete_blobs(
+                *names,
+                delete_snapshots='include',
+                raise_on_any_failure=False,
+                timeout=self.read_timeout,
+            )
+            # we get one response per blob, in the same order as the blobs were given
+            statuses = [response.status_code async for response in responses]
+        except Exception as e:
+            return {name: str(e) for name in names}
+
+        return {
+            name: 'HTTP {}'.format(status)
+            for name, status in zip(names, statuses)
+            # a blob that is already gone is as good as deleted
+            if not (200 <= status < 300 or status == 404)
+        }
+
     async def _get_blob_metadata(self, blob_key: str) -> AbstractBlobMetadata:
         # blob_client = self.azure_container_client.get_blob_client(blob_key)
         # blob_properties = await blob_client.get_blob_properties()
@@ -287,11 +370,12 @@ class AzureStorage(AbstractStorage):
 
     @staticmethod
     def file_matches_storage(src: pathlib.Path, cached_item: ManifestObject, threshold=None, enable_md5_checks=False,
-                             chunk_size=None):
+                             chunk_size=None, digest_cache=None):
         return AzureStorage.compare_with_manifest(
             actual_size=src.stat().st_size,
             size_in_manifest=cached_item.size,
-            actual_hash=AbstractStorage.generate_md5_hash(src) if enable_md5_checks else None,
+            actual_hash=AbstractStorage.generate_md5_hash(src, digest_cache=digest_cache)
+            if enable_md5_checks else None,
             hash_in_manifest=cached_item.MD5,
         )
 
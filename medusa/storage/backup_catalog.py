@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import collections
+import gzip
+import json
+import logging
+import pathlib
+import time
+import typing as t
+
+CATALOG_VERSION = 1
+# segments get merged into the snapshot and deleted only once they are this old (in seconds). a compaction that takes
+# more than half of it gives up, which is what keeps concurrent compactions from losing segments, see compact()
+SEGMENT_RETENTION = 3600
+# maybe_compact() only compacts when there are at least this many segments to merge
+COMPACTION_THRESHOLD = 500
+
+CatalogEntry = collections.namedtuple('CatalogEntry', ['name', 'fqdn', 'started', 'finished', 'differential'])
+
+
+class BackupCatalog(object):
+    """
+    Catalog of all the node backups of the cluster, meant to be listed with a handful of requests.
+
+    The catalog is made of a snapshot, which is one gzipped JSON object describing all the node backups, and of
+    segments. Each node adds a segment when one of its backups starts, finishes or gets purged. Segments are empty
+    objects, everything is in their name:
+
+        index/catalog/segments/<backup name>/started_<timestamp>_<full|differential>_<fqdn>
+        index/catalog/segments/<backup name>/finished_<timestamp>_<fqdn>
+        index/catalog/segments/<backup name>/removed_<timestamp>_<fqdn>
+
+    Nodes never write the same segment, so they don't need to coordinate. Reading the catalog lists the segments and
+    applies them on top of the snapshot. Compactions merge the segments into a new snapshot, then delete them.
+
+    Until a first compaction writes the snapshot, the catalog does not exist and the backups are listed from the
+    per-blob backup index. The first compaction also imports that index. It only happens when running
+    `medusa build-index`, once every node runs a version of Medusa writing segments: the backups of the other nodes
+    would be missing from the catalog otherwise.
+    """
+
+    def __init__(self, storage, clock: t.Callable[[], float] = time.time):
+        self._storage = storage
+        self._clock = clock
+        self._snapshot_path = '{}index/catalog/snapshot.json.gz'.format(storage.prefix_path)
+        self._segments_path = '{}index/catalog/segments/'.format(storage.prefix_path)
+
+    def exists(self) -> bool:
+        return self._storage.storage_driver.get_blob(self._snapshot_path) is not None
+
+    def record_started(self, node_backup):
+        backup_type = 'differential' if node_backup.is_differential else 'full'
+        self._add_segment(
+            node_backup.name, 'started_{}_{}_{}'.format(node_backup.started, backup_type, node_backup.fqdn)
+        )
+
+    def record_finished(self, node_backup):
+        self._add_segment(node_backup.name, 'finished_{}_{}'.format(node_backup.finished, node_backup.fqdn))
+
+    def record_removed(self, node_backup):
+        self._add_segment(node_backup.name, 'removed_{}_{}'.format(int(self._clock()), node_backup.fqdn))
+
+    def _add_segment(self, backup_name, segment_name):
+        self._storage.storage_driver.upload_blob_from_string(
+            '{}{}/{}'.format(self._segments_path, backup_name, segment_name), ''
+        )
+
+    def _list_segments(self):
+        return self._storage.storage_driver.list_objects(self._segments_path)
+
+    def _read_snapshot(self) -> t.Optional[t.Dict[t.Tuple[str, str], CatalogEntry]]:
+        blob = self._storage.storage_driver.get_blob(self._snapshot_path)
+        if blob is None:
+            return None
+        snapshot = json.loads(gzip.decompress(self._storage.storage_driver.read_blob_as_bytes(blob)))
+        if snapshot['version'] != CATALOG_VERSION:
+            raise ValueError('Unsupported backup catalog version {}'.format(snapshot['version']))
+        return {
+            (name, fqdn): CatalogEntry(name, fqdn, started, finished, bool(differential))
+            for name, node_backups in snapshot['backups'].items()
+            for fqdn, (started, finished, differential) in node_backups.items()
+        }
+
+    def _write_snapshot(self, entries: t.Dict[t.Tuple[str, str], CatalogEntry]):
+        backups = collections.defaultdict(dict)
+        for entry in entries.values():
+            backups[entry.name][entry.fqdn] = [entry.started, entry.finished, int(entry.differential)]
+        content = json.dumps({'version': CATALOG_VERSION, 'backups': backups}, separators=(',', ':'))
+        self._storage.storage_driver.upload_blob_from_string(self._snapshot_path, gzip.compress(content.encode()))
+
+    @staticmethod
+    def _parse_segment(blob) -> t.Tuple[str, str, int, t.Optional[bool], str]:
+        path = pathlib.Path(blob.name)
+        backup_name = path.parent.name
+        kind, timestamp, details = path.name.split('_', 2)
+        if kind == 'started':
+            backup_type, fqdn = details.split('_', 1)
+            return kind, backup_name, int(timestamp), backup_type == 'differential', fqdn
+        return kind, backup_name, int(timestamp), None, details
+
+    @staticmethod
+    def _apply_segments(entries: t.Dict[t.Tuple[str, str], CatalogEntry], segments):
+        events = []
+        for blob in segments:
+            try:
+                events.append(BackupCatalog._parse_segment(blob))
+            except ValueError:
+                logging.warning('Ignoring malformed backup catalog segment {}'.format(blob.name))
+
+        # a node backup can only finish or be removed once it started
+        order = {'started': 0, 'finished': 1, 'removed': 2}
+        for kind, name, timestamp, differential, fqdn in sorted(events, key=lambda e: order[e[0]]):
+            entry = entries.get((name, fqdn), CatalogEntry(name, fqdn, None, None, False))
+            if kind == 'started':
+                entries[(name, fqdn)] = entry._replace(started=timestamp, differential=differential)
+            elif kind == 'finished':
+                entries[(name, fqdn)] = entry._replace(finished=timestamp)
+            elif entry.started is None or timestamp >= entry.started:
+                # unless the backup got taken again after being removed
+                entries.pop((name, fqdn), None)
+
+    def entries(self) -> t.Optional[t.List[CatalogEntry]]:
+        """
+        Reads the catalog, None if there is none yet.
+        """
+        # segments first: a compaction writes its snapshot before deleting the segments it merged
+        segments = self._list_segments()
+        entries = self._read_snapshot()
+        if entries is None:
+            return None
+        self._apply_segments(entries, segments)
+        return list(entries.values())
+
+    def maybe_compact(self):
+        """
+        Compacts the catalog if enough segments piled up since the last compaction. Does not create the catalog, see
+        the class docstring.
+        """
+        if not self.exists():
+            return
+        if len(self._compactable_segments(self._list_segments())) >= COMPACTION_THRESHOLD:
+            self.compact()
+
+    def _compactable_segments(self, segments):
+        horizon = self._clock() - SEGMENT_RETENTION
+        return [
+            blob for blob in segments
+            if self._storage.storage_driver.get_object_datetime(blob).timestamp() <= horizon
+        ]
+
+    def compact(self, import_backup_index: bool = False):
+        """
+        Merges the segments into the snapshot, and deletes the ones older than SEGMENT_RETENTION.
+
+        Compactions can run on several nodes at once. Deleting only old segments and giving up when a compaction
+        is slow guarantees a compaction never overwrites the snapshot without a segment another one deleted.
+
+        :param import_backup_index: also import the per-blob backup index, which always happens on the first
+        compaction. Needed to pick up the backups of nodes running a version of Medusa that does not write segments.
+        """
+        started = self._clock()
+        segments = self._list_segments()
+        entries = self._read_snapshot()
+        if entries is None or import_backup_index:
+            logging.info('Importing the backup index into the backup catalog')
+            entries = entries or {}
+            for node_backup in self._storage.node_backups_from_index(self._storage.list_backup_index_blobs()):
+                key = (node_backup.name, node_backup.fqdn)
+                if key not in entries:
+                    entries[key] = CatalogEntry(
+                        node_backup.name, node_backup.fqdn, node_backup.started, node_backup.finished,
+                        node_backup.is_differential
+                    )
+
+        compactable = self._compactable_segments(segments)
+        self._apply_segments(entries, segments)
+
+        if self._clock() - started > SEGMENT_RETENTION / 2:
+            logging.warning('Backup catalog compaction took too long, not writing its outcome')
+            return
+
+        logging.info('Compacting the backup catalog: {} node backups, {} segments merged'.format(
+            len(entries), len(compactable)
+        ))
+        self._write_snapshot(entries)
+        self._storage.storage_driver.delete_objects(compactable)
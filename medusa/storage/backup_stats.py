@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import collections
+import json
+import typing as t
+
+BACKUP_STATS_VERSION = 1
+
+KeyspaceStats = collections.namedtuple('KeyspaceStats', ['size', 'num_objects'])
+
+
+class BackupStats(object):
+    """
+    Totals of a node backup, written to the index when the backup finishes so listing backups does not need to
+    download their manifests.
+
+    new_size is what the backup uploaded, reused_size what it refers to from previous differential backups. Both are
+    None when the stats got computed from the manifest after the fact, because the manifest does not tell them apart.
+    """
+
+    def __init__(
+            self,
+            size: int,
+            num_objects: int,
+            keyspaces: t.Dict[str, KeyspaceStats],
+            new_size: t.Optional[int] = None,
+            reused_size: t.Optional[int] = None
+    ):
+        self.size = size
+        self.num_objects = num_objects
+        self.keyspaces = keyspaces
+        self.new_size = new_size
+        self.reused_size = reused_size
+
+    def __repr__(self):
+        return 'BackupStats(size={0.size}, num_objects={0.num_objects})'.format(self)
+
+    def __eq__(self, other):
+        return isinstance(other, BackupStats) and self.to_dict() == other.to_dict()
+
+    @staticmethod
+    def from_manifest(manifest, reused_size: t.Optional[int] = None) -> 'BackupStats':
+        """
+        Computes the stats of a Manifest. Giving reused_size tells how many of its bytes were not uploaded by the
+        backup.
+        """
+        keyspaces = collections.defaultdict(lambda: KeyspaceStats(0, 0))
+        for table in manifest.tables():
+            totals = keyspaces[table.keyspace]
+            keyspaces[table.keyspace] = KeyspaceStats(totals.size + table.size, totals.num_objects + table.num_objects)
+        size = manifest.size()
+        return BackupStats(
+            size, manifest.num_objects(), dict(keyspaces),
+            new_size=size - reused_size if reused_size is not None else None,
+            reused_size=reused_size
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            'version': BACKUP_STATS_VERSION,
+            'size': self.size,
+            'num_objects': self.num_objects,
+            'new_size': self.new_size,
+            'reused_size': self.reused_size,
+            'keyspaces': {
+                keyspace: {'size': totals.size, 'num_objects': totals.num_objects}
+                for keyspace, totals in self.keyspaces.items()
+            }
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, sort_keys=True)
+
+    @staticmethod
+    def from_json(content: t.Union[str, bytes]) -> 'BackupStats':
+        stats = json.loads(content)
+        if stats.get('version') != BACKUP_STATS_VERSION:
+            raise ValueError('Unsupported backup stats version {}'.format(stats.get('version')))
+        return BackupStats(
+            stats['size'],
+            stats['num_objects'],
+            {
+                keyspace: KeyspaceStats(totals['size'], totals['num_objects'])
+                for keyspace, totals in stats['keyspaces'].items()
+            },
+            new_size=stats['new_size'],
+            reused_size=stats['reused_size']
+        )
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import io
+import logging
+import threading
+import time
+import typing as t
+
+
+class TokenBucket(object):
+    """
+    Limits the rate at which bytes get transferred, across all the threads and event loops of the process.
+
+    Transfers take one token per byte they move. The bucket holds at most one second worth of tokens and can go in
+    debt, in which case whoever took the tokens waits until the debt is paid back. So the transfers sharing a bucket
+    get the configured rate between all of them, no matter how many there are or how big their chunks are.
+
+    A rate of 0 means there is no limit.
+    """
+
+    def __init__(self, rate: int = 0, clock: t.Callable[[], float] = time.monotonic):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._rate = rate
+        self._tokens = float(rate)
+        self._updated_at = clock()
+
+    @property
+    def rate(self) -> int:
+        return self._rate
+
+    def set_rate(self, rate: int):
+        with self._lock:
+            self._refill()
+            # a bucket that had no limit starts full, so transfers don't stall when a limit gets set
+            self._tokens = float(rate) if not self._rate else min(self._tokens, float(rate))
+            self._rate = rate
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(float(self._rate), self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+    def _take(self, amount: int) -> float:
+        """
+        Takes tokens from the bucket.
+
+        :param amount: the number of bytes transferred
+        :return: how many seconds the caller has to wait before it can transfer more
+        """
+        # boto reports negative amounts when it rewinds a stream to retry a request
+        if amount <= 0:
+            return 0.0
+        with self._lock:
+            if not self._rate:
+                return 0.0
+            self._refill()
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self._rate)
+
+    def consume(self, amount: int):
+        """
+        Takes tokens for bytes transferred from a thread, blocking it for as long as the rate requires.
+        """
+        delay = self._take(amount)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def consume_async(self, amount: int):
+        """
+        Takes tokens for bytes transferred from a coroutine, suspending it for as long as the rate requires.
+        """
+        delay = self._take(amount)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def throttle(self, chunks: t.AsyncIterator[bytes]) -> t.AsyncIterator[bytes]:
+        """
+        Passes chunks through, at the rate of the bucket.
+        """
+        async for chunk in chunks:
+            await self.consume_async(len(chunk))
+            yield chunk
+
+
+class ThrottledReader(io.RawIOBase):
+    """
+    Read-only binary file whose reads take their bytes from a TokenBucket.
+
+    Meant for the libraries that read upload payloads from a file object in a thread, as aiohttp does.
+    """
+
+    def __init__(self, raw: t.BinaryIO, bucket: TokenBucket):
+        super().__init__()
+        self._raw = raw
+        self._bucket = bucket
+        self.name = getattr(raw, 'name', None)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self._raw.seekable()
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._raw.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._raw.tell()
+
+    def fileno(self) -> int:
+        return self._raw.fileno()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._raw.read(size)
+        self._bucket.consume(len(data))
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class BandwidthLimiter(object):
+    """
+    Process wide limits of the bandwidth used by the storage drivers.
+
+    Uploads and downloads have a bucket each, shared by every transfer of every storage instance. The limits come
+    from the storage configuration, and can be changed while Medusa runs (eg from the gRPC service). Once changed
+    that way, the configuration of storages created afterwards does not override them anymore.
+    """
+
+    def __init__(self):
+        self.upload = TokenBucket()
+        self.download = TokenBucket()
+        self._lock = threading.Lock()
+        self._overridden = False
+
+    def configure(self, upload_rate: int, download_rate: int):
+        """
+        Applies the limits from the storage configuration, unless they were changed at runtime.
+
+        :param upload_rate: bytes per second allowed for uploads, 0 for no limit
+        :param download_rate: bytes per second allowed for downloads, 0 for no limit
+        """
+        with self._lock:
+            if self._overridden:
+                return
+            self.upload.set_rate(upload_rate)
+            self.download.set_rate(download_rate)
+
+    def set_limits(self, upload_rate: t.Optional[int] = None, download_rate: t.Optional[int] = None):
+        """
+        Changes the limits at runtime, for the transfers in progress as well as for the ones to come.
+
+        :param upload_rate: bytes per second allowed for uploads, 0 for no limit, None to leave it as it is
+        :param download_rate: bytes per second allowed for downloads, 0 for no limit, None to leave it as it is
+        """
+        with self._lock:
+            self._overridden = True
+            if upload_rate is not None:
+                self.upload.set_rate(upload_rate)
+            if download_rate is not None:
+                self.download.set_rate(download_rate)
+        logging.info('Bandwidth limits set to {} B/s for uploads and {} B/s for downloads'.format(
+            self.upload.rate, self.download.rate
+        ))
+
+    def reset(self):
+        """
+        Removes the limits and lets the storage configuration set them again.
+        """
+        with self._lock:
+            self._overridden = False
+            self.upload.set_rate(0)
+            self.download.set_rate(0)
+
+
+bandwidth_limiter = BandwidthLimiter()
@@ -34,6 +34,13 @@ class ClusterBackup(object):
     def name(self):
         return self._name
 
+    @property
+    def first_node_backup(self):
+        """
+        The node backup the tokenmap and the schema of the cluster backup come from.
+        """
+        return self._first_nodebackup
+
     @property
     def started(self):
         return min(map(operator.attrgetter('started'), self.node_backups.values()))
@@ -88,7 +95,11 @@ class ClusterBackup(object):
                 for node_backup in self.expected_node_backups()
                 if node_backup.finished is None]
 
+    def _prefetch(self, **blobs):
+        self._first_nodebackup.storage.prefetch_node_backups(self.node_backups.values(), **blobs)
+
     def size(self):
+        self._prefetch(stats=True)
         return sum(
             node_backup.size()
             for node_backup in self.node_backups.values()
@@ -96,6 +107,7 @@ class ClusterBackup(object):
         )
 
     def num_objects(self):
+        self._prefetch(stats=True)
         return sum(
             node_backup.num_objects()
             for node_backup in self.node_backups.values()
@@ -103,6 +115,7 @@ class ClusterBackup(object):
         )
 
     def to_json_dict(self):
+        self._prefetch(stats=True, server_version=True)
         nodes_list = []
         incomplete_nodes_list = []
         total_size = 0
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import collections
+import contextlib
+import logging
+import threading
+import time
+import typing as t
+
+import psutil
+
+
+# a window has to do this much better than the previous one to count as a throughput increase
+THROUGHPUT_GAIN = 1.05
+# latency counts as flat while it stays within this factor of the best one seen
+LATENCY_TOLERANCE = 1.25
+# by how much the concurrency gets cut when the storage throttles us or the node is busy
+BACKOFF_FACTOR = 0.5
+# the node is considered under pressure above these (system wide) usage percentages
+CPU_PRESSURE_PERCENT = 90.0
+IOWAIT_PRESSURE_PERCENT = 30.0
+
+
+def node_under_pressure() -> bool:
+    """
+    Tells if the CPUs or disks of the node are busy enough for Medusa to get out of Cassandra's way.
+
+    The usage is the one since the previous call, so the first call of the process only sees a busy node if it is
+    busy right now.
+    """
+    times = psutil.cpu_times_percent(interval=None)
+    iowait = getattr(times, 'iowait', 0.0)
+    busy = 100.0 - times.idle - iowait
+    return busy >= CPU_PRESSURE_PERCENT or iowait >= IOWAIT_PRESSURE_PERCENT
+
+
+class Transfer(object):
+    def __init__(self):
+        self.size = None
+
+    def completed(self, size: int):
+        self.size = size
+
+
+class ConcurrencyController(object):
+    """
+    Decides how many transfers run at once.
+
+    When not adaptive, this is a plain semaphore of the configured size. When adaptive, the limit follows an
+    AIMD (additive increase, multiplicative decrease) scheme:
+    - transfers are looked at in windows, each window ending when as many transfers as the limit allows completed
+    - the limit goes up by one after a window whose throughput was higher than the previous one, as long as the
+      latency (seconds spent transferring each byte) did not grow
+    - the limit gets halved as soon as the storage throttles a request, or at the end of a window if the node is
+      under CPU or IO pressure
+
+    Throttling gets reported by the storage drivers through throttled(), which can be called from any thread.
+    """
+
+    def __init__(
+            self,
+            initial: int,
+            maximum: t.Optional[int] = None,
+            adaptive: bool = False,
+            minimum: int = 1,
+            under_pressure: t.Callable[[], bool] = node_under_pressure,
+            clock: t.Callable[[], float] = time.monotonic,
+    ):
+        self._minimum = max(minimum, 1)
+        self._maximum = max(maximum or initial, self._minimum)
+        self._limit = min(max(initial, self._minimum), self._maximum)
+        self._adaptive = adaptive
+        self._under_pressure = under_pressure
+        self._clock = clock
+
+        self._in_flight = 0
+        self._waiters = collections.deque()
+
+        self._lock = threading.Lock()
+        self._throttled = 0
+        self._backed_off = False
+
+        self._previous_throughput = None
+        self._best_latency = None
+        self._start_window()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def maximum(self) -> int:
+        return self._maximum
+
+    @property
+    def adaptive(self) -> bool:
+        return self._adaptive
+
+    def throttled(self):
+        """
+        Records that the storage rejected or delayed a request because we are sending too many.
+        """
+        with self._lock:
+            self._throttled += 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> t.AsyncIterator[Transfer]:
+        """
+        Holds one of the transfer slots for the duration of a transfer.
+
+        The transfer calls completed() on what this yields once it succeeded, so its size and duration get accounted.
+        """
+        await self._acquire()
+        transfer = Transfer()
+        started = self._clock()
+        try:
+            yield transfer
+        finally:
+            self._in_flight -= 1
+            if self._adaptive:
+                self._adjust(transfer.size, self._clock() - started)
+            self._wake_up()
+
+    async def _acquire(self):
+        while self._in_flight >= self._limit:
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # we might have been woken up already, so let someone else have the slot
+                self._wake_up()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self._in_flight += 1
+
+    def _wake_up(self):
+        free_slots = self._limit - self._in_flight
+        while free_slots > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free_slots -= 1
+
+    def _start_window(self):
+        self._window_started = self._clock()
+        self._window_transfers = 0
+        self._window_bytes = 0
+        self._window_busy_seconds = 0.0
+
+    def _set_limit(self, limit: int, reason: str):
+        limit = min(max(limit, self._minimum), self._maximum)
+        if limit != self._limit:
+            logging.info('[Storage] Running {} concurrent transfers instead of {} ({})'.format(
+                limit, self._limit, reason
+            ))
+            self._limit = limit
+
+    def _adjust(self, size: t.Optional[int], duration: float):
+        with self._lock:
+            throttled, self._throttled = self._throttled, 0
+        # the transfers that were already running when we backed off can get throttled too. we wait for one of
+        # the transfers to succeed before we back off again, so a single burst does not take us down to the minimum
+        if throttled and not self._backed_off:
+            self._set_limit(int(self._limit * BACKOFF_FACTOR), 'the storage throttled {} requests'.format(throttled))
+            self._backed_off = True
+            self._previous_throughput = None
+            self._start_window()
+            return
+
+        # failed transfers tell nothing about the throughput
+        if size is None:
+            return
+        self._backed_off = False
+        self._window_transfers += 1
+        self._window_bytes += size
+        self._window_busy_seconds += duration
+        if self._window_transfers < self._limit:
+            return
+
+        elapsed = max(self._clock() - self._window_started, 1e-6)
+        throughput = self._window_bytes / elapsed
+        latency = self._window_busy_seconds / self._window_bytes if self._window_bytes else None
+
+        if self._under_pressure():
+            self._set_limit(int(self._limit * BACKOFF_FACTOR), 'the node is busy')
+        elif self._previous_throughput is None or throughput >= self._previous_throughput * THROUGHPUT_GAIN:
+            if latency is None or self._best_latency is None or latency <= self._best_latency * LATENCY_TOLERANCE:
+                self._set_limit(self._limit + 1, 'throughput went up to {:.1f}MB/s'.format(throughput / 1024 ** 2))
+
+        self._previous_throughput = throughput
+        if latency is not None:
+            self._best_latency = latency if self._best_latency is None else min(self._best_latency, latency)
+        self._start_window()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import pathlib
+import sqlite3
+import threading
+import typing as t
+
+
+class DigestCache(object):
+    """
+    Persistent cache of the MD5 digests of local files.
+
+    SSTables never change once written, and the hard links of a snapshot keep the inode of the live file. So a
+    file with the same device, inode, size and mtime as one digested by a previous backup has the same content,
+    and its digest can be reused instead of reading the whole file again.
+
+    Single part digests are stored with a part size of 0, multipart ones with the part size they were made with.
+    The cache is a SQLite database shared by the threads comparing files with the storage.
+    """
+
+    SINGLE_PART = 0
+
+    def __init__(self, path: t.Union[str, pathlib.Path]):
+        self._path = pathlib.Path(path).expanduser()
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(str(self._path), check_same_thread=False)
+            with self._connection:
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS digests ('
+                    'device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, part_size INTEGER, digest TEXT, '
+                    'PRIMARY KEY (device, inode, size, mtime_ns, part_size))'
+                )
+        return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def digest(self, src: t.Union[str, pathlib.Path], part_size: int, compute: t.Callable[[], str]) -> str:
+        """
+        Gives the digest of a file, only reading the file if no digest is known for its current version.
+
+        :param src: the local file
+        :param part_size: the part size of a multipart digest, or SINGLE_PART
+        :param compute: computes the digest when it is not in the cache
+        :return: the digest of the file
+        """
+        stat = pathlib.Path(src).stat()
+        key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, part_size)
+
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    'SELECT digest FROM digests '
+                    'WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ? AND part_size = ?',
+                    key
+                ).fetchone()
+        except sqlite3.Error as e:
+            logging.warning('Could not read the digest cache {}: {}'.format(self._path, e))
+            return compute()
+        if row is not None:
+            return row[0]
+
+        digest = compute()
+        try:
+            with self._lock:
+                with self._connect() as connection:
+                    connection.execute('INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)', key + (digest,))
+        except sqlite3.Error as e:
+            logging.warning('Could not update the digest cache {}: {}'.format(self._path, e))
+        return digest
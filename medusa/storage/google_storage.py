@@ -32,7 +32,10 @@ from tenacity.stop import stop_after_attempt
 from tenacity.wait import wait_fixed
 from gcloud.aio.storage import Storage
 
-from medusa.storage.abstract_storage import AbstractStorage, AbstractBlob, ManifestObject, ObjectDoesNotExistError
+from medusa.storage.abstract_storage import (
+    AbstractStorage, AbstractBlob, ManifestObject, ObjectDoesNotExistError, note_throttled_attempt
+)
+from medusa.storage.bandwidth_limiter import ThrottledReader, bandwidth_limiter
 
 
 DOWNLOAD_STREAM_CONSUMPTION_CHUNK_SIZE = 1024 * 1024 * 5
@@ -71,7 +74,8 @@ class GoogleStorage(AbstractStorage):
             self.multipart_chunksize_bytes = DOWNLOAD_STREAM_CONSUMPTION_CHUNK_SIZE
         logging.debug('GCS download chunk size: {} bytes'.format(self.multipart_chunksize_bytes))
 
-        concurrent_transfers = int(config.concurrent_transfers) if 'concurrent_transfers' in dir(config) else 0
+        has_concurrent_transfers = 'concurrent_transfers' in dir(config)
+        concurrent_transfers = AbstractStorage.max_concurrent_transfers(config) if has_concurrent_transfers else 0
         if concurrent_transfers > 0:
             logging.debug('Using concurrent transfers: {}'.format(concurrent_transfers))
             self.semaphore = asyncio.Semaphore(concurrent_transfers)
@@ -103,20 +107,21 @@ class GoogleStorage(AbstractStorage):
             logging.error('Error disconnecting from Google Storage: {}'.format(e))
 
     async def _list_blobs(self, prefix=None) -> t.List[AbstractBlob]:
-        self._ensure_session()
-        objects = self._paginate_objects(prefix=prefix)
+        return [blob async for blob in self._iter_blobs(prefix)]
 
-        return [
-            AbstractBlob(
+    async def _iter_blobs(self, prefix=None) -> t.AsyncIterator[AbstractBlob]:
+        self._ensure_session()
+        async for o in self._paginate_objects(prefix=prefix):
+            yield AbstractBlob(
                 o['name'],
                 int(o['size']),
                 o['md5Hash'],
                 # datetime comes as a string like 2023-08-31T14:23:24.957Z
-                datetime.datetime.strptime(o['timeCreated'], '%Y-%m-%dT%H:%M:%S.%fZ'),
+                datetime.datetime.strptime(o['timeCreated'], '%Y-%m-%dT%H:%M:%S.%fZ').replace(
+                    tzinfo=datetime.timezone.utc
+                ),
                 o['storageClass']
             )
-            async for o in objects
-        ]
 
     async def _paginate_objects(self, prefix=None):
 
@@ -176,7 +181,7 @@ class GoogleStorage(AbstractStorage):
             resp['name'], int(resp['size']), resp['md5Hash'], resp['timeCreated'], None
         )
 
-    @retry(stop=stop_after_attempt(MAX_UP_DOWN_LOAD_RETRIES), wait=wait_fixed(5))
+    @retry(stop=stop_after_attempt(MAX_UP_DOWN_LOAD_RETRIES), wait=wait_fixed(5), before_sleep=note_throttled_attempt)
     async def _download_blob(self, src: str, dest: str):
         self._ensure_session()
         blob = await self._stat_blob(src)
@@ -187,6 +192,33 @@ class GoogleStorage(AbstractStorage):
         src_path = Path(src)
         file_path = AbstractStorage.path_maybe_with_parent(dest, src_path)
 
+        try:
+            # a single stream is too slow for big objects, so we fetch their ranges over several connections.
+            # the semaphore is the connection budget of all the transfers, so each range takes one of its slots
+            if self.semaphore and self._should_download_in_ranges(blob.size):
+                logging.debug(
+                    '[Storage] Downloading gcs://{}/{} -> {} in ranges of {}'.format(
+                        self.config.bucket_name, object_key, file_path,
+                        self.human_readable_size(self.multipart_chunksize_bytes)
+                    )
+                )
+                await self._download_blob_in_ranges(
+                    object_key, blob.size, file_path, self.multipart_chunksize_bytes, self.semaphore
+                )
+            else:
+                await self._download_blob_in_one_stream(object_key, file_path)
+
+        except aiohttp.client_exceptions.ClientResponseError as cre:
+            logging.error('Error downloading file from gs://{}/{}: {}'.format(self.config.bucket_name, object_key, cre))
+            if cre.status == 404:
+                raise ObjectDoesNotExistError('Object {} does not exist'.format(object_key))
+            raise cre
+
+    def _should_download_in_ranges(self, size: int) -> bool:
+        threshold = AbstractStorage._human_size_to_bytes(str(self.config.multi_part_upload_threshold))
+        return size > self.multipart_chunksize_bytes and size >= threshold
+
+    async def _download_blob_in_one_stream(self, object_key: str, file_path: str):
         if self.semaphore:
             await self.semaphore.acquire()
         try:
@@ -206,17 +238,26 @@ class GoogleStorage(AbstractStorage):
                     chunk = await stream.read(self.multipart_chunksize_bytes)
                     if not chunk:
                         break
+                    await bandwidth_limiter.download.consume_async(len(chunk))
                     await f.write(chunk)
-
-        except aiohttp.client_exceptions.ClientResponseError as cre:
-            logging.error('Error downloading file from gs://{}/{}: {}'.format(self.config.bucket_name, object_key, cre))
-            if cre.status == 404:
-                raise ObjectDoesNotExistError('Object {} does not exist'.format(object_key))
-            raise cre
         finally:
             if self.semaphore:
                 self.semaphore.release()
 
+    async def _read_blob_range(self, object_key: str, start: int, end: int) -> t.AsyncIterator[bytes]:
+        self._ensure_session()
+        stream = await self.gcs_storage.download_stream(
+            bucket=self.bucket_name,
+            object_name=object_key,
+            headers={'Range': 'bytes={}-{}'.format(start, end)},
+            timeout=self.read_timeout,
+        )
+        while True:
+            chunk = await stream.read(self.multipart_chunksize_bytes)
+            if not chunk:
+                break
+            yield chunk
+
     async def _stat_blob(self, object_key: str) -> AbstractBlob:
         self._ensure_session()
         blob = await self.gcs_storage.download_metadata(
@@ -229,11 +270,13 @@ class GoogleStorage(AbstractStorage):
             int(blob['size']),
             blob['md5Hash'],
             # datetime comes as a string like 2023-08-31T14:23:24.957Z
-            datetime.datetime.strptime(blob['timeCreated'], '%Y-%m-%dT%H:%M:%S.%fZ'),
+            datetime.datetime.strptime(blob['timeCreated'], '%Y-%m-%dT%H:%M:%S.%fZ').replace(
+                tzinfo=datetime.timezone.utc
+            ),
             blob['storageClass']
         )
 
-    @retry(stop=stop_after_attempt(MAX_UP_DOWN_LOAD_RETRIES), wait=wait_fixed(5))
+    @retry(stop=stop_after_attempt(MAX_UP_DOWN_LOAD_RETRIES), wait=wait_fixed(5), before_sleep=note_throttled_attempt)
     async def _upload_blob(self, src: str, dest: str) -> ManifestObject:
         self._ensure_session()
         src_path = Path(src)
@@ -264,16 +307,20 @@ class GoogleStorage(AbstractStorage):
                 )
             )
             with open(src, 'rb') as src_file:
+                # aiohttp reads the file from a thread, which can then wait for the bandwidth limiter
                 resp = await self.gcs_storage.upload(
                     bucket=self.bucket_name,
                     object_name=object_key,
-                    file_data=src_file,
+                    file_data=ThrottledReader(src_file, bandwidth_limiter.upload),
                     force_resumable_upload=True,
                     timeout=None,
                 )
         mo = ManifestObject(resp['name'], int(resp['size']), resp['md5Hash'])
         return mo
 
+    def _is_throttling_error(self, exception: Exception) -> bool:
+        return isinstance(exception, aiohttp.client_exceptions.ClientResponseError) and exception.status in (429, 503)
+
     async def _get_object(self, object_key: str) -> AbstractBlob:
         self._ensure_session()
         try:
@@ -314,11 +361,12 @@ class GoogleStorage(AbstractStorage):
 
     @staticmethod
     def file_matches_storage(src: pathlib.Path, cached_item: ManifestObject, threshold=None, enable_md5_checks=False,
-                             chunk_size=None):
+                             chunk_size=None, digest_cache=None):
         return GoogleStorage.compare_with_manifest(
             actual_size=src.stat().st_size,
             size_in_manifest=cached_item.size,
-            actual_hash=AbstractStorage.generate_md5_hash(src) if enable_md5_checks else None,
+            actual_hash=AbstractStorage.generate_md5_hash(src, digest_cache=digest_cache)
+            if enable_md5_checks else None,
             hash_in_manifest=cached_item.MD5
         )
 
@@ -24,6 +24,7 @@ from pathlib import Path
 import aiofiles
 
 from medusa.storage.abstract_storage import AbstractStorage, AbstractBlob, ManifestObject, ObjectDoesNotExistError
+from medusa.storage.bandwidth_limiter import bandwidth_limiter
 
 
 BUFFER_SIZE = 4 * 1024 * 1024
@@ -31,6 +32,9 @@ BUFFER_SIZE = 4 * 1024 * 1024
 
 class LocalStorage(AbstractStorage):
 
+    # glob() gives the files in the order of the directory entries
+    listings_are_sorted = False
+
     def __init__(self, config):
         self.config = config
         self.bucket_name = self.config.bucket_name
@@ -49,25 +53,23 @@ class LocalStorage(AbstractStorage):
         pass
 
     async def _list_blobs(self, prefix=None):
-        if prefix is None:
-            paths = list(self.root_dir.glob('**/*'))
-        else:
-            paths = [
-                p for p in self.root_dir.glob('**/*')
-                # relative_to() cuts off the base_path and bucket, so it works just like cloud storages
-                if str(p.relative_to(self.root_dir)).startswith(str(prefix))
-            ]
-
-        return [
-            AbstractBlob(
+        return [blob async for blob in self._iter_blobs(prefix)]
+
+    async def _iter_blobs(self, prefix=None) -> t.AsyncIterator[AbstractBlob]:
+        # glob() walks the tree lazily, so we never hold more than the current blob
+        for p in self.root_dir.glob('**/*'):
+            # relative_to() cuts off the base_path and bucket, so it works just like cloud storages
+            if prefix is not None and not str(p.relative_to(self.root_dir)).startswith(str(prefix)):
+                continue
+            if p.is_dir():
+                continue
+            yield AbstractBlob(
                 str(p.relative_to(self.root_dir)),
                 os.stat(self.root_dir / p).st_size,
                 None,   # was self._md5(self.root_dir / p),  see Task1 for issue #829
                 datetime.datetime.fromtimestamp(os.stat(self.root_dir / p).st_mtime),
                 None
             )
-            for p in paths if not p.is_dir()
-        ]
 
     def _md5(self, file_path: str) -> str:
         with open(file_path, 'rb') as f:
@@ -119,6 +121,7 @@ class LocalStorage(AbstractStorage):
                     data = await f.read(BUFFER_SIZE)
                     if not data:
                         break
+                    await bandwidth_limiter.download.consume_async(len(data))
                     await d.write(data)
 
     async def _upload_blob(self, src: str, dest: str) -> ManifestObject:
@@ -146,6 +149,7 @@ class LocalStorage(AbstractStorage):
                     data = await f.read(BUFFER_SIZE)
                     if not data:
                         break
+                    await bandwidth_limiter.upload.consume_async(len(data))
                     await d.write(data)
                     md5.update(data)
 
@@ -174,6 +178,17 @@ class LocalStorage(AbstractStorage):
         async with aiofiles.open(object_path, 'rb') as f:
             return await f.read()
 
+    async def _read_blob_range(self, object_key: str, start: int, end: int) -> t.AsyncIterator[bytes]:
+        async with aiofiles.open(self.root_dir / object_key, 'rb') as f:
+            await f.seek(start)
+            remaining = end + 1 - start
+            while remaining > 0:
+                data = await f.read(min(BUFFER_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+
     async def _delete_object(self, obj: AbstractBlob):
         object_path = self.root_dir / obj.name
         os.remove(object_path)
@@ -194,7 +209,7 @@ class LocalStorage(AbstractStorage):
 
     @staticmethod
     def file_matches_storage(src: pathlib.Path, cached_item: ManifestObject, threshold=None, enable_md5_checks=False,
-                             chunk_size=None):
+                             chunk_size=None, digest_cache=None):
         return LocalStorage.compare_with_manifest(
             actual_size=src.stat().st_size,
             size_in_manifest=cached_item.size
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Reading and writing of the backup manifests.
+
+A manifest lists the objects (path, MD5, size) of every table of a node backup. Historically it is a JSON document,
+which has to be parsed in full to get anything out of it. The compact format stores the same content as:
+
+    magic (4 bytes) | format version (1 byte) | number of tables
+    table index: for each table, keyspace | table | number of objects | total size | length of its objects
+    objects of each table, in the order of the index
+
+Numbers are unsigned LEB128 varints and strings are a varint length followed by UTF-8 bytes. Each object is stored
+as the length of the prefix its path shares with the previous object of the table, the rest of its path, its size
+and its digest. Digests are stored as binary when they are hex or base64 MD5s, which is what the storage providers
+give us. The index tells where the objects of each table start, so a single table gets read without decoding the
+others, and sizes or object counts come straight from the index.
+"""
+import base64
+import binascii
+import collections
+import json
+import os
+import typing as t
+
+MANIFEST_FORMAT_JSON = 'json'
+MANIFEST_FORMAT_COMPACT = 'compact'
+MANIFEST_FORMATS = [MANIFEST_FORMAT_JSON, MANIFEST_FORMAT_COMPACT]
+
+COMPACT_MANIFEST_MAGIC = b'MDSM'
+COMPACT_MANIFEST_VERSION = 1
+
+# how the digest of an object is stored
+_DIGEST_STRING = 0
+_DIGEST_HEX = 1
+_DIGEST_BASE64 = 2
+_DIGEST_MULTIPART_HEX = 3
+_DIGEST_NONE = 4
+
+MD5_SIZE = 16
+
+ManifestTable = collections.namedtuple(
+    'ManifestTable', ['keyspace', 'columnfamily', 'num_objects', 'size', 'offset', 'length']
+)
+
+
+def _write_varint(buffer: bytearray, value: int):
+    if value < 0:
+        raise ValueError('Cannot store negative number {} in a compact manifest'.format(value))
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            buffer.append(byte | 0x80)
+        else:
+            buffer.append(byte)
+            return
+
+
+def _read_varint(data: memoryview, position: int) -> t.Tuple[int, int]:
+    value, shift = 0, 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def _write_bytes(buffer: bytearray, value: bytes):
+    _write_varint(buffer, len(value))
+    buffer.extend(value)
+
+
+def _read_bytes(data: memoryview, position: int) -> t.Tuple[bytes, int]:
+    length, position = _read_varint(data, position)
+    return bytes(data[position:position + length]), position + length
+
+
+def _md5_from_hex(digest: str) -> t.Optional[bytes]:
+    if len(digest) != 2 * MD5_SIZE:
+        return None
+    try:
+        raw = bytes.fromhex(digest)
+    except ValueError:
+        return None
+    # upper case digests would not come back the same
+    return raw if raw.hex() == digest else None
+
+
+def _md5_from_base64(digest: str) -> t.Optional[bytes]:
+    try:
+        raw = base64.b64decode(digest, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if len(raw) != MD5_SIZE or base64.b64encode(raw).decode('ascii') != digest:
+        return None
+    return raw
+
+
+def _write_digest(buffer: bytearray, digest: t.Optional[str]):
+    if digest is None:
+        buffer.append(_DIGEST_NONE)
+        return
+
+    raw = _md5_from_hex(digest)
+    if raw is not None:
+        buffer.append(_DIGEST_HEX)
+        buffer.extend(raw)
+        return
+
+    raw = _md5_from_base64(digest)
+    if raw is not None:
+        buffer.append(_DIGEST_BASE64)
+        buffer.extend(raw)
+        return
+
+    # S3 ETags of multipart uploads are the hex MD5 of the parts' MD5s, followed by the number of parts
+    md5, _, parts = digest.partition('-')
+    raw = _md5_from_hex(md5)
+    if raw is not None and parts.isdigit() and str(int(parts)) == parts:
+        buffer.append(_DIGEST_MULTIPART_HEX)
+        buffer.extend(raw)
+        _write_varint(buffer, int(parts))
+        return
+
+    buffer.append(_DIGEST_STRING)
+    _write_bytes(buffer, digest.encode('utf-8'))
+
+
+def _read_digest(data: memoryview, position: int) -> t.Tuple[t.Optional[str], int]:
+    kind = data[position]
+    position += 1
+    if kind == _DIGEST_NONE:
+        return None, position
+    if kind == _DIGEST_STRING:
+        raw, position = _read_bytes(data, position)
+        return raw.decode('utf-8'), position
+
+    raw = bytes(data[position:position + MD5_SIZE])
+    position += MD5_SIZE
+    if kind == _DIGEST_HEX:
+        return raw.hex(), position
+    if kind == _DIGEST_BASE64:
+        return base64.b64encode(raw).decode('ascii'), position
+    if kind == _DIGEST_MULTIPART_HEX:
+        parts, position = _read_varint(data, position)
+        return '{}-{}'.format(raw.hex(), parts), position
+    raise ValueError('Unknown digest type {} in compact manifest'.format(kind))
+
+
+def _encode_objects(objects: t.List[dict]) -> bytes:
+    buffer = bytearray()
+    previous_path = b''
+    for obj in objects:
+        path = obj['path'].encode('utf-8')
+        shared = len(os.path.commonprefix([previous_path, path]))
+        _write_varint(buffer, shared)
+        _write_bytes(buffer, path[shared:])
+        _write_varint(buffer, int(obj['size']))
+        _write_digest(buffer, obj['MD5'])
+        previous_path = path
+    return bytes(buffer)
+
+
+def encode_manifest(sections: t.List[dict]) -> bytes:
+    """
+    Turns manifest sections, as they are in JSON manifests, into a compact manifest.
+    """
+    index = bytearray()
+    bodies = []
+    _write_varint(index, len(sections))
+    for section in sections:
+        body = _encode_objects(section['objects'])
+        _write_bytes(index, section['keyspace'].encode('utf-8'))
+        _write_bytes(index, section['columnfamily'].encode('utf-8'))
+        _write_varint(index, len(section['objects']))
+        _write_varint(index, sum(int(obj['size']) for obj in section['objects']))
+        _write_varint(index, len(body))
+        bodies.append(body)
+    return COMPACT_MANIFEST_MAGIC + bytes([COMPACT_MANIFEST_VERSION]) + bytes(index) + b''.join(bodies)
+
+
+def serialize_manifest(sections: t.List[dict], manifest_format: str = MANIFEST_FORMAT_JSON) -> t.Union[str, bytes]:
+    if manifest_format == MANIFEST_FORMAT_JSON:
+        return json.dumps(sections)
+    if manifest_format == MANIFEST_FORMAT_COMPACT:
+        return encode_manifest(sections)
+    raise ValueError('Unknown manifest format {}, expected one of {}'.format(manifest_format, MANIFEST_FORMATS))
+
+
+class Manifest(object):
+    """
+    Read-only view of a node backup manifest, in either format.
+
+    Iterating over it gives the sections (one dict per table, with 'keyspace', 'columnfamily' and 'objects'), just
+    like iterating over a parsed JSON manifest does. With a compact manifest, sections are only decoded when they get
+    asked for, and nothing decoded is kept around.
+    """
+
+    def __init__(self, content: t.Union[str, bytes]):
+        if self.is_compact_content(content):
+            self._data = memoryview(content)
+            self._sections = None
+            self._tables = self._read_index()
+        else:
+            if isinstance(content, (bytes, bytearray)):
+                content = content.decode('utf-8')
+            self._data = None
+            self._sections = json.loads(content)
+            self._tables = [
+                ManifestTable(
+                    section['keyspace'], section['columnfamily'], len(section['objects']),
+                    sum(int(obj['size']) for obj in section['objects']), i, None
+                )
+                # for JSON manifests, the offset of a table is the position of its section in the document
+                for i, section in enumerate(self._sections)
+            ]
+
+    @staticmethod
+    def is_compact_content(content: t.Union[str, bytes]) -> bool:
+        return isinstance(content, (bytes, bytearray)) and content.startswith(COMPACT_MANIFEST_MAGIC)
+
+    @property
+    def is_compact(self) -> bool:
+        return self._data is not None
+
+    def _read_index(self) -> t.List[ManifestTable]:
+        version = self._data[len(COMPACT_MANIFEST_MAGIC)]
+        if version != COMPACT_MANIFEST_VERSION:
+            raise ValueError('Unsupported compact manifest version {}'.format(version))
+        try:
+            position = len(COMPACT_MANIFEST_MAGIC) + 1
+            num_tables, position = _read_varint(self._data, position)
+            entries = []
+            for _ in range(num_tables):
+                keyspace, position = _read_bytes(self._data, position)
+                columnfamily, position = _read_bytes(self._data, position)
+                num_objects, position = _read_varint(self._data, position)
+                size, position = _read_varint(self._data, position)
+                length, position = _read_varint(self._data, position)
+                entries.append((keyspace.decode('utf-8'), columnfamily.decode('utf-8'), num_objects, size, length))
+        except IndexError:
+            raise ValueError('Compact manifest is truncated or corrupted')
+
+        tables = []
+        offset = position
+        for keyspace, columnfamily, num_objects, size, length in entries:
+            tables.append(ManifestTable(keyspace, columnfamily, num_objects, size, offset, length))
+            offset += length
+        if offset != len(self._data):
+            raise ValueError('Compact manifest is truncated or corrupted')
+        return tables
+
+    def _decode_objects(self, table: ManifestTable) -> t.List[dict]:
+        objects = []
+        position, end = table.offset, table.offset + table.length
+        previous_path = b''
+        while position < end:
+            shared, position = _read_varint(self._data, position)
+            suffix, position = _read_bytes(self._data, position)
+            size, position = _read_varint(self._data, position)
+            digest, position = _read_digest(self._data, position)
+            path = previous_path[:shared] + suffix
+            objects.append({'path': path.decode('utf-8'), 'MD5': digest, 'size': size})
+            previous_path = path
+        return objects
+
+    def _section(self, table: ManifestTable) -> dict:
+        if self._sections is not None:
+            return self._sections[table.offset]
+        return {'keyspace': table.keyspace, 'columnfamily': table.columnfamily, 'objects': self._decode_objects(table)}
+
+    @staticmethod
+    def _fqtn(table: ManifestTable) -> str:
+        return '{}.{}'.format(table.keyspace, table.columnfamily)
+
+    def tables(self) -> t.List[ManifestTable]:
+        """
+        The tables of the manifest, without their objects.
+        """
+        return list(self._tables)
+
+    def section(self, keyspace: str, columnfamily: str) -> t.Optional[dict]:
+        """
+        Reads the section of a single table, the table name including its id as it does in the manifest.
+        """
+        for table in self._tables:
+            if table.keyspace == keyspace and table.columnfamily == columnfamily:
+                return self._section(table)
+        return None
+
+    def sections(self, fqtns: t.Optional[t.Collection[str]] = None) -> t.Iterator[dict]:
+        """
+        Reads the sections of the tables whose keyspace.table-id is in fqtns, or of all the tables if fqtns is None.
+        """
+        for table in self._tables:
+            if fqtns is None or self._fqtn(table) in fqtns:
+                yield self._section(table)
+
+    def __iter__(self) -> t.Iterator[dict]:
+        return self.sections()
+
+    def __len__(self) -> int:
+        return len(self._tables)
+
+    def size(self, fqtns: t.Optional[t.Collection[str]] = None) -> int:
+        return sum(table.size for table in self._tables if fqtns is None or self._fqtn(table) in fqtns)
+
+    def num_objects(self, fqtns: t.Optional[t.Collection[str]] = None) -> int:
+        return sum(table.num_objects for table in self._tables if fqtns is None or self._fqtn(table) in fqtns)
+
+    def to_json(self) -> str:
+        return json.dumps(list(self.sections()))
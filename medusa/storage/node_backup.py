@@ -17,6 +17,9 @@ import logging
 import pathlib
 import re
 
+from medusa.storage.backup_stats import BackupStats
+from medusa.storage.manifest import Manifest
+
 
 class NodeBackup(object):
 
@@ -65,6 +68,7 @@ class NodeBackup(object):
         self._differential_path = self._meta_path / 'differential'
         self._restore_verify_query_path = self._meta_path / 'restore_verify_query.json'
         self._server_version_path = self._meta_path / 'server_version.json'
+        self._stats_path = '{}index/backup_stats/{}/{}.json'.format(storage.prefix_path, name, fqdn)
 
         if preloaded_blobs is None:
             preloaded_blobs = []
@@ -72,8 +76,12 @@ class NodeBackup(object):
                 preloaded_blobs = storage.storage_driver.list_objects('{}/'.format(self._meta_path))
 
         self._cached_blobs = {pathlib.Path(blob.name): blob for blob in preloaded_blobs}
+        self._missing_blobs = set()
+        self._cached_contents = {}
 
         self.cached_manifest = None
+        self.cached_manifest_content = None
+        self.cached_stats = None
         self.cached_manifest_blob = manifest_blob
         self.cached_schema_blob = schema_blob
         self.cached_tokenmap_blob = tokenmap_blob
@@ -94,6 +102,33 @@ class NodeBackup(object):
             self._cached_blobs[path] = blob
         return blob
 
+    def cache_blob(self, path, blob):
+        """
+        Remembers a blob of this backup fetched along with the ones of other backups, or that it does not exist if
+        blob is None.
+        """
+        if blob is not None:
+            self._cached_blobs[pathlib.Path(path)] = blob
+        else:
+            self._missing_blobs.add(pathlib.Path(path))
+
+    def cache_content(self, path, content):
+        """
+        Remembers the content of a meta blob of this backup read along with the ones of other backups, or that it does
+        not exist if content is None.
+        """
+        if content is not None:
+            self._cached_contents[pathlib.Path(path)] = content
+        else:
+            self._missing_blobs.add(pathlib.Path(path))
+
+    def is_cached(self, path):
+        path = pathlib.Path(path)
+        return path in self._cached_contents or path in self._missing_blobs
+
+    def is_missing(self, path):
+        return pathlib.Path(path) in self._missing_blobs
+
     @property
     def name(self):
         return self._name
@@ -120,6 +155,8 @@ class NodeBackup(object):
 
     @property
     def tokenmap(self):
+        if self.tokenmap_path in self._cached_contents:
+            return self._cached_contents[self.tokenmap_path].decode('utf-8')
         if self.cached_tokenmap_blob is None:
             self.cached_tokenmap_blob = self._blob(self.tokenmap_path)
         return self._storage.storage_driver.read_blob_as_string(self.cached_tokenmap_blob)
@@ -135,6 +172,10 @@ class NodeBackup(object):
     @property
     def server_version(self):
         try:
+            if self.server_version_path in self._cached_contents:
+                return self._cached_contents[self.server_version_path].decode('utf-8')
+            if self.server_version_path in self._missing_blobs:
+                raise FileNotFoundError(str(self.server_version_path))
             if self.cached_server_version_blob is None:
                 self.cached_server_version_blob = self._blob(self.server_version_path)
             return self._storage.storage_driver.read_blob_as_string(self.cached_server_version_blob)
@@ -247,14 +288,49 @@ class NodeBackup(object):
         return self._manifest_path
 
     @property
-    def manifest(self):
+    def manifest_content(self):
+        """
+        The manifest as it is stored, a JSON string or the bytes of a compact manifest. None if there is no manifest.
+        """
+        if self.cached_manifest_content is None:
+            content = self._cached_contents.pop(self.manifest_path, None)
+            if content is None:
+                if self.manifest_path in self._missing_blobs:
+                    return None
+                blob = self._storage.storage_driver.get_blob(str(self.manifest_path))
+                if blob is None:
+                    return None
+                content = self._storage.storage_driver.read_blob_as_bytes(blob)
+            self.cached_manifest_content = content if Manifest.is_compact_content(content) else content.decode('utf-8')
+        return self.cached_manifest_content
+
+    def read_manifest(self):
+        """
+        Gives the manifest as a Manifest, which only decodes the tables it gets asked for. None if there is no manifest.
+        """
         if self.cached_manifest is None:
-            self.cached_manifest = self._storage.storage_driver.get_blob_content_as_string(self.manifest_path)
+            content = self.manifest_content
+            if content is None:
+                return None
+            self.cached_manifest = Manifest(content)
         return self.cached_manifest
 
+    @property
+    def manifest(self):
+        """
+        The manifest as a JSON string, whatever the format it is stored in.
+        """
+        manifest = self.read_manifest()
+        if manifest is None:
+            return None
+        return self.manifest_content if not manifest.is_compact else manifest.to_json()
+
     @manifest.setter
     def manifest(self, manifest):
         self.cached_manifest = None
+        self.cached_manifest_content = None
+        self.cached_stats = None
+        self._missing_blobs.discard(self.manifest_path)
         self._storage.storage_driver.upload_blob_from_string(self.manifest_path, manifest)
 
     def datapath(self, *, keyspace, columnfamily):
@@ -265,17 +341,37 @@ class NodeBackup(object):
         return self._node_backup_path
 
     def exists(self):
+        if self.schema_path in self._missing_blobs:
+            return False
         return self._blob(self.schema_path) is not None
 
+    @property
+    def stats_path(self):
+        return self._stats_path
+
+    @property
+    def stats(self):
+        """
+        The BackupStats of this backup. They come from the index, or from the manifest for backups taken before
+        Medusa wrote them there.
+        """
+        if self.cached_stats is None:
+            content = self._cached_contents.pop(pathlib.Path(self.stats_path), None)
+            if content is None and pathlib.Path(self.stats_path) not in self._missing_blobs:
+                blob = self._storage.storage_driver.get_blob(self.stats_path)
+                if blob is not None:
+                    content = self._storage.storage_driver.read_blob_as_bytes(blob)
+            if content is not None:
+                try:
+                    self.cached_stats = BackupStats.from_json(content)
+                except (ValueError, KeyError) as e:
+                    logging.warning('Ignoring the stats of backup {} of {}: {}'.format(self._name, self._fqdn, e))
+            if self.cached_stats is None:
+                self.cached_stats = BackupStats.from_manifest(self.read_manifest())
+        return self.cached_stats
+
     def size(self):
-        return sum(
-            obj['size']
-            for section in json.loads(self.manifest)
-            for obj in section['objects']
-        )
+        return self.stats.size
 
     def num_objects(self):
-        return sum(
-            len(section['objects'])
-            for section in json.loads(self.manifest)
-        )
+        return self.stats.num_objects
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import collections
+import gzip
+import json
+import logging
+import pathlib
+import time
+import typing as t
+
+from medusa.storage.backup_catalog import SEGMENT_RETENTION
+
+REFERENCE_INDEX_VERSION = 1
+ADDED_SEGMENT_SUFFIX = '.json.gz'
+
+
+class ObjectReferences(object):
+    """
+    The objects of the data folder of a node, each with the set of differential backups referencing it.
+    """
+
+    def __init__(self, backups: t.Iterable[str] = (), objects: t.Optional[t.Dict[str, t.Set[str]]] = None):
+        # backups without objects are still known to the index, so they don't look like missing ones
+        self.backups = set(backups)
+        self.objects = collections.defaultdict(set, objects or {})
+
+    def add_backup(self, backup_name: str, paths: t.Iterable[str]):
+        self.backups.add(backup_name)
+        for path in paths:
+            self.objects[path].add(backup_name)
+
+    def remove_backup(self, backup_name: str):
+        if backup_name not in self.backups:
+            return
+        self.backups.discard(backup_name)
+        for path in list(self.objects):
+            self.objects[path].discard(backup_name)
+            if not self.objects[path]:
+                del self.objects[path]
+
+    def referenced_paths(self) -> t.Set[str]:
+        return set(self.objects)
+
+    def to_json(self) -> str:
+        backups = sorted(self.backups)
+        ids = {name: i for i, name in enumerate(backups)}
+        return json.dumps({
+            'version': REFERENCE_INDEX_VERSION,
+            'backups': backups,
+            'objects': {path: sorted(ids[name] for name in names) for path, names in self.objects.items()},
+        }, separators=(',', ':'))
+
+    @staticmethod
+    def from_json(content: t.Union[str, bytes]) -> 'ObjectReferences':
+        index = json.loads(content)
+        if index['version'] != REFERENCE_INDEX_VERSION:
+            raise ValueError('Unsupported reference index version {}'.format(index['version']))
+        backups = index['backups']
+        return ObjectReferences(backups, {path: {backups[i] for i in ids} for path, ids in index['objects'].items()})
+
+
+class ReferenceIndex(object):
+    """
+    Tells which differential backups of a node reference each object of its data folder, so purges can find the
+    objects no backup needs anymore without reading every manifest.
+
+    It works like the BackupCatalog: a snapshot holding the references, and segments added when a backup finishes
+    (holding the paths of its objects) or gets purged (empty, everything is in the name):
+
+        index/references/<fqdn>/segments/added_<timestamp>_<backup name>.json.gz
+        index/references/<fqdn>/segments/removed_<timestamp>_<backup name>
+
+    Reading the index applies the segments on top of the snapshot, and purges compact them into a new snapshot.
+    Backups taken by versions of Medusa that did not write segments are missing from the index, which is why
+    purges check it against the list of backups and complete it when needed, see purge.cleanup_obsolete_files().
+    """
+
+    def __init__(self, storage, fqdn: str, clock: t.Callable[[], float] = time.time):
+        self._storage = storage
+        self._clock = clock
+        self._snapshot_path = '{}index/references/{}/snapshot.json.gz'.format(storage.prefix_path, fqdn)
+        self._segments_path = '{}index/references/{}/segments/'.format(storage.prefix_path, fqdn)
+        self._read_at = None
+
+    @staticmethod
+    def manifest_paths(manifest) -> t.Set[str]:
+        return {obj['path'] for columnfamily_manifest in manifest for obj in columnfamily_manifest['objects']}
+
+    def record_added(self, backup_name: str, paths: t.Iterable[str]):
+        content = json.dumps(sorted(paths), separators=(',', ':'))
+        self._storage.storage_driver.upload_blob_from_string(
+            '{}added_{}_{}{}'.format(self._segments_path, int(self._clock()), backup_name, ADDED_SEGMENT_SUFFIX),
+            gzip.compress(content.encode())
+        )
+
+    def record_removed(self, backup_name: str):
+        self._storage.storage_driver.upload_blob_from_string(
+            '{}removed_{}_{}'.format(self._segments_path, int(self._clock()), backup_name), ''
+        )
+
+    def _list_segments(self):
+        return self._storage.storage_driver.list_objects(self._segments_path)
+
+    def last_removal(self) -> t.Optional[float]:
+        """
+        When a backup last got removed from the index, or the index last got compacted, as a unix timestamp. Purges
+        go through either before deleting objects of the node, and the removed segments get merged into the snapshot
+        by compactions.
+        """
+        driver = self._storage.storage_driver
+        timestamps = []
+        for blob in self._list_segments():
+            try:
+                timestamp, kind, _ = self._parse_segment(blob)
+            except ValueError:
+                continue
+            if kind == 'removed':
+                timestamps.append(timestamp)
+        snapshot = driver.get_blob(self._snapshot_path)
+        if snapshot is not None:
+            timestamps.append(driver.get_object_datetime(snapshot).timestamp())
+        return max(timestamps, default=None)
+
+    @staticmethod
+    def _parse_segment(blob) -> t.Tuple[int, str, str]:
+        kind, timestamp, backup_name = pathlib.Path(blob.name).name.split('_', 2)
+        if kind == 'added' and backup_name.endswith(ADDED_SEGMENT_SUFFIX):
+            return int(timestamp), kind, backup_name[:-len(ADDED_SEGMENT_SUFFIX)]
+        if kind == 'removed':
+            return int(timestamp), kind, backup_name
+        raise ValueError('Unknown segment kind {}'.format(kind))
+
+    def read(self) -> t.Tuple[ObjectReferences, t.List]:
+        """
+        Reads the references, along with the segments they were read from.
+        """
+        self._read_at = self._clock()
+        # segments first: a compaction writes its snapshot before deleting the segments it merged
+        segments = self._list_segments()
+        driver = self._storage.storage_driver
+        snapshot = driver.get_blob(self._snapshot_path)
+        references = ObjectReferences()
+        if snapshot is not None:
+            try:
+                references = ObjectReferences.from_json(gzip.decompress(driver.read_blob_as_bytes(snapshot)))
+            except ValueError as e:
+                # the backups it held then look missing from the index, so purges read their manifests
+                logging.warning('Ignoring the reference index snapshot {}: {}'.format(self._snapshot_path, e))
+
+        events = []
+        for blob in segments:
+            try:
+                events.append(self._parse_segment(blob) + (blob,))
+            except ValueError:
+                logging.warning('Ignoring malformed reference index segment {}'.format(blob.name))
+
+        added = [blob.name for _, kind, _, blob in events if kind == 'added']
+        contents = driver.get_blobs_contents(added)
+        # a backup can get removed and taken again under the same name, hence applying them in order
+        for _, kind, backup_name, blob in sorted(events, key=lambda event: event[:2]):
+            if kind == 'removed':
+                references.remove_backup(backup_name)
+            elif contents[blob.name] is not None:
+                references.add_backup(backup_name, json.loads(gzip.decompress(contents[blob.name])))
+        return references, segments
+
+    def compact(self, references: ObjectReferences, segments):
+        """
+        Writes references obtained from read() as the new snapshot, and deletes the segments they were read from which
+        are older than SEGMENT_RETENTION. Gives up if read() happened more than half of it ago, for the same reasons as
+        BackupCatalog.compact().
+        """
+        if self._read_at is None or self._clock() - self._read_at > SEGMENT_RETENTION / 2:
+            logging.warning('Reference index compaction took too long, not writing its outcome')
+            return
+        horizon = self._clock() - SEGMENT_RETENTION
+        driver = self._storage.storage_driver
+        compactable = [blob for blob in segments if driver.get_object_datetime(blob).timestamp() <= horizon]
+        logging.info('Compacting the reference index: {} objects, {} segments merged'.format(
+            len(references.objects), len(compactable)
+        ))
+        driver.upload_blob_from_string(self._snapshot_path, gzip.compress(references.to_json().encode()))
+        driver.delete_objects(compactable)
@@ -20,6 +20,7 @@ import pathlib
 import boto3
 import botocore.session
 import concurrent.futures
+import functools
 import logging
 import io
 import os
@@ -29,15 +30,36 @@ from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
 from botocore.exceptions import ClientError
 from pathlib import Path
-from tenacity import retry, stop_after_attempt, wait_fixed
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_fixed
 
 from medusa.storage.abstract_storage import (
-    AbstractStorage, AbstractBlob, AbstractBlobMetadata, ManifestObject, ObjectDoesNotExistError
+    AbstractStorage, AbstractBlob, AbstractBlobMetadata, ManifestObject, ObjectDoesNotExistError,
+    MAX_CONCURRENT_METADATA_REQUESTS
 )
+from medusa.storage.bandwidth_limiter import bandwidth_limiter
 
 
 MAX_UP_DOWN_LOAD_RETRIES = 5
 AWS_KMS_ENCRYPTION = 'aws:kms'
+# the most keys a single DeleteObjects request accepts
+S3_MAX_KEYS_PER_DELETE = 1000
+# error codes S3 and its clones answer with when we send them too many requests
+S3_THROTTLING_ERROR_CODES = {'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequests'}
+
+
+class ThrottledDeleteError(Exception):
+    """
+    Raised when S3 throttled some of the keys of a DeleteObjects request, so it gets retried.
+    """
+
+    def __init__(self, failures: t.Dict[str, str]):
+        super().__init__('{} keys could not be deleted because of throttling'.format(len(failures)))
+        self.failures = failures
+
+
+def _is_not_implemented(exception: Exception) -> bool:
+    return isinstance(exception, ClientError) and exception.response['Error']['Code'] == 'NotImplemented'
+
 
 """
     S3BaseStorage supports all the S3 compatible storages. Certain providers might override this method
@@ -124,10 +146,17 @@ class S3BaseStorage(AbstractStorage):
         self.transfer_config = self._make_transfer_config(config)
         logging.debug('S3 multipart chunk size: {} bytes'.format(self.transfer_config.multipart_chunksize))
 
-        self.executor = concurrent.futures.ThreadPoolExecutor(int(config.concurrent_transfers))
+        self.executor = concurrent.futures.ThreadPoolExecutor(AbstractStorage.max_concurrent_transfers(config))
+        # boto3 is not asyncio aware, so every call to S3 runs in a thread to keep the event loop free.
+        # small requests get their own threads, so they don't queue up behind long transfers
+        self.metadata_executor = concurrent.futures.ThreadPoolExecutor(MAX_CONCURRENT_METADATA_REQUESTS)
 
         self.read_timeout = int(config.read_timeout) if 'read_timeout' in dir(config) and config.read_timeout else None
 
+        # the ETag of an object uploaded in a single part is the MD5 of its content, unless it got encrypted with
+        # a KMS or customer key. None means we don't know yet, the first single part upload finds it out
+        self.single_part_etag_is_md5 = None if self.kms_id is None and self.sse_c_key is None else False
+
         super().__init__(config)
 
     def connect(self):
@@ -138,9 +167,10 @@ class S3BaseStorage(AbstractStorage):
         )
 
         # pool must cover all threads boto can open: concurrent_transfers files * max_concurrency chunks each,
-        # plus headroom for incidental calls sharing the same pool (head_object, list_blobs, manifest uploads...)
+        # plus the threads making incidental calls sharing the same pool (head_object, list_blobs, manifest uploads...)
         multipart_max_concurrency = int(self.config.multipart_max_concurrency or 4)
-        max_pool_size = int(self.config.concurrent_transfers) * multipart_max_concurrency + 10
+        max_pool_size = AbstractStorage.max_concurrent_transfers(self.config) * multipart_max_concurrency \
+            + MAX_CONCURRENT_METADATA_REQUESTS
 
         boto_config = Config(
             region_name=self.credentials.region,
@@ -169,12 +199,25 @@ class S3BaseStorage(AbstractStorage):
                 config=boto_config,
                 **self.connection_extra_args
             )
+        # boto retries throttled requests on its own, so we hear about them from its retry hook
+        self.s3_client.meta.events.register('needs-retry.s3', self._note_throttled_request)
+
+    def _note_throttled_request(self, response=None, **kwargs):
+        if response is None:
+            return None
+        http_response, parsed = response
+        error_code = parsed.get('Error', {}).get('Code') if isinstance(parsed, dict) else None
+        if http_response.status_code == 503 or error_code in S3_THROTTLING_ERROR_CODES:
+            self.transfer_concurrency.throttled()
+        # returning something would tell boto how long to wait before retrying
+        return None
 
     def disconnect(self):
         logging.debug('Disconnecting from S3...')
         try:
             self.s3_client.close()
             self.executor.shutdown()
+            self.metadata_executor.shutdown()
         except Exception as e:
             logging.error('Error disconnecting from S3: {}'.format(e))
 
@@ -200,7 +243,6 @@ class S3BaseStorage(AbstractStorage):
 
     def _make_transfer_config(self, config):
 
-        transfer_max_bandwidth = config.transfer_max_bandwidth or None
         multipart_chunksize = config.multipart_chunksize or None
         multipart_max_concurrency = int(config.multipart_max_concurrency or 4)
         multipart_threshold = (
@@ -213,9 +255,8 @@ class S3BaseStorage(AbstractStorage):
             'multipart_threshold': multipart_threshold,
         }
 
-        if transfer_max_bandwidth is not None:
-            transfer_config['max_bandwidth'] = AbstractStorage._human_size_to_bytes(transfer_max_bandwidth)
-
+        # no max_bandwidth here: boto would apply it to each transfer separately, the bandwidth_limiter
+        # gets the bytes of all the transfers from the callbacks instead
         if multipart_chunksize is not None:
             transfer_config['multipart_chunksize'] = AbstractStorage._human_size_to_bytes(multipart_chunksize)
         return TransferConfig(**transfer_config)
@@ -265,20 +306,25 @@ class S3BaseStorage(AbstractStorage):
             raise ValueError("Unknown provider name {}".format(provider_name))
 
     async def _list_blobs(self, prefix=None) -> t.List[AbstractBlob]:
+        return [blob async for blob in self._iter_blobs(prefix)]
 
-        blobs = []
+    async def _call_s3(self, fn: t.Callable, *args, **kwargs):
+        # runs a blocking boto3 call in a thread, so concurrent coroutines really make concurrent requests
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.metadata_executor, functools.partial(fn, *args, **kwargs))
 
-        response = self.s3_client.get_paginator('list_objects_v2').paginate(
+    async def _iter_blobs(self, prefix=None) -> t.AsyncIterator[AbstractBlob]:
+        pages = iter(self.s3_client.get_paginator('list_objects_v2').paginate(
             Bucket=self.bucket_name,
             Prefix=str(prefix),
             PaginationConfig={'PageSize': 1000}
-        ).build_full_result()
+        ))
 
-        for o in response.get('Contents', []):
-            obj_hash = o['ETag'].replace('"', '')
-            blobs.append(AbstractBlob(o['Key'], o['Size'], obj_hash, o['LastModified'], o['StorageClass']))
-
-        return blobs
+        # each page is a request, so we fetch them from a thread too
+        while (page := await self._call_s3(next, pages, None)) is not None:
+            for o in page.get('Contents', []):
+                obj_hash = o['ETag'].replace('"', '')
+                yield AbstractBlob(o['Key'], o['Size'], obj_hash, o['LastModified'], o['StorageClass'])
 
     @retry(stop=stop_after_attempt(MAX_UP_DOWN_LOAD_RETRIES), wait=wait_fixed(5))
     async def _upload_object(self, data: io.BytesIO, object_key: str, headers: t.Dict[str, str]) -> AbstractBlob:
@@ -305,7 +351,8 @@ class S3BaseStorage(AbstractStorage):
         try:
             # not passing in the transfer config because that is meant to cap a throughput
             # here we are uploading a small-ish file so no need to cap
-            self.s3_client.put_object(
+            await self._call_s3(
+                self.s3_client.put_object,
                 Bucket=self.bucket_name,
                 Key=object_key,
                 Body=data,
@@ -355,6 +402,7 @@ class S3BaseStorage(AbstractStorage):
                 Filename=file_path,
                 ExtraArgs=extra_args,
                 Config=self.transfer_config,
+                Callback=bandwidth_limiter.download.consume,
             )
         except Exception as e:
             logging.error('Error downloading file from s3://{}/{}: {}'.format(self.bucket_name, object_key, e))
@@ -367,7 +415,9 @@ class S3BaseStorage(AbstractStorage):
                 extra_args['SSECustomerAlgorithm'] = 'AES256'
                 extra_args['SSECustomerKey'] = self.sse_c_key
 
-            resp = self.s3_client.head_object(Bucket=self.bucket_name, Key=object_key, **extra_args)
+            resp = await self._call_s3(
+                self.s3_client.head_object, Bucket=self.bucket_name, Key=object_key, **extra_args
+            )
             item_hash = resp['ETag'].replace('"', '')
             return AbstractBlob(object_key, int(resp['ContentLength']), item_hash, resp['LastModified'], None)
         except ClientError as e:
@@ -422,6 +472,7 @@ class S3BaseStorage(AbstractStorage):
             'Key': object_key,
             'Config': self.transfer_config,
             'ExtraArgs': extra_args,
+            'Callback': bandwidth_limiter.upload.consume,
         }
         # we are going to combine asyncio with boto's threading
         # we do this by submitting the upload into an executor
@@ -434,15 +485,29 @@ class S3BaseStorage(AbstractStorage):
     def __upload_file(self, upload_conf):
         self.s3_client.upload_file(**upload_conf)
 
+        blob_name = upload_conf['Key']
+        file_size = os.stat(upload_conf['Filename']).st_size
+        local_hash = None
+        # boto does a single PutObject below the threshold. the file was just read for the upload, so digesting it
+        # costs less than a HEAD request. the few multipart uploads keep asking S3 for their ETag
+        if file_size < self.transfer_config.multipart_threshold and self.single_part_etag_is_md5 is not False:
+            local_hash = base64.b64decode(AbstractStorage.generate_md5_hash(upload_conf['Filename'])).hex()
+            if self.single_part_etag_is_md5:
+                return ManifestObject(blob_name, file_size, local_hash)
+
         extra_args = {}
         if self.sse_c_key is not None:
             extra_args['SSECustomerAlgorithm'] = 'AES256'
             extra_args['SSECustomerKey'] = self.sse_c_key
 
         resp = self.s3_client.head_object(Bucket=upload_conf['Bucket'], Key=upload_conf['Key'], **extra_args)
-        blob_name = upload_conf['Key']
         blob_size = int(resp['ContentLength'])
         blob_hash = resp['ETag'].replace('"', '')
+
+        if local_hash is not None and self.single_part_etag_is_md5 is None:
+            # buckets encrypting objects with KMS by default give ETags that are not MD5s
+            self.single_part_etag_is_md5 = local_hash == blob_hash
+            logging.debug('[S3 Storage] ETags of single part uploads are MD5s: {}'.format(self.single_part_etag_is_md5))
         return ManifestObject(blob_name, blob_size, blob_hash)
 
     async def _get_object(self, object_key: t.Union[Path, str]) -> AbstractBlob:
@@ -455,22 +520,104 @@ class S3BaseStorage(AbstractStorage):
             extra_args['SSECustomerAlgorithm'] = 'AES256'
             extra_args['SSECustomerKey'] = self.sse_c_key
 
-        return self.s3_client.get_object(Bucket=self.bucket_name, Key=blob.name, **extra_args)['Body'].read()
+        def read_object():
+            return self.s3_client.get_object(Bucket=self.bucket_name, Key=blob.name, **extra_args)['Body'].read()
+
+        return await self._call_s3(read_object)
+
+    async def _read_blob_range(self, object_key: str, start: int, end: int) -> t.AsyncIterator[bytes]:
+        extra_args = {}
+        if self.sse_c_key is not None:
+            extra_args['SSECustomerAlgorithm'] = 'AES256'
+            extra_args['SSECustomerKey'] = self.sse_c_key
+
+        resp = await self._call_s3(
+            self.s3_client.get_object,
+            Bucket=self.bucket_name,
+            Key=object_key,
+            Range='bytes={}-{}'.format(start, end),
+            **extra_args
+        )
+        body = resp['Body']
+        try:
+            while True:
+                chunk = await self._call_s3(body.read, self.transfer_config.io_chunksize)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
 
     @retry(stop=stop_after_attempt(MAX_UP_DOWN_LOAD_RETRIES), wait=wait_fixed(5))
     async def _delete_object(self, obj: AbstractBlob):
-        self.s3_client.delete_object(
+        await self._call_s3(
+            self.s3_client.delete_object,
             Bucket=self.bucket_name,
             Key=obj.name
         )
 
+    async def _delete_objects(
+            self,
+            objects: t.List[AbstractBlob],
+            concurrent_transfers: int = None
+    ) -> t.Dict[str, str]:
+        # if we get the concurrent_transfers provided, use those instead of the ones from the config
+        semaphore = asyncio.Semaphore(
+            concurrent_transfers if concurrent_transfers else int(self.config.concurrent_transfers)
+        )
+
+        async def bounded_delete_batch(batch):
+            async with semaphore:
+                return await self._delete_batch(batch, concurrent_transfers)
+
+        batches = [objects[i:i + S3_MAX_KEYS_PER_DELETE] for i in range(0, len(objects), S3_MAX_KEYS_PER_DELETE)]
+        failures = {}
+        for batch_failures in await asyncio.gather(*(bounded_delete_batch(b) for b in batches)):
+            failures.update(batch_failures)
+        return failures
+
+    async def _delete_batch(self, batch: t.List[AbstractBlob], concurrent_transfers: int = None) -> t.Dict[str, str]:
+        try:
+            return await self._delete_keys([obj.name for obj in batch])
+        except ThrottledDeleteError as e:
+            return e.failures
+        except ClientError as e:
+            if _is_not_implemented(e):
+                # some S3 compatible storages do not implement DeleteObjects
+                logging.debug('[S3 Storage] Bulk delete is not supported, deleting {} objects one by one'.format(
+                    len(batch)
+                ))
+                return await super()._delete_objects(batch, concurrent_transfers)
+            return {obj.name: str(e) for obj in batch}
+
+    @retry(stop=stop_after_attempt(MAX_UP_DOWN_LOAD_RETRIES), wait=wait_fixed(5),
+           retry=retry_if_exception(lambda e: not _is_not_implemented(e)), reraise=True)
+    async def _delete_keys(self, keys: t.List[str]) -> t.Dict[str, str]:
+        return await self._call_s3(self.__delete_keys, keys)
+
+    def __delete_keys(self, keys: t.List[str]) -> t.Dict[str, str]:
+        logging.debug('[S3 Storage] Deleting {} objects from s3://{}'.format(len(keys), self.bucket_name))
+        resp = self.s3_client.delete_objects(
+            Bucket=self.bucket_name,
+            # in quiet mode, the response only lists the keys that could not be deleted
+            Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+        )
+        errors = resp.get('Errors', [])
+        failures = {error['Key']: '{}: {}'.format(error.get('Code'), error.get('Message')) for error in errors}
+        if any(error.get('Code') in S3_THROTTLING_ERROR_CODES for error in errors):
+            # the request itself succeeded, so boto neither retried it nor told us about the throttling. deleting
+            # the keys that did get deleted again is harmless, so the whole batch gets retried
+            self.transfer_concurrency.throttled()
+            raise ThrottledDeleteError(failures)
+        return failures
+
     async def _get_blob_metadata(self, blob_key: str) -> AbstractBlobMetadata:
         extra_args = {}
         if self.sse_c_key is not None:
             extra_args['SSECustomerAlgorithm'] = 'AES256'
             extra_args['SSECustomerKey'] = self.sse_c_key
 
-        resp = self.s3_client.head_object(Bucket=self.bucket_name, Key=blob_key, **extra_args)
+        resp = await self._call_s3(self.s3_client.head_object, Bucket=self.bucket_name, Key=blob_key, **extra_args)
 
         # the headers come as some non-default dict, so we need to re-package them
         blob_metadata = resp.get('ResponseMetadata', {}).get('HTTPHeaders', {})
@@ -506,7 +653,7 @@ class S3BaseStorage(AbstractStorage):
 
     @staticmethod
     def file_matches_storage(src: pathlib.Path, cached_item: ManifestObject, threshold=None, enable_md5_checks=False,
-                             chunk_size=None):
+                             chunk_size=None, digest_cache=None):
 
         threshold = AbstractStorage._human_size_to_bytes(str(threshold)) if threshold else -1
 
@@ -515,9 +662,9 @@ class S3BaseStorage(AbstractStorage):
             md5_hash = None
         elif src.stat().st_size >= threshold > 0:
             chunk_size_bytes = AbstractStorage._human_size_to_bytes(chunk_size) if chunk_size else None
-            md5_hash = AbstractStorage.md5_multipart(src, chunk_size_bytes)
+            md5_hash = AbstractStorage.md5_multipart(src, chunk_size_bytes, digest_cache=digest_cache)
         else:
-            md5_hash = AbstractStorage.generate_md5_hash(src)
+            md5_hash = AbstractStorage.generate_md5_hash(src, digest_cache=digest_cache)
 
         return S3BaseStorage.compare_with_manifest(
             actual_size=src.stat().st_size,
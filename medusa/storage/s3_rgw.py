@@ -31,9 +31,9 @@ class S3RGWStorage(S3BaseStorage):
 
     @staticmethod
     def file_matches_storage(src: pathlib.Path, cached_item: ManifestObject, threshold=None, enable_md5_checks=False,
-                             chunk_size=None):
+                             chunk_size=None, digest_cache=None):
         # for S3RGW, we never set threshold so the S3's multipart never happens
-        return S3Storage.file_matches_storage(src, cached_item, None, enable_md5_checks)
+        return S3Storage.file_matches_storage(src, cached_item, None, enable_md5_checks, digest_cache=digest_cache)
 
     @staticmethod
     def compare_with_manifest(actual_size, size_in_manifest, actual_hash=None, hash_in_manifest=None, threshold=None):
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import contextlib
+import logging
+import pathlib
+import sqlite3
+import time
+import typing as t
+
+from medusa.storage.abstract_storage import AbstractBlob, ManifestObject
+
+
+class UploadedObjectsCache(object):
+    """
+    Local record of the objects a node has in the data folder of its storage bucket.
+
+    Differential backups need to know what is already uploaded. Listing the whole data folder of a node
+    can take minutes and costs LIST requests, so the listing is done only when the cache is missing, when
+    it was filled for another bucket/prefix, or when the last full listing is older than the reconcile
+    interval. In between, the cache follows the uploads done by backups and the deletions done by purges.
+
+    The cache is a SQLite database, so a backup or purge interrupted half way leaves it consistent.
+    """
+
+    def __init__(self, path: t.Union[str, pathlib.Path], scope: str, reconcile_interval_seconds: float):
+        """
+        :param path: location of the cache file
+        :param scope: identifies the storage location the cached objects live in (eg bucket and data prefix).
+                      A cache filled for a different scope is not used.
+        :param reconcile_interval_seconds: how long the cache is trusted after a full listing of the storage
+        """
+        self._path = pathlib.Path(path).expanduser()
+        self._scope = scope
+        self._reconcile_interval_seconds = reconcile_interval_seconds
+
+    @contextlib.contextmanager
+    def _connection(self) -> t.Iterator[sqlite3.Connection]:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(str(self._path))
+        try:
+            # the connection context manager commits the transaction, or rolls it back on errors
+            with connection:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS objects (path TEXT PRIMARY KEY, size INTEGER, hash TEXT)'
+                )
+                connection.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)')
+                yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _get_state(connection: sqlite3.Connection, key: str) -> t.Optional[str]:
+        row = connection.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def is_fresh(self, now: t.Optional[float] = None) -> bool:
+        """
+        Tells if the cache can be used instead of listing the storage.
+
+        :param now: current time as a unix timestamp, defaults to time.time()
+        :return: True if the cache was reconciled with the storage of the same scope recently enough
+        """
+        now = time.time() if now is None else now
+        reconciled_at = self.reconciled_at()
+        if reconciled_at is None:
+            return False
+        return now - reconciled_at < self._reconcile_interval_seconds
+
+    def reconciled_at(self) -> t.Optional[float]:
+        """
+        :return: when the storage of the same scope was last listed into the cache as a unix timestamp, None if never
+        """
+        try:
+            with self._connection() as connection:
+                scope = self._get_state(connection, 'scope')
+                reconciled_at = self._get_state(connection, 'reconciled_at')
+        except sqlite3.Error as e:
+            logging.warning('Could not read the uploaded objects cache {}: {}'.format(self._path, e))
+            return None
+
+        if scope != self._scope or reconciled_at is None:
+            return None
+        return float(reconciled_at)
+
+    def objects(self) -> t.List[ManifestObject]:
+        with self._connection() as connection:
+            rows = connection.execute('SELECT path, size, hash FROM objects').fetchall()
+        return [ManifestObject(path, size, hash_) for path, size, hash_ in rows]
+
+    def reconcile(self, blobs: t.Iterable[AbstractBlob], now: t.Optional[float] = None) -> t.Iterator[AbstractBlob]:
+        """
+        Replaces the content of the cache with a full listing of the storage.
+
+        The blobs are passed through as they are recorded, so the listing can be consumed while it streams in.
+        The cache only becomes fresh once the listing got consumed entirely.
+
+        :param blobs: every blob present in the storage for the scope of this cache
+        :param now: time of the listing as a unix timestamp, defaults to time.time()
+        :return: the blobs given as input
+        """
+        now = time.time() if now is None else now
+        with self._connection() as connection:
+            # the listing goes to a temporary table first, which does not lock the cache, so backups and purges can
+            # keep updating it while the listing streams in. the cache only gets written once the listing is complete,
+            # in one transaction, so a listing that does not complete leaves the cache as it was. the listing replaces
+            # the cached sizes and hashes, as objects can get rewritten with another content
+            connection.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS listed (path TEXT PRIMARY KEY, size INTEGER, hash TEXT)'
+            )
+            for blob in blobs:
+                connection.execute(
+                    'INSERT OR REPLACE INTO listed (path, size, hash) VALUES (?, ?, ?)',
+                    (blob.name, blob.size, blob.hash)
+                )
+                yield blob
+            connection.execute('DELETE FROM state')
+            connection.execute('DELETE FROM objects')
+            connection.execute('INSERT INTO objects (path, size, hash) SELECT path, size, hash FROM listed')
+            connection.execute('DROP TABLE listed')
+            connection.executemany(
+                'INSERT INTO state (key, value) VALUES (?, ?)',
+                [('scope', self._scope), ('reconciled_at', str(now))]
+            )
+
+    def add(self, objects: t.Iterable[ManifestObject]):
+        """
+        Records objects that just got uploaded.
+
+        :param objects: the uploaded objects
+        """
+        with self._connection() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO objects (path, size, hash) VALUES (?, ?, ?)',
+                [(str(mo.path), mo.size, mo.MD5) for mo in objects]
+            )
+
+    def forget(self, paths: t.Iterable[str]):
+        """
+        Removes objects from the cache, typically because they are about to be deleted from the storage.
+
+        :param paths: the paths of the objects in the storage
+        """
+        with self._connection() as connection:
+            connection.executemany('DELETE FROM objects WHERE path = ?', [(str(path),) for path in paths])
@@ -15,21 +15,45 @@
 
 import json
 import logging
+import operator
+import time
 import medusa.utils
 
+from medusa.deep_verify import DeepVerification, DeepVerificationProgress
 from medusa.storage import Storage
+from medusa.storage.abstract_storage import AbstractStorage
+from medusa.storage.bandwidth_limiter import bandwidth_limiter
 
 
-def verify(config, backup_name, enable_md5_checks_flag):
+def verify(config, backup_name, enable_md5_checks_flag, output='text', deep=False, check_sstables=False,
+           max_bandwidth=None, max_size=None, progress_file=None):
     with Storage(config=config.storage) as storage:
         enable_md5 = enable_md5_checks_flag or medusa.utils.evaluate_boolean(config.checks.enable_md5_checks)
+        deep_verification = None
+        if deep:
+            if max_bandwidth:
+                bandwidth_limiter.set_limits(download_rate=AbstractStorage._human_size_to_bytes(max_bandwidth))
+            deep_verification = DeepVerification(
+                storage,
+                DeepVerificationProgress(progress_file),
+                check_sstables=check_sstables,
+                max_size=AbstractStorage._human_size_to_bytes(max_size) if max_size else None
+            )
 
         try:
             cluster_backup = storage.get_cluster_backup(backup_name)
         except KeyError:
             logging.error('No such backup')
+            if output == 'json':
+                print(json.dumps({}))
             raise RuntimeError("Manifest validation failed")
 
+        storage.prefetch_cluster_backups([cluster_backup], tokenmap=True, manifest=True)
+
+        if output == 'json':
+            verify_json(storage, cluster_backup, enable_md5, deep_verification)
+            return
+
         print('Validating {0.name} ...'.format(cluster_backup))
 
         if cluster_backup.is_complete():
@@ -42,79 +66,245 @@ def verify(config, backup_name, enable_md5_checks_flag):
                 print('  - [{}] Backup missing'.format(fqdn))
             raise RuntimeError("Backup is incomplete")
 
-        consistency_errors = [
-            consistency_error
-            for node_backup in cluster_backup.node_backups.values()
-            for consistency_error in validate_manifest(storage, node_backup, enable_md5)
-        ]
+        # errors get printed as they are found, whichever node they come from
+        failed = False
+        for _, error in validate_node_backups(storage, cluster_backup.node_backups.values(), enable_md5):
+            if error is not None:
+                failed = True
+                print(error)
 
-        if consistency_errors:
+        if failed:
             print("- Manifest validation: Failed!")
-            for error in consistency_errors:
-                print(error)
             raise RuntimeError("Manifest validation failed")
         else:
             print("- Manifest validated: OK!!")
 
+        if deep_verification is not None:
+            deep_verify(deep_verification, cluster_backup)
 
-def validate_manifest(storage, node_backup, enable_md5_checks):
+
+def deep_verify(deep_verification, cluster_backup):
+    failed = False
+    for _, error in deep_verification.verify(cluster_backup.node_backups.values()):
+        failed = True
+        print(error)
+
+    summary = '{} objects, {} read'.format(
+        deep_verification.num_objects, AbstractStorage.human_readable_size(deep_verification.size)
+    )
+    if failed:
+        print('- Deep verification: Failed! ({})'.format(summary))
+        raise RuntimeError("Deep verification failed")
+    elif deep_verification.complete:
+        print('- Deep verification: OK! ({})'.format(summary))
+    else:
+        print('- Deep verification: OK so far ({}), the next one resumes where it stopped'.format(summary))
+
+
+def verify_json(storage, cluster_backup, enable_md5_checks, deep_verification=None):
+    started = time.monotonic()
+    report = {
+        'name': cluster_backup.name,
+        'complete': cluster_backup.is_complete(),
+        'incomplete_nodes': [node_backup.fqdn for node_backup in cluster_backup.incomplete_nodes()],
+        'missing_nodes': sorted(cluster_backup.missing_nodes()),
+        'nodes': [],
+    }
+
+    if report['complete']:
+        errors = {}
+        for verification, error in validate_node_backups(
+                storage, cluster_backup.node_backups.values(), enable_md5_checks
+        ):
+            if error is not None:
+                errors.setdefault(verification.fqdn, []).append(error.strip())
+            else:
+                report['nodes'].append(verification.to_json_dict(errors.get(verification.fqdn, [])))
+        report['nodes'].sort(key=operator.itemgetter('fqdn'))
+
+    report['valid'] = report['complete'] and all(not node['errors'] for node in report['nodes'])
+
+    if deep_verification is not None and report['valid']:
+        deep_errors = {}
+        for node_backup, error in deep_verification.verify(cluster_backup.node_backups.values()):
+            deep_errors.setdefault(node_backup.fqdn, []).append(error.strip())
+        report['deep'] = {
+            'complete': deep_verification.complete,
+            'num_objects': deep_verification.num_objects,
+            'size': deep_verification.size,
+            'errors': deep_errors,
+        }
+        report['valid'] = not deep_errors
+    report['duration'] = round(time.monotonic() - started, 3)
+    print(json.dumps(report, ensure_ascii=False, sort_keys=True))
+
+    if not report['complete']:
+        raise RuntimeError("Backup is incomplete")
+    if not report['valid']:
+        raise RuntimeError("Manifest validation failed")
+
+
+class NodeVerification(object):
     """
-    Goes through all files in the manifest for given backup.
+    Verifies the data of a node backup, by joining the listing of its data folder with its manifest.
 
-    :return: iterable of errors (meaning problematic objects)
+    Both sides are sorted by path, so the join is a merge which walks each of them once, and the listing can be fed
+    page by page as it comes. Blobs out of the listing order would break the merge, so they fail the verification.
     """
 
-    try:
-        manifest = json.loads(node_backup.manifest)
-    except Exception:
-        logging.error('Unable to read manifest from storage')
-        return
+    def __init__(self, storage, node_backup, enable_md5_checks):
+        self._storage = storage
+        self._node_backup = node_backup
+        self._enable_md5_checks = enable_md5_checks
+        self._expected = None
+        self._unreadable = False
+        self._position = 0
+        self._previous_name = None
+        self.num_objects = 0
+        self.num_errors = 0
+        self.started = None
+        self.duration = None
 
-    data_path_prefix = storage.storage_driver.get_path_prefix(node_backup.data_path)
+    @property
+    def fqdn(self):
+        return self._node_backup.fqdn
 
-    objects_in_storage = {
-        blob.name: blob
-        for blob in storage.storage_driver.list_objects(node_backup.data_path)
-        if '-Statistics.db' not in blob.name
-    }
+    @property
+    def data_path(self):
+        return self._node_backup.data_path
 
-    objects_in_manifest = [
-        obj
-        for columnfamily_manifest in manifest
-        for obj in columnfamily_manifest['objects']
-        if '-Statistics.db' not in obj["path"]
-    ]
+    def _load_manifest(self):
+        try:
+            manifest = self._node_backup.read_manifest()
+        except Exception:
+            logging.error('Unable to read manifest from storage')
+            self._unreadable = True
+            self._expected = []
+            return
 
-    for object_in_manifest in objects_in_manifest:
+        data_path_prefix = self._storage.storage_driver.get_path_prefix(self._node_backup.data_path)
+        expected = sorted(
+            (
+                ('{}{}'.format(data_path_prefix, obj['path']), obj)
+                for columnfamily_manifest in manifest
+                for obj in columnfamily_manifest['objects']
+                if '-Statistics.db' not in obj['path']
+            ),
+            key=operator.itemgetter(0)
+        )
+        # a path listed twice in the manifest is still a single blob
+        self._expected = [
+            entry for i, entry in enumerate(expected)
+            if i == 0 or entry[0] != expected[i - 1][0]
+        ]
 
-        blob = objects_in_storage.get('{}{}'.format(data_path_prefix, object_in_manifest['path']))
+    def _missing(self, until=None):
+        while self._position < len(self._expected) and (until is None or self._expected[self._position][0] < until):
+            _, object_in_manifest = self._expected[self._position]
+            self._position += 1
+            yield "  - [{}] Doesn't exists".format(object_in_manifest['path'])
 
-        if blob is None:
-            yield("  - [{}] Doesn't exists".format(object_in_manifest['path']))
-            continue
+    def add_blobs(self, blobs):
+        """
+        Checks the next blobs of the listing, giving the errors found.
+        """
+        if self._expected is None:
+            self._load_manifest()
+        if self._unreadable:
+            return
 
-        if not storage.storage_driver.blob_matches_manifest(blob, object_in_manifest, enable_md5_checks):
-            if '-Summary.db' in blob.name:
-                m = f"Blob [{blob.name}] mismatches manifest. "
-                m += f"It's a Summary.db file which might be re-written once Cassandra rebuilds index summaries. "
-                m += f"Therefore we are not causing this mismatch to fail the verification. "
-                m += f"Cassandra will (re-)write this file during bootstrap if needed. "
-                logging.warning(m)
+        for blob in blobs:
+            if '-Statistics.db' in blob.name:
                 continue
-            logging.error("Expected {} but got {}".format(object_in_manifest, blob))
-            yield("  - [{}] Blob different".format(object_in_manifest['path']))
+            if self._previous_name is not None and blob.name < self._previous_name:
+                raise RuntimeError('The listing of {} is not sorted, {} came after {}'.format(
+                    self.data_path, blob.name, self._previous_name
+                ))
+            self._previous_name = blob.name
+            self.num_objects += 1
+
+            # whatever comes before this blob in the manifest was not found in storage
+            yield from self._count(self._missing(until=blob.name))
+
+            if self._position < len(self._expected) and self._expected[self._position][0] == blob.name:
+                _, object_in_manifest = self._expected[self._position]
+                self._position += 1
+                yield from self._count(self._check_blob(blob, object_in_manifest))
+            elif self._node_backup.is_differential is False:
+                # Checking for files existing in storage, but in not in the manifest
+                # Relevant for full backups only because
+                # Differential backups can have more files in data dir than in manifest
+                yield from self._count(["  - [{}] exists in storage, but not in manifest".format(blob.name)])
 
-    # Checking for files existing in storage, but in not in the manifest
-    # Relevant for full backups only because
-    # Differential backups can have more files in data dir than in manifest
-    if node_backup.is_differential is False:
+    def finish(self):
+        """
+        Gives the errors about the end of the manifest, once the whole listing went through add_blobs().
+        """
+        if self._expected is None:
+            self._load_manifest()
+        yield from self._count(self._missing())
+        self._expected = []
 
-        paths_in_storage = set(objects_in_storage.keys())
+    def _check_blob(self, blob, object_in_manifest):
+        if self._storage.storage_driver.blob_matches_manifest(blob, object_in_manifest, self._enable_md5_checks):
+            return
+        if '-Summary.db' in blob.name:
+            m = f"Blob [{blob.name}] mismatches manifest. "
+            m += f"It's a Summary.db file which might be re-written once Cassandra rebuilds index summaries. "
+            m += f"Therefore we are not causing this mismatch to fail the verification. "
+            m += f"Cassandra will (re-)write this file during bootstrap if needed. "
+            logging.warning(m)
+            return
+        logging.error("Expected {} but got {}".format(object_in_manifest, blob))
+        yield "  - [{}] Blob different".format(object_in_manifest['path'])
 
-        paths_in_manifest = {
-            "{}{}".format(data_path_prefix, obj['path'])
-            for obj in objects_in_manifest
+    def _count(self, errors):
+        for error in errors:
+            self.num_errors += 1
+            yield error
+
+    def to_json_dict(self, errors):
+        return {
+            'fqdn': self.fqdn,
+            'num_objects': self.num_objects,
+            'errors': errors,
+            'duration': round(self.duration, 3) if self.duration is not None else None,
         }
 
-        for path in paths_in_storage - paths_in_manifest:
-            yield("  - [{}] exists in storage, but not in manifest".format(path))
+
+def validate_node_backups(storage, node_backups, enable_md5_checks):
+    """
+    Verifies node backups concurrently, their data folders being listed side by side.
+
+    :return: iterable of (NodeVerification, error) as errors are found, and of (NodeVerification, None) once the
+    verification of a node backup is over
+    """
+    verifications = {}
+    for node_backup in node_backups:
+        verification = NodeVerification(storage, node_backup, enable_md5_checks)
+        verifications[str(node_backup.data_path)] = verification
+
+    for page in storage.storage_driver.iter_blobs_concurrently(verifications.keys()):
+        verification = verifications[page.prefix]
+        verification.started = page.started
+        for error in verification.add_blobs(page.blobs):
+            yield verification, error
+        if page.last:
+            for error in verification.finish():
+                yield verification, error
+            verification.duration = time.monotonic() - page.started
+            logging.debug('Verified the backup of {} in {:.1f}s, {} objects, {} errors'.format(
+                verification.fqdn, verification.duration, verification.num_objects, verification.num_errors
+            ))
+            yield verification, None
+
+
+def validate_manifest(storage, node_backup, enable_md5_checks):
+    """
+    Goes through all files in the manifest for given backup.
+
+    :return: iterable of errors (meaning problematic objects)
+    """
+    for _, error in validate_node_backups(storage, [node_backup], enable_md5_checks):
+        if error is not None:
+            yield error
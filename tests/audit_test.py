@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import base64
+import configparser
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+from medusa.audit import AuditedBackup, AuditedBackups, AuditTotals, BackupAuditor
+from medusa.config import StorageConfig, _namedtuple_from_dict
+from medusa.index import add_backup_finish_to_index, add_backup_start_to_index
+from medusa.storage import Storage
+
+
+class AuditTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        config = configparser.ConfigParser(interpolation=None)
+        config['storage'] = {
+            'host_file_separator': ',',
+            'bucket_name': 'medusa_test_bucket',
+            'storage_provider': 'local',
+            'fqdn': '127.0.0.1',
+            'base_path': self.base_path,
+            'concurrent_transfers': 1,
+        }
+        self.storage = Storage(config=_namedtuple_from_dict(StorageConfig, config['storage']))
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def _make_backup(self, name, fqdn, files):
+        node_backup = self.storage.get_node_backup(fqdn=fqdn, name=name)
+        node_backup.schema = 'schema'
+        node_backup.tokenmap = json.dumps({fqdn: {'tokens': [1]}})
+        objects = []
+        for file_name, content in files.items():
+            path = '{}/ks1/t1-cfid1/{}'.format(node_backup.data_path, file_name)
+            self.storage.storage_driver.upload_blob_from_string(path, content)
+            md5 = base64.b64encode(hashlib.md5(content.encode()).digest()).decode()
+            objects.append({'path': path, 'MD5': md5, 'size': len(content)})
+        node_backup.manifest = json.dumps([{'keyspace': 'ks1', 'columnfamily': 't1-cfid1', 'objects': objects}])
+        add_backup_start_to_index(self.storage, node_backup)
+        add_backup_finish_to_index(self.storage, node_backup)
+        return node_backup
+
+    def _local_path(self, node_backup, file_name):
+        return os.path.join(
+            self.storage.storage_driver.root_dir, '{}/ks1/t1-cfid1/{}'.format(node_backup.data_path, file_name)
+        )
+
+    def test_objects_are_sampled_by_size(self):
+        self._make_backup('backup1', 'node1', {'nb-1-big-Data.db': 'x' * 1000, 'nb-1-big-Filter.db': ''})
+        small = self._make_backup('backup2', 'node1', {'nb-2-big-Data.db': 'y' * 10})
+        os.remove(self._local_path(small, 'nb-2-big-Data.db'))
+
+        totals = AuditTotals()
+        auditor = BackupAuditor(self.storage, totals, rng=random.Random(42))
+        audit_round = auditor.audit(500)
+
+        self.assertEqual(500, audit_round.sampled_objects)
+        # about 1% of the bytes are missing
+        self.assertTrue(0 < len(audit_round.corrupted) < 25)
+        self.assertIn("[backup2] {}/ks1/t1-cfid1/nb-2-big-Data.db doesn't exist".format(small.data_path),
+                      audit_round.corrupted)
+        self.assertEqual((500 - len(audit_round.corrupted)) * 1000, audit_round.verified_bytes)
+        self.assertEqual(len(audit_round.corrupted), totals.corrupted_objects)
+        self.assertIsNone(totals.max_corrupted_fraction())
+
+    def test_read_objects(self):
+        node_backup = self._make_backup('backup1', 'node1', {'nb-1-big-Data.db': 'content'})
+        monitoring = Mock()
+        totals = AuditTotals()
+
+        auditor = BackupAuditor(self.storage, totals, monitoring, read_objects=True)
+        self.assertEqual(0, len(auditor.audit(10).corrupted))
+        self.assertAlmostEqual(0.259, totals.max_corrupted_fraction(), places=3)
+
+        # same size, so only reading the object back tells it changed
+        with open(self._local_path(node_backup, 'nb-1-big-Data.db'), 'w') as f:
+            f.write('CONTENT')
+        self.assertEqual(10, len(auditor.audit(10).corrupted))
+        self.assertEqual(20, totals.sampled_objects)
+        self.assertEqual(70, totals.verified_bytes)
+
+        monitoring.send.assert_any_call(['medusa-audit', 'verified-bytes', '127.0.0.1'], 70)
+        monitoring.send.assert_any_call(['medusa-audit', 'corrupted-objects', '127.0.0.1'], 10)
+
+    def test_purged_backups_are_not_corrupted(self):
+        self._make_backup('backup1', 'node1', {'nb-1-big-Data.db': 'content'})
+        purged = self._make_backup('backup2', 'node1', {'nb-2-big-Data.db': 'other content'})
+        auditor = BackupAuditor(self.storage, AuditTotals(), rng=random.Random(42))
+        self.assertEqual(10, auditor.audit(10).sampled_objects)
+
+        shutil.rmtree(os.path.join(self.storage.storage_driver.root_dir, str(purged.backup_path)))
+        audit_round = auditor.audit(20)
+        self.assertEqual([], audit_round.corrupted)
+        self.assertEqual(audit_round.verified_bytes, audit_round.sampled_objects * len('content'))
+        self.assertEqual(10, auditor.audit(10).sampled_objects)
+
+    def test_auditors_share_the_listing_of_backups(self):
+        self._make_backup('backup1', 'node1', {'nb-1-big-Data.db': 'content'})
+        backups = AuditedBackups()
+        with patch.object(self.storage, 'list_node_backups', wraps=self.storage.list_node_backups) as listing:
+            for _ in range(3):
+                auditor = BackupAuditor(self.storage, AuditTotals(), backups=backups)
+                self.assertEqual(5, auditor.audit(5).sampled_objects)
+        listing.assert_called_once()
+        # only names and sizes are kept between rounds, not the node backups and their manifests
+        self.assertEqual([AuditedBackup('node1', 'backup1', False, len('content'))], backups.get(self.storage))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -208,7 +208,7 @@ class BackupNodeTest(unittest.TestCase):
         max_active = 0
         lock = threading.Lock()
 
-        def fake_file_matches_storage(src, cached_item, threshold, enable_md5_checks, chunk_size):
+        def fake_file_matches_storage(src, cached_item, threshold, enable_md5_checks, chunk_size, digest_cache=None):
             nonlocal active, max_active
             with lock:
                 active += 1
@@ -170,6 +170,11 @@ class ConfigTest(unittest.TestCase):
         # Kubernetes must be disabled by default so use_sudo can be honored
         assert not medusa.utils.evaluate_boolean(config.kubernetes.enabled if config.kubernetes else False)
 
+    def test_manifest_format_default(self):
+        """Ensure that manifests stay readable by older versions unless compact ones are asked for"""
+        config = medusa.config.load_config({}, self.medusa_config_file)
+        assert config.storage.manifest_format == 'json'
+
     def test_use_sudo_kubernetes_disabled(self):
         """Ensure that use_sudo is honored when Kubernetes mode is disabled (default)"""
         args = {'use_sudo': 'True'}
@@ -44,6 +44,7 @@ class DownloadTest(unittest.TestCase):
             },
         ]
         self.assertEqual(123401, _get_download_size(manifest))
+        self.assertEqual(123100, _get_download_size(manifest, {'k2.t2-81ffe430e50c11e99f91a15641db358f'}))
 
     def test_check_available_space(self):
         destination = 'whatever'
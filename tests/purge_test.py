@@ -14,14 +14,21 @@
 # limitations under the License.
 
 import configparser
+import json
+import shutil
+import tempfile
 import unittest
 
 from datetime import datetime, timedelta
+from unittest.mock import patch
 
 from medusa.config import MedusaConfig, StorageConfig, _namedtuple_from_dict
-from medusa.storage import Storage
+from medusa.index import add_backup_finish_to_index, add_backup_start_to_index
+from medusa.storage import NodeBackup, Storage
+from medusa.storage.reference_index import ReferenceIndex
 from medusa.purge import backups_to_purge_by_age, backups_to_purge_by_count, backups_to_purge_by_name
-from medusa.purge import filter_differential_backups, filter_files_within_gc_grace
+from medusa.purge import cleanup_obsolete_files, filter_differential_backups, filter_files_within_gc_grace
+from medusa.purge import purge_backup, purge_backups
 
 from tests.storage_test import make_node_backup, make_cluster_backup, make_blob
 
@@ -149,6 +156,102 @@ class PurgeTest(unittest.TestCase):
         # non-existent backup name raises KeyError
         self.assertRaises(KeyError, backups_to_purge_by_name, self.storage, cluster_backups, ["nonexistent"], False)
 
+    def _temp_storage(self):
+        base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_path)
+        return Storage(config=self.config.storage._replace(base_path=base_path, concurrent_transfers=1))
+
+    def _take_backup(self, storage, name, files, fqdn='node1'):
+        node_backup = storage.get_node_backup(fqdn=fqdn, name=name, differential_mode=True)
+        node_backup.schema = 'schema'
+        node_backup.tokenmap = json.dumps({fqdn: {'tokens': [1]}})
+        objects = []
+        for file_name in files:
+            path = '{}{}/data/ks1/t1-cfid1/{}'.format(storage.prefix_path, fqdn, file_name)
+            storage.storage_driver.upload_blob_from_string(path, file_name)
+            objects.append({'path': path, 'MD5': '', 'size': len(file_name)})
+        node_backup.manifest = json.dumps([{'keyspace': 'ks1', 'columnfamily': 't1-cfid1', 'objects': objects}])
+        add_backup_start_to_index(storage, node_backup)
+        add_backup_finish_to_index(storage, node_backup)
+        return node_backup
+
+    def test_cleanup_obsolete_files_uses_the_reference_index(self):
+        storage = self._temp_storage()
+        backup1 = self._take_backup(storage, 'backup1', ['nb-1-big-Data.db', 'nb-2-big-Data.db'])
+        # taken by a version of Medusa which did not know about the reference index
+        with patch.object(ReferenceIndex, 'record_added'):
+            self._take_backup(storage, 'backup2', ['nb-2-big-Data.db', 'nb-3-big-Data.db'])
+        storage.storage_driver.upload_blob_from_string('node1/data/ks1/t1-cfid1/nb-0-big-Data.db', 'orphan')
+
+        with patch.object(NodeBackup, 'read_manifest', autospec=True, side_effect=NodeBackup.read_manifest) as read:
+            self.assertEqual((1, len('orphan'), 0), cleanup_obsolete_files(storage, 'node1', 0))
+            self.assertEqual(['backup2'], [c.args[0].name for c in read.call_args_list])
+            # the compaction added the missing backup to the index
+            read.reset_mock()
+            self.assertEqual((0, 0, 0), cleanup_obsolete_files(storage, 'node1', 0))
+            self.assertEqual([], read.call_args_list)
+
+            purge_backup(storage, backup1)
+            self.assertEqual((1, len('nb-1-big-Data.db'), 0), cleanup_obsolete_files(storage, 'node1', 0))
+            self.assertEqual([], read.call_args_list)
+
+        remaining = [blob.name for blob in storage.storage_driver.list_objects('node1/data/')]
+        self.assertEqual(['node1/data/ks1/t1-cfid1/nb-2-big-Data.db', 'node1/data/ks1/t1-cfid1/nb-3-big-Data.db'],
+                         sorted(remaining))
+
+    def test_purge_from_another_host_makes_the_uploaded_objects_cache_stale(self):
+        storage = self._temp_storage()
+        storage = Storage(config=storage.config._replace(
+            uploaded_objects_cache_file='{}/uploaded_objects.db'.format(storage.config.base_path),
+            uploaded_objects_cache_reconcile_interval_in_hours='24'
+        ))
+        backup1 = self._take_backup(storage, 'backup1', ['nb-1-big-Data.db'])
+        self._take_backup(storage, 'backup2', ['nb-2-big-Data.db'])
+        self.assertEqual({'nb-1-big-Data.db', 'nb-2-big-Data.db'},
+                         set(storage.list_files_per_table()['ks1']['t1-cfid1']))
+        self.assertTrue(storage._uploaded_objects_cache_is_fresh())
+
+        other_host = Storage(config=storage.config._replace(
+            fqdn='node2', uploaded_objects_cache_file='{}/other.db'.format(storage.config.base_path)
+        ))
+        with patch.object(Storage, 'forget_uploaded_objects') as forget:
+            purge_backup(other_host, backup1)
+            self.assertEqual((1, len('nb-1-big-Data.db'), 0), cleanup_obsolete_files(other_host, 'node1', 0))
+            # the cache of the other host does not hold the objects of this node
+            forget.assert_not_called()
+
+        # the next differential backup does not count on the deleted object
+        self.assertFalse(storage._uploaded_objects_cache_is_fresh())
+        self.assertEqual({'nb-2-big-Data.db'}, set(storage.list_files_per_table()['ks1']['t1-cfid1']))
+
+    def test_purge_backups_of_several_nodes(self):
+        storage = self._temp_storage()
+        nodes = ['node1', 'node2', 'node3']
+        for fqdn in nodes:
+            self._take_backup(storage, 'backup1', ['nb-1-big-Data.db', 'nb-2-big-Data.db'], fqdn)
+            self._take_backup(storage, 'backup2', ['nb-2-big-Data.db'], fqdn)
+        listed_backups = list(storage.list_node_backups())
+        backups_to_purge = [node_backup for node_backup in listed_backups if node_backup.name == 'backup1']
+
+        def list_data_objects():
+            return sorted(blob.name for fqdn in nodes for blob in storage.storage_driver.list_objects(fqdn))
+
+        objects = list_data_objects()
+        with patch.object(Storage, 'list_node_backups', side_effect=AssertionError('backups were listed again')):
+            plan = purge_backups(storage, backups_to_purge, 0, 'node1', listed_backups=listed_backups,
+                                 max_workers=2, dry_run=True)
+            self.assertEqual(objects, list_data_objects())
+            self.assertEqual(plan, purge_backups(storage, backups_to_purge, 0, 'node1',
+                                                 listed_backups=listed_backups, max_workers=2))
+
+        meta_objects = [name for name in objects if '/backup1/' in name]
+        self.assertEqual(len(meta_objects) + 3, plan[0])
+        self.assertEqual(
+            ['{}/data/ks1/t1-cfid1/nb-2-big-Data.db'.format(fqdn) for fqdn in nodes],
+            [name for name in list_data_objects() if '/data/' in name]
+        )
+        self.assertEqual(['backup2'], [b.name for b in storage.list_node_backups(fqdn='node2')])
+
 
 if __name__ == '__main__':
     unittest.main()
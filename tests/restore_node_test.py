@@ -14,6 +14,14 @@
 # limitations under the License.
 
 import configparser
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import subprocess
+import tempfile
+import threading
 import unittest
 from unittest import mock
 
@@ -21,8 +29,10 @@ from cassandra.util import Version
 
 from medusa import restore_node, storage
 from medusa.config import MedusaConfig, StorageConfig, _namedtuple_from_dict
+from medusa.download import download_section
 from medusa.host_man import HostMan
-from medusa.storage import abstract_storage
+from medusa.local_objects import LocalObjects
+from medusa.storage import Storage, abstract_storage
 
 
 class RestoreNodeTest(unittest.TestCase):
@@ -119,6 +129,195 @@ class RestoreNodeTest(unittest.TestCase):
         # THEN expect default release version will be captured.
         self.assertEqual(HostMan.get_release_version(), Version(HostMan.DEFAULT_RELEASE_VERSION))
 
+    def _make_backup(self):
+        base_path = pathlib.Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(base_path))
+        storage_config = self.config.storage._replace(
+            storage_provider='local', base_path=str(base_path), bucket_name='bucket', fqdn='node1',
+            concurrent_transfers=1
+        )
+        backup_storage = Storage(config=storage_config)
+        node_backup = backup_storage.get_node_backup(fqdn='node1', name='backup1', differential_mode=True)
+        node_backup.schema = 'schema'
+        node_backup.tokenmap = json.dumps({'node1': {'tokens': [1]}})
+        sections = []
+        for keyspace, table in [('ks1', 't1-1'), ('ks1', 't2-2'), ('system', 'peers-3'), ('system_auth', 'roles-4')]:
+            path = 'node1/data/{}/{}/nb-1-big-Data.db'.format(keyspace, table)
+            backup_storage.storage_driver.upload_blob_from_string(path, 'data of {}'.format(table))
+            sections.append({'keyspace': keyspace, 'columnfamily': table, 'objects': [{'path': path, 'size': 0}]})
+        sections.append({'keyspace': 'ks1', 'columnfamily': 'empty-5', 'objects': []})
+        node_backup.manifest = json.dumps(sections)
+
+        data_dir = base_path / 'cassandra' / 'data'
+        for table in ['ks1/t1-1', 'system/peers-3', 'system_auth/roles-4']:
+            (data_dir / table).mkdir(parents=True)
+            (data_dir / table / 'old-Data.db').write_text('old')
+        return backup_storage, node_backup, data_dir
+
+    def _assert_restored(self, data_dir):
+        def table_files(table):
+            return sorted(p.name for p in (data_dir / table).iterdir())
+
+        self.assertEqual(['nb-1-big-Data.db'], table_files('ks1/t1-1'))
+        self.assertEqual('data of t2-2', (data_dir / 'ks1/t2-2/nb-1-big-Data.db').read_text())
+        # peers get cleaned but not restored when not restoring in place, and auth is kept
+        self.assertEqual([], table_files('system'))
+        self.assertEqual(['old-Data.db'], table_files('system_auth/roles-4'))
+        self.assertFalse((data_dir / 'ks1/empty-5').exists())
+
+    def test_restore_sections_streaming(self):
+        backup_storage, node_backup, data_dir = self._make_backup()
+        staging_dir = data_dir.parent / '.medusa-restore'
+        staging_dir.mkdir()
+
+        fqtns = {'ks1.t1-1', 'ks1.t2-2', 'system.peers-3', 'system_auth.roles-4', 'ks1.empty-5'}
+        with mock.patch.object(os, 'chown') as chown:
+            restore_node.restore_sections_streaming(backup_storage, node_backup, fqtns, staging_dir, data_dir,
+                                                    in_place=False, keep_auth=True, use_sudo=False)
+
+        self._assert_restored(data_dir)
+        self.assertTrue((staging_dir / 'tokenmap.json').exists())
+        # the files already belong to the owner of the data directory
+        chown.assert_not_called()
+
+    def test_restore_sections_direct(self):
+        backup_storage, node_backup, data_dir = self._make_backup()
+        fqtns = {'ks1.t1-1', 'ks1.t2-2', 'system.peers-3', 'system_auth.roles-4', 'ks1.empty-5'}
+        sections = list(node_backup.read_manifest().sections(fqtns))
+        for section in sections:
+            restore_node.stage_section(backup_storage, node_backup, section, None, data_dir, in_place=False,
+                                       keep_auth=True, use_sudo=False, direct=True)
+        # the live tables are untouched until the backup data gets renamed into place
+        self.assertEqual('old', (data_dir / 'ks1/t1-1/old-Data.db').read_text())
+        self.assertEqual(['.t1-1.medusa-restore', '.t2-2.medusa-restore', 't1-1'],
+                         sorted(p.name for p in (data_dir / 'ks1').iterdir()))
+
+        restore_node.place_staged_sections(sections, None, data_dir, in_place=False, keep_auth=True, use_sudo=False,
+                                           direct=True)
+        self._assert_restored(data_dir)
+        self.assertEqual(['t1-1', 't2-2'], sorted(p.name for p in (data_dir / 'ks1').iterdir()))
+
+    def test_download_section_reuses_local_snapshots(self):
+        backup_storage, node_backup, data_dir = self._make_backup()
+        contents = {
+            'nb-2-big-Data.db': 'in snapshot', 'nb-3-big-Data.db': 'downloaded', '.t1_idx/nb-2-big-Data.db': 'idx'
+        }
+        objects = []
+        for name, content in contents.items():
+            path = 'node1/data/ks1/t1-1/{}'.format(name)
+            backup_storage.storage_driver.upload_blob_from_string(path, content)
+            md5 = hashlib.md5(content.encode()).hexdigest()
+            objects.append({'path': path, 'size': len(content), 'MD5': md5})
+        section = {'keyspace': 'ks1', 'columnfamily': 't1-1', 'objects': objects}
+
+        # an older snapshot holds a file of the same name and size but another content
+        old_snapshot = data_dir / 'ks1/t1-1/snapshots/medusa-backup0'
+        (old_snapshot / '.t1_idx').mkdir(parents=True)
+        (old_snapshot / 'nb-2-big-Data.db').write_text('in snapsho7')
+        (old_snapshot / 'nb-3-big-Data.db').write_text('downloadeD')
+        snapshot = data_dir / 'ks1/t1-1/snapshots/medusa-backup1'
+        (snapshot / '.t1_idx').mkdir(parents=True)
+        (snapshot / 'nb-2-big-Data.db').write_text('in snapshot')
+        (snapshot / '.t1_idx/nb-2-big-Data.db').write_text('idx')
+
+        local_objects = LocalObjects(data_dir, ['medusa-backup0', 'medusa-backup1'], 'backup1')
+        dst = data_dir.parent / 'restore/ks1/t1-1'
+        download_section(backup_storage, node_backup, section, dst, local_objects)
+
+        for name, content in contents.items():
+            self.assertEqual(content, (dst / name).read_text())
+        self.assertTrue((dst / 'nb-2-big-Data.db').samefile(snapshot / 'nb-2-big-Data.db'))
+        self.assertTrue((dst / '.t1_idx/nb-2-big-Data.db').samefile(snapshot / '.t1_idx/nb-2-big-Data.db'))
+        self.assertFalse((dst / 'nb-3-big-Data.db').samefile(old_snapshot / 'nb-3-big-Data.db'))
+        self.assertEqual(2, local_objects.reused_objects)
+        self.assertEqual(len('in snapshot') + len('idx'), local_objects.reused_bytes)
+
+    def test_download_section_reuses_live_tables(self):
+        backup_storage, node_backup, data_dir = self._make_backup()
+        objects = []
+        for name, content in [('nb-2-big-Data.db', 'live'), ('nb-3-big-Data.db', 'gone')]:
+            path = 'node1/data/ks1/t1-1/{}'.format(name)
+            backup_storage.storage_driver.upload_blob_from_string(path, content)
+            objects.append({'path': path, 'size': len(content), 'MD5': hashlib.md5(content.encode()).hexdigest()})
+        section = {'keyspace': 'ks1', 'columnfamily': 't1-1', 'objects': objects}
+        live_table = data_dir / 'ks1/t1-1'
+        (live_table / 'nb-2-big-Data.db').write_text('live')
+
+        local_objects = LocalObjects(data_dir, [], 'backup1', live_tables=False)
+        dst = data_dir.parent / 'restore1/ks1/t1-1'
+        download_section(backup_storage, node_backup, section, dst, local_objects)
+        self.assertFalse((dst / 'nb-2-big-Data.db').samefile(live_table / 'nb-2-big-Data.db'))
+        self.assertEqual(0, local_objects.reused_objects)
+
+        local_objects = LocalObjects(data_dir, [], 'backup1')
+        self.assertEqual({(pathlib.Path('old-Data.db'), 3), (pathlib.Path('nb-2-big-Data.db'), 4)},
+                         set(local_objects.index(section)))
+        dst = data_dir.parent / 'restore2/ks1/t1-1'
+        download_section(backup_storage, node_backup, section, dst, local_objects)
+        self.assertTrue((dst / 'nb-2-big-Data.db').samefile(live_table / 'nb-2-big-Data.db'))
+        self.assertEqual('gone', (dst / 'nb-3-big-Data.db').read_text())
+        self.assertEqual(1, local_objects.reused_objects)
+
+    def test_load_sections(self):
+        backup_storage, node_backup, data_dir = self._make_backup()
+        config = self.config._replace(storage=backup_storage.config)
+        sections = [section for section in node_backup.read_manifest().sections() if section['objects']]
+        for section in sections:
+            section['objects'][0]['size'] = len('data of {}'.format(section['columnfamily']))
+        download_dir = data_dir.parent / 'sstableloader'
+        # each table takes 12 to 15 bytes, so only one fits at once
+        budget = restore_node.DiskBudget(20)
+        loaded = []
+
+        def load_table(_config, table_dir, _storage_port, _native_port):
+            self.assertLessEqual(budget.used, budget.size)
+            loaded.append((table_dir.relative_to(download_dir), sorted(p.name for p in table_dir.iterdir())))
+
+        with mock.patch.object(restore_node, 'load_table', side_effect=load_table):
+            restore_node.load_sections(config, [(node_backup, sections)], download_dir, budget, 7000, 9042,
+                                       download_workers=2, loader_workers=2)
+
+        self.assertEqual(
+            sorted((pathlib.Path('node1') / s['keyspace'] / s['columnfamily'], ['nb-1-big-Data.db']) for s in sections),
+            sorted(loaded)
+        )
+        # each table got deleted once loaded
+        self.assertEqual([], [p for p in download_dir.rglob('*') if p.is_file()])
+        self.assertEqual(0, budget.used)
+
+        with mock.patch.object(restore_node, 'load_table', side_effect=subprocess.CalledProcessError(1, 'loader')):
+            with self.assertRaises(subprocess.CalledProcessError):
+                restore_node.load_sections(config, [(node_backup, sections)], download_dir, budget, 7000, 9042)
+        self.assertEqual([], [p for p in download_dir.rglob('*') if p.is_file()])
+        self.assertEqual(0, budget.used)
+
+    def test_disk_budget(self):
+        budget = restore_node.DiskBudget(10)
+        # larger than the budget, but alone
+        budget.acquire(15)
+        acquired = threading.Event()
+        waiting = threading.Thread(target=lambda: (budget.acquire(5), acquired.set()))
+        waiting.start()
+        self.assertFalse(acquired.wait(0.1))
+        budget.release(15)
+        self.assertTrue(acquired.wait(5))
+        waiting.join()
+        self.assertEqual(5, budget.used)
+
+    def test_chown_tree(self):
+        root = pathlib.Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(root))
+        (root / '.t1_idx').mkdir()
+        (root / 'nb-1-big-Data.db').write_text('data')
+        (root / '.t1_idx' / 'nb-1-big-Data.db').write_text('data')
+        with mock.patch.object(os, 'chown') as chown:
+            restore_node.chown_tree(root, os.getuid() + 1, os.getgid())
+        self.assertEqual(
+            sorted([str(root), str(root / '.t1_idx'), str(root / 'nb-1-big-Data.db'),
+                    str(root / '.t1_idx' / 'nb-1-big-Data.db')]),
+            sorted(c.args[0] for c in chown.call_args_list)
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -13,6 +13,7 @@
 # limitations under the License.
 import concurrent
 import configparser
+import grpc
 import unittest
 
 from datetime import datetime
@@ -20,10 +21,12 @@ from grpc import ServicerContext
 from unittest.mock import Mock, patch
 
 from medusa.backup_manager import BackupMan
-from medusa.config import MedusaConfig, _namedtuple_from_dict, StorageConfig, CassandraConfig
+from medusa.audit import AuditRound
+from medusa.config import MedusaConfig, _namedtuple_from_dict, StorageConfig, CassandraConfig, ChecksConfig
 from medusa.service.grpc import medusa_pb2
 from medusa.service.grpc.server import MedusaService
 from medusa.storage import Storage
+from medusa.storage.bandwidth_limiter import bandwidth_limiter
 
 from tests.storage_test import make_node_backup, make_cluster_backup, make_unfinished_node_backup
 
@@ -375,6 +378,53 @@ class ServerTest(unittest.TestCase):
             start_time = int(datetime.strptime(backup_status.startTime, '%Y-%m-%d %H:%M:%S').timestamp())
             self.assertEqual(123456, start_time)
 
+    def test_set_bandwidth_limits(self):
+        service = MedusaService(self._make_config())
+        context = Mock(spec=ServicerContext)
+        self.addCleanup(bandwidth_limiter.reset)
+        bandwidth_limiter.configure(upload_rate=100, download_rate=200)
+
+        request = medusa_pb2.SetBandwidthLimitsRequest(uploadMaxBandwidth='10MB/s')
+        response = service.SetBandwidthLimits(request, context)
+        # the download limit is left as it was
+        self.assertEqual(10 * 1024 * 1024, response.uploadBytesPerSecond)
+        self.assertEqual(200, response.downloadBytesPerSecond)
+
+        request = medusa_pb2.SetBandwidthLimitsRequest(uploadMaxBandwidth='0', downloadMaxBandwidth='bogus')
+        response = service.SetBandwidthLimits(request, context)
+        context.set_code.assert_called_once_with(grpc.StatusCode.INVALID_ARGUMENT)
+        self.assertEqual(10 * 1024 * 1024, response.uploadBytesPerSecond)
+        self.assertEqual(200, response.downloadBytesPerSecond)
+
+    def test_audit_backups(self):
+        config = self._make_config()._replace(
+            checks=_namedtuple_from_dict(ChecksConfig, {'enable_md5_checks': 'False'}),
+            monitoring=Mock(monitoring_provider='None'),
+        )
+        service = MedusaService(config)
+        context = Mock(spec=ServicerContext)
+        rounds = [AuditRound(100, 1000, []), AuditRound(50, 400, ['[backup1] node1/data/ks1/t1/nb-1-big-Data.db'])]
+
+        def audit(samples):
+            audit_round = rounds.pop(0)
+            service.audit_totals.add(audit_round)
+            return audit_round
+
+        with patch('medusa.service.grpc.server.Storage'), \
+                patch('medusa.service.grpc.server.BackupAuditor') as auditor:
+            auditor.return_value.audit.side_effect = audit
+            service.AuditBackups(medusa_pb2.AuditBackupsRequest(), context)
+            response = service.AuditBackups(medusa_pb2.AuditBackupsRequest(samples=50, readObjects=True), context)
+
+        self.assertEqual(100, auditor.return_value.audit.call_args_list[0][0][0])
+        self.assertTrue(auditor.call_args_list[1][1]['read_objects'])
+        self.assertEqual(50, response.sampledObjects)
+        self.assertEqual(['[backup1] node1/data/ks1/t1/nb-1-big-Data.db'], list(response.corruptedObjects))
+        self.assertEqual(150, response.totalSampledObjects)
+        self.assertEqual(1400, response.totalVerifiedBytes)
+        self.assertEqual(1, response.totalCorruptedObjects)
+        context.set_code.assert_not_called()
+
 
 if __name__ == '__main__':
     unittest.main()
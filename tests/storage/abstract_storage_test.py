@@ -168,3 +168,37 @@ class AbstractStorageTest(unittest.TestCase):
         self.assertLess(elapsed, 0.35)
         self.assertLessEqual(max_active, 2)
         self.assertEqual(['slow', 'fast1', 'fast2'], [mo.path for mo in results])
+
+    def test_upload_blobs_in_batches_shares_concurrency_across_batches(self):
+        # two batches going to different destinations: a per-batch scheduler would wait for the
+        # slow file of the first batch before starting the second one. with a single queue, the
+        # second batch starts as soon as a slot frees up, and the total stays capped at 2.
+        config = AttributeDict({'bucket_name': 'must_be_set', 'concurrent_transfers': 2})
+        storage = TestAbstractStorage(config)
+
+        durations = {'slow': 0.3, 'fast1': 0.1, 'fast2': 0.1, 'fast3': 0.1}
+        active = 0
+        max_active = 0
+
+        async def fake_upload_blob(src, dest):
+            nonlocal active, max_active
+            active += 1
+            max_active = max(max_active, active)
+            await asyncio.sleep(durations[src])
+            active -= 1
+            return ManifestObject(f'{dest}/{src}', 0, None)
+
+        storage._upload_blob = fake_upload_blob
+
+        batches = [(['slow', 'fast1'], 'table1'), ([], 'table2'), (['fast2', 'fast3'], 'table3')]
+        start = time.monotonic()
+        results = asyncio.run(storage._upload_blobs_in_batches(iter(batches)))
+        elapsed = time.monotonic() - start
+
+        # per-batch barriers would take ~0.3 + 0.1 = 0.4s
+        self.assertLess(elapsed, 0.38)
+        self.assertLessEqual(max_active, 2)
+        self.assertEqual(
+            [['table1/slow', 'table1/fast1'], [], ['table3/fast2', 'table3/fast3']],
+            [[mo.path for mo in batch] for batch in results]
+        )
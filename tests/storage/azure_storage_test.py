@@ -6,7 +6,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import asyncio
+import base64
+import hashlib
 import os
+import pathlib
 import tempfile
 import unittest
 
@@ -15,6 +18,7 @@ from unittest.mock import AsyncMock, MagicMock, patch
 from azure.core.credentials import AzureNamedKeyCredential
 from azure.identity import DefaultAzureCredential
 
+from medusa.storage.abstract_storage import AbstractBlob
 from medusa.storage.azure_storage import AzureStorage
 from tests.storage.abstract_storage_test import AttributeDict
 
@@ -216,20 +220,17 @@ class AzureStorageTest(unittest.TestCase):
             config = self._make_config(credentials_file.name, {'multipart_chunksize': '8MB'})
             storage = AzureStorage(config)
 
-            # Fake blob properties returned after upload
-            mock_blob_props = MagicMock()
-            mock_blob_props.name = 'test-object'
-            mock_blob_props.size = 12
-            mock_blob_props.etag = '"abc123"'
-            mock_blob_props.last_modified = None
-            mock_blob_props.blob_tier = None
-            mock_blob_props.get.side_effect = lambda key, default=None: default
+            # Fake single Put Blob: it consumes the data and responds with the MD5 the service computed
+            async def _fake_upload_blob(data, **kwargs):
+                content = b''.join([chunk async for chunk in data])
+                return {'content_md5': bytearray(hashlib.md5(content).digest())}
 
-            mock_blob_client = AsyncMock()
-            mock_blob_client.get_blob_properties = AsyncMock(return_value=mock_blob_props)
+            mock_blob_client = MagicMock()
+            mock_blob_client.upload_blob = AsyncMock(side_effect=_fake_upload_blob)
+            mock_blob_client.get_blob_properties = AsyncMock()
 
-            mock_container = AsyncMock()
-            mock_container.upload_blob = AsyncMock(return_value=mock_blob_client)
+            mock_container = MagicMock()
+            mock_container.get_blob_client.return_value = mock_blob_client
             storage.azure_container_client = mock_container
 
             with patch.object(AzureStorage, '_file_chunks') as mock_file_chunks:
@@ -238,8 +239,99 @@ class AzureStorageTest(unittest.TestCase):
                     yield b'hello medusa'
                 mock_file_chunks.side_effect = _fake_chunks
 
-                asyncio.run(storage._upload_blob(tmp_file_name, 'test-object'))
+                mo = asyncio.run(storage._upload_blob(tmp_file_name, 'test-object'))
 
             mock_file_chunks.assert_called_once_with(
                 tmp_file_name, chunk_size=8 * 1024 * 1024
             )
+            # the hash comes from digesting the upload, there is no need to fetch the blob properties
+            mock_blob_client.get_blob_properties.assert_not_called()
+            self.assertEqual('test-object/{}'.format(os.path.basename(tmp_file_name)), mo.path)
+            self.assertEqual(12, mo.size)
+            self.assertEqual(base64.b64encode(hashlib.md5(b'hello medusa').digest()).decode(), mo.MD5)
+
+    def test_download_blob_fetches_ranges(self):
+        payload = b'0123456789abcdefghijk'
+        with tempfile.NamedTemporaryFile() as credentials_file, tempfile.TemporaryDirectory() as dest:
+            credentials_file.write(self.credentials_file_content.encode())
+            credentials_file.flush()
+            config = self._make_config(credentials_file.name, {
+                'concurrent_transfers': '2',
+                'multipart_chunksize': '8',
+                'multi_part_upload_threshold': '16',
+            })
+            storage = AzureStorage(config)
+            storage._stat_blob = AsyncMock(return_value=AbstractBlob('some/object', len(payload), 'hash', None, None))
+
+            requested_ranges = []
+
+            async def _fake_download_blob(blob, offset, length, timeout):
+                requested_ranges.append((offset, length))
+
+                async def _chunks():
+                    yield payload[offset:offset + length]
+                return MagicMock(chunks=_chunks)
+
+            storage.azure_container_client = MagicMock()
+            storage.azure_container_client.download_blob = AsyncMock(side_effect=_fake_download_blob)
+
+            asyncio.run(storage._download_blob('some/object', dest))
+
+            self.assertEqual(payload, pathlib.Path(dest, 'object').read_bytes())
+            self.assertEqual([(0, 8), (8, 8), (16, 5)], sorted(requested_ranges))
+
+    def test_delete_objects_uses_batch_requests(self):
+        with tempfile.NamedTemporaryFile() as credentials_file:
+            credentials_file.write(self.credentials_file_content.encode())
+            credentials_file.flush()
+            storage = AzureStorage(self._make_config(credentials_file.name))
+
+            async def _responses(*status_codes):
+                for status_code in status_codes:
+                    yield MagicMock(status_code=status_code)
+
+            mock_container = MagicMock()
+            mock_container.delete_blobs = AsyncMock(side_effect=lambda *names, **kwargs: _responses(
+                *[403 if name == 'denied' else 404 if name == 'gone' else 202 for name in names]
+            ))
+            storage.azure_container_client = mock_container
+
+            objects = [AbstractBlob(name, 1, 'hash', None, None) for name in ['deleted', 'gone', 'denied']]
+            failures = storage.delete_objects(objects)
+
+            mock_container.delete_blobs.assert_called_once()
+            args, kwargs = mock_container.delete_blobs.call_args
+            self.assertEqual(('deleted', 'gone', 'denied'), args)
+            self.assertFalse(kwargs['raise_on_any_failure'])
+            # an already missing blob does not count as a failure
+            self.assertEqual({'denied': 'HTTP 403'}, failures)
+
+    def test_delete_objects_bounds_concurrent_batches(self):
+        with tempfile.NamedTemporaryFile() as credentials_file:
+            credentials_file.write(self.credentials_file_content.encode())
+            credentials_file.flush()
+            storage = AzureStorage(self._make_config(credentials_file.name))
+
+            running = []
+            most_running = []
+
+            async def _delete_blobs(*names, **kwargs):
+                running.append(names)
+                most_running.append(len(running))
+                await asyncio.sleep(0.01)
+                running.remove(names)
+
+                async def _responses():
+                    for _ in names:
+                        yield MagicMock(status_code=202)
+                return _responses()
+
+            storage.azure_container_client = MagicMock()
+            storage.azure_container_client.delete_blobs = AsyncMock(side_effect=_delete_blobs)
+
+            objects = [AbstractBlob('blob{}'.format(i), 1, 'hash', None, None) for i in range(256 * 10)]
+            failures = storage.delete_objects(objects, concurrent_transfers=3)
+
+            self.assertEqual({}, failures)
+            self.assertEqual(10, storage.azure_container_client.delete_blobs.call_count)
+            self.assertEqual(3, max(most_running))
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import io
+import unittest
+from unittest.mock import patch
+
+from medusa.storage.bandwidth_limiter import BandwidthLimiter, ThrottledReader, TokenBucket
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_no_limit(self):
+        bucket = TokenBucket(0, clock=self.clock)
+        self.assertEqual(0, bucket._take(10 * 1024 ** 3))
+
+    def test_burst_of_one_second(self):
+        bucket = TokenBucket(100, clock=self.clock)
+        self.assertEqual(0, bucket._take(60))
+        self.assertEqual(0, bucket._take(40))
+        # the bucket is empty, the next bytes have to wait for it to refill
+        self.assertAlmostEqual(0.5, bucket._take(50))
+
+    def test_concurrent_takers_share_the_rate(self):
+        bucket = TokenBucket(100, clock=self.clock)
+        bucket._take(100)
+        # each taker waits for the debt of the ones before it, so together they get 100 bytes per second
+        self.assertAlmostEqual(1.0, bucket._take(100))
+        self.assertAlmostEqual(2.0, bucket._take(100))
+        self.clock.now += 2.0
+        self.assertAlmostEqual(1.0, bucket._take(100))
+
+    def test_refill_does_not_exceed_one_second(self):
+        bucket = TokenBucket(100, clock=self.clock)
+        bucket._take(100)
+        self.clock.now += 60
+        self.assertEqual(0, bucket._take(100))
+        self.assertAlmostEqual(0.1, bucket._take(10))
+
+    def test_negative_amounts_are_ignored(self):
+        bucket = TokenBucket(100, clock=self.clock)
+        bucket._take(100)
+        self.assertEqual(0, bucket._take(-100))
+        self.assertAlmostEqual(1.0, bucket._take(100))
+
+    def test_set_rate(self):
+        bucket = TokenBucket(0, clock=self.clock)
+        bucket.set_rate(100)
+        # setting a limit starts with a full bucket
+        self.assertEqual(0, bucket._take(100))
+        bucket.set_rate(10)
+        self.assertAlmostEqual(1.0, bucket._take(10))
+        bucket.set_rate(0)
+        self.assertEqual(0, bucket._take(1000))
+
+    def test_consume_sleeps(self):
+        bucket = TokenBucket(100, clock=self.clock)
+        with patch('medusa.storage.bandwidth_limiter.time.sleep') as sleep:
+            bucket.consume(100)
+            sleep.assert_not_called()
+            bucket.consume(50)
+            sleep.assert_called_once_with(0.5)
+
+    def test_throttle(self):
+        bucket = TokenBucket(100, clock=self.clock)
+        delays = []
+
+        async def fake_sleep(delay):
+            delays.append(delay)
+
+        async def chunks():
+            for chunk in [b'a' * 100, b'b' * 100, b'c' * 50]:
+                yield chunk
+
+        async def read_all():
+            return [chunk async for chunk in bucket.throttle(chunks())]
+
+        with patch('medusa.storage.bandwidth_limiter.asyncio.sleep', new=fake_sleep):
+            read = asyncio.run(read_all())
+
+        self.assertEqual([b'a' * 100, b'b' * 100, b'c' * 50], read)
+        self.assertEqual([1.0, 1.5], delays)
+
+
+class ThrottledReaderTest(unittest.TestCase):
+
+    def test_reads_take_tokens(self):
+        bucket = TokenBucket(0)
+        taken = []
+        bucket.consume = taken.append
+        reader = ThrottledReader(io.BytesIO(b'0123456789'), bucket)
+
+        self.assertEqual(b'0123', reader.read(4))
+        buffer = bytearray(4)
+        self.assertEqual(4, reader.readinto(buffer))
+        self.assertEqual(b'4567', bytes(buffer))
+        self.assertEqual(b'89', reader.read())
+        self.assertEqual([4, 4, 2], taken)
+
+        reader.seek(2)
+        self.assertEqual(2, reader.tell())
+        self.assertTrue(isinstance(reader, io.IOBase))
+
+
+class BandwidthLimiterTest(unittest.TestCase):
+
+    def test_configure(self):
+        limiter = BandwidthLimiter()
+        limiter.configure(upload_rate=100, download_rate=200)
+        self.assertEqual(100, limiter.upload.rate)
+        self.assertEqual(200, limiter.download.rate)
+
+    def test_runtime_limits_win_over_configuration(self):
+        limiter = BandwidthLimiter()
+        limiter.configure(upload_rate=100, download_rate=200)
+        limiter.set_limits(upload_rate=50)
+        self.assertEqual(50, limiter.upload.rate)
+        self.assertEqual(200, limiter.download.rate)
+
+        # a storage created afterwards does not undo the change
+        limiter.configure(upload_rate=100, download_rate=100)
+        self.assertEqual(50, limiter.upload.rate)
+        self.assertEqual(200, limiter.download.rate)
+
+        limiter.reset()
+        limiter.configure(upload_rate=100, download_rate=100)
+        self.assertEqual(100, limiter.upload.rate)
+        self.assertEqual(100, limiter.download.rate)
+
+
+if __name__ == '__main__':
+    unittest.main()
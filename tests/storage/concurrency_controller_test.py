@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import unittest
+
+from medusa.storage.concurrency_controller import ConcurrencyController
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ConcurrencyControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.pressure = False
+
+    def _make_controller(self, initial, maximum=None, adaptive=True):
+        return ConcurrencyController(
+            initial, maximum, adaptive, under_pressure=lambda: self.pressure, clock=self.clock
+        )
+
+    def _transfer(self, controller, size, seconds, fails=False):
+        async def transfer():
+            async with controller.slot() as t:
+                self.clock.now += seconds
+                if fails:
+                    raise IOError('transfer failed')
+                t.completed(size)
+        try:
+            asyncio.run(transfer())
+        except IOError:
+            pass
+
+    def _window(self, controller, transfers, size, seconds):
+        # transfers running side by side, all taking the whole window
+        start = self.clock.now
+        for _ in range(transfers):
+            self.clock.now = start
+            self._transfer(controller, size, seconds)
+
+    def test_never_exceeds_the_limit(self):
+        controller = self._make_controller(3, adaptive=False)
+        counts = {'in_flight': 0, 'peak': 0}
+
+        async def transfer():
+            async with controller.slot() as t:
+                counts['in_flight'] += 1
+                counts['peak'] = max(counts['peak'], counts['in_flight'])
+                await asyncio.sleep(0.01)
+                counts['in_flight'] -= 1
+                t.completed(100)
+
+        async def transfer_all():
+            await asyncio.gather(*(transfer() for _ in range(10)))
+
+        asyncio.run(transfer_all())
+        self.assertEqual(3, counts['peak'])
+        self.assertEqual(0, counts['in_flight'])
+
+    def test_increases_while_throughput_rises(self):
+        controller = self._make_controller(1, maximum=4)
+
+        self._window(controller, 1, 100, 1)
+        self.assertEqual(2, controller.limit)
+        self._window(controller, 2, 100, 1)
+        self.assertEqual(3, controller.limit)
+        # throughput went down, we stay where we are
+        self._window(controller, 3, 100, 2)
+        self.assertEqual(3, controller.limit)
+        self._window(controller, 3, 100, 1)
+        self.assertEqual(4, controller.limit)
+        # never above the maximum
+        self._window(controller, 4, 100, 0.5)
+        self.assertEqual(4, controller.limit)
+
+    def test_holds_when_latency_grows(self):
+        controller = self._make_controller(1, maximum=4)
+        self._window(controller, 1, 100, 1)
+        self.assertEqual(2, controller.limit)
+        # more throughput, but each transfer got 50% slower: the storage or the network is saturated
+        self._window(controller, 2, 200, 3)
+        self.assertEqual(2, controller.limit)
+
+    def test_backs_off_when_throttled(self):
+        controller = self._make_controller(8, maximum=8)
+
+        controller.throttled()
+        self._transfer(controller, 100, 1)
+        self.assertEqual(4, controller.limit)
+
+        # more throttling from the same burst, before any transfer succeeded again
+        controller.throttled()
+        self._transfer(controller, 100, 1, fails=True)
+        self.assertEqual(4, controller.limit)
+
+        self._transfer(controller, 100, 1)
+        controller.throttled()
+        self._transfer(controller, 100, 1)
+        self.assertEqual(2, controller.limit)
+
+    def test_backs_off_when_node_is_busy(self):
+        controller = self._make_controller(4, maximum=8)
+        self.pressure = True
+        self._window(controller, 4, 100, 1)
+        self.assertEqual(2, controller.limit)
+        self._window(controller, 2, 100, 1)
+        self.assertEqual(1, controller.limit)
+        self._window(controller, 1, 100, 1)
+        self.assertEqual(1, controller.limit)
+
+    def test_not_adaptive_ignores_signals(self):
+        controller = self._make_controller(2, maximum=8, adaptive=False)
+        controller.throttled()
+        self._window(controller, 2, 100, 1)
+        self._window(controller, 2, 1000, 1)
+        self.assertEqual(2, controller.limit)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import pathlib
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from medusa.storage.abstract_storage import AbstractStorage, ManifestObject
+from medusa.storage.digest_cache import DigestCache
+from medusa.storage.s3_storage import S3Storage
+
+
+class DigestCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src = pathlib.Path(self.tmp_dir.name) / 'nb-1-big-Data.db'
+        self.src.write_bytes(os.urandom(3 * 1024))
+        self.digest_cache = DigestCache(pathlib.Path(self.tmp_dir.name) / 'medusa' / 'digests.db')
+
+    def tearDown(self):
+        self.digest_cache.close()
+        self.tmp_dir.cleanup()
+
+    def test_unchanged_file_is_not_read_again(self):
+        expected = AbstractStorage.generate_md5_hash(self.src)
+        self.assertEqual(expected, AbstractStorage.generate_md5_hash(self.src, digest_cache=self.digest_cache))
+
+        with patch('builtins.open', side_effect=AssertionError('the file should not be read')):
+            self.assertEqual(expected, AbstractStorage.generate_md5_hash(self.src, digest_cache=self.digest_cache))
+
+        # the cache survives medusa restarts
+        self.digest_cache.close()
+        reopened = DigestCache(pathlib.Path(self.tmp_dir.name) / 'medusa' / 'digests.db')
+        self.assertEqual(expected, reopened.digest(self.src, DigestCache.SINGLE_PART, lambda: 'not cached'))
+        reopened.close()
+
+    def test_modified_file_is_digested_again(self):
+        AbstractStorage.generate_md5_hash(self.src, digest_cache=self.digest_cache)
+        self.src.write_bytes(os.urandom(3 * 1024))
+        os.utime(self.src, ns=(0, 123456789))
+
+        self.assertEqual(
+            AbstractStorage.generate_md5_hash(self.src),
+            AbstractStorage.generate_md5_hash(self.src, digest_cache=self.digest_cache)
+        )
+
+    def test_multipart_digests_depend_on_part_size(self):
+        single_part = AbstractStorage.generate_md5_hash(self.src, digest_cache=self.digest_cache)
+        two_parts = AbstractStorage.md5_multipart(self.src, 2 * 1024, digest_cache=self.digest_cache)
+        three_parts = AbstractStorage.md5_multipart(self.src, 1024, digest_cache=self.digest_cache)
+
+        self.assertEqual(AbstractStorage.md5_multipart(self.src, 2 * 1024), two_parts)
+        self.assertEqual(AbstractStorage.md5_multipart(self.src, 1024), three_parts)
+        self.assertNotEqual(two_parts, three_parts)
+        self.assertNotIn('-', single_part)
+
+    def test_file_matches_storage_with_digest_cache(self):
+        cached_item = ManifestObject('nb-1-big-Data.db', 3 * 1024, AbstractStorage.md5_multipart(self.src, 1024))
+        for _ in range(2):
+            self.assertTrue(S3Storage.file_matches_storage(
+                self.src, cached_item, threshold=1024, enable_md5_checks=True, chunk_size='1KB',
+                digest_cache=self.digest_cache
+            ))
+
+
+if __name__ == '__main__':
+    unittest.main()
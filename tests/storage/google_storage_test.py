@@ -195,3 +195,67 @@ class GoogleStorageTest(unittest.TestCase):
             asyncio.run(storage._download_blob('some/object', tmp_dir))
 
         self.assertTrue(all(s == DOWNLOAD_STREAM_CONSUMPTION_CHUNK_SIZE for s in read_sizes))
+
+    def test_download_blob_in_ranges(self):
+        storage = self._make_gcs_storage({
+            'concurrent_transfers': '2',
+            'multipart_chunksize': '4',
+            'multi_part_upload_threshold': '8',
+        })
+        payload = b'0123456789abcdefghijk'
+        fake_blob = mock.MagicMock()
+        fake_blob.name = 'some/object'
+        fake_blob.size = len(payload)
+
+        requested_ranges = []
+
+        async def fake_download_stream(bucket, object_name, headers=None, timeout=None):
+            start, end = headers['Range'][len('bytes='):].split('-')
+            requested_ranges.append((int(start), int(end)))
+            return self._make_fake_stream(payload[int(start):int(end) + 1])
+
+        storage.gcs_storage = mock.AsyncMock()
+        storage.gcs_storage.download_stream = fake_download_stream
+
+        async def fake_stat(key):
+            return fake_blob
+
+        storage._stat_blob = fake_stat
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            asyncio.run(storage._download_blob('some/object', tmp_dir))
+            self.assertEqual(payload, (Path(tmp_dir) / 'object').read_bytes())
+
+        self.assertEqual(
+            [(0, 3), (4, 7), (8, 11), (12, 15), (16, 19), (20, 20)],
+            sorted(requested_ranges)
+        )
+
+    def test_read_blob_range_opens_the_session(self):
+        storage = self._make_gcs_storage()
+        payload = b'0123456789'
+
+        def ensure_session():
+            storage.gcs_storage = mock.AsyncMock()
+            storage.gcs_storage.download_stream = mock.AsyncMock(return_value=self._make_fake_stream(payload[2:6]))
+
+        storage._ensure_session = mock.MagicMock(side_effect=ensure_session)
+
+        async def read_range():
+            return b''.join([chunk async for chunk in storage._read_blob_range('some/object', 2, 5)])
+
+        # nothing else might have needed the session yet
+        self.assertEqual(b'2345', asyncio.run(read_range()))
+        storage._ensure_session.assert_called_once()
+
+    def test_download_blob_in_ranges_fails_on_short_range(self):
+        storage = self._make_gcs_storage({'concurrent_transfers': '2'})
+        storage.gcs_storage = mock.AsyncMock()
+        storage.gcs_storage.download_stream = mock.AsyncMock(side_effect=lambda **kw: self._make_fake_stream(b'ab'))
+
+        async def download(file_path):
+            await storage._download_blob_in_ranges('some/object', 12, file_path, 4, asyncio.Semaphore(2))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with self.assertRaises(IOError):
+                asyncio.run(download(str(Path(tmp_dir) / 'object')))
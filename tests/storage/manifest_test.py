@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import unittest
+from unittest.mock import patch
+
+from medusa.filtering import filter_fqtns
+from medusa.storage.manifest import Manifest, encode_manifest, serialize_manifest
+
+SECTIONS = [
+    {
+        'keyspace': 'ks1',
+        'columnfamily': 't1-cfid1',
+        'objects': [
+            # hex MD5, as S3 gives it
+            {'path': 'node1/data/ks1/t1-cfid1/nb-1-big-Data.db', 'MD5': 'b1946ac92492d2347c6235b4d2611184',
+             'size': 3 * 1024 ** 3},
+            # multipart ETag
+            {'path': 'node1/data/ks1/t1-cfid1/nb-1-big-Index.db', 'MD5': 'b1946ac92492d2347c6235b4d2611184-12',
+             'size': 100},
+            # base64 MD5, as GCS and Azure give it
+            {'path': 'node1/data/ks1/t1-cfid1/.t1_idx/nb-1-big-Data.db', 'MD5': 'sZRqySSS0jR8YjW00mERhA==',
+             'size': 0},
+            {'path': 'node1/data/ks1/t1-cfid1/nb-2-big-Data.db', 'MD5': 'not a digest we know', 'size': 7},
+            {'path': 'node1/data/ks1/t1-cfid1/nb-3-big-Data.db', 'MD5': None, 'size': 8},
+            # upper case hex would not come back the same if stored as binary
+            {'path': 'node1/data/ks1/t1-cfid1/nb-4-big-Data.db', 'MD5': 'B1946AC92492D2347C6235B4D2611184',
+             'size': 9},
+        ]
+    },
+    {'keyspace': 'ks1', 'columnfamily': 't2-cfid2', 'objects': []},
+    {
+        'keyspace': 'système',
+        'columnfamily': 'tàble-cfid3',
+        'objects': [
+            {'path': 'node1/data/système/tàble-cfid3/nb-1-big-Data.db', 'MD5': 'b1946ac92492d2347c6235b4d2611184',
+             'size': 1},
+        ]
+    },
+]
+
+
+class ManifestTest(unittest.TestCase):
+
+    def test_compact_manifest_round_trip(self):
+        content = encode_manifest(SECTIONS)
+        manifest = Manifest(content)
+        self.assertTrue(manifest.is_compact)
+        self.assertEqual(SECTIONS, list(manifest))
+        self.assertEqual(SECTIONS, json.loads(manifest.to_json()))
+        self.assertLess(len(content), len(json.dumps(SECTIONS)) / 2)
+
+    def test_legacy_json_manifest(self):
+        for content in [json.dumps(SECTIONS), json.dumps(SECTIONS).encode('utf-8')]:
+            manifest = Manifest(content)
+            self.assertFalse(manifest.is_compact)
+            self.assertEqual(SECTIONS, list(manifest))
+            self.assertEqual(3 * 1024 ** 3 + 125, manifest.size())
+            self.assertEqual(7, manifest.num_objects())
+
+    def test_stats_come_from_the_index(self):
+        manifest = Manifest(encode_manifest(SECTIONS))
+        with patch.object(Manifest, '_decode_objects') as decode_objects:
+            self.assertEqual(
+                [('ks1', 't1-cfid1'), ('ks1', 't2-cfid2'), ('système', 'tàble-cfid3')],
+                [(table.keyspace, table.columnfamily) for table in manifest.tables()]
+            )
+            self.assertEqual(3 * 1024 ** 3 + 125, manifest.size())
+            self.assertEqual(1, manifest.size({'système.tàble-cfid3'}))
+            self.assertEqual(7, manifest.num_objects())
+            self.assertEqual(3, len(manifest))
+            retained, ignored = filter_fqtns(['ks1'], [], manifest)
+            decode_objects.assert_not_called()
+        self.assertEqual({'ks1.t1-cfid1', 'ks1.t2-cfid2'}, retained)
+        self.assertEqual({'système.tàble'}, ignored)
+
+    def test_read_single_table(self):
+        manifest = Manifest(encode_manifest(SECTIONS))
+        with patch.object(Manifest, '_decode_objects', wraps=manifest._decode_objects) as decode_objects:
+            self.assertEqual(SECTIONS[2], manifest.section('système', 'tàble-cfid3'))
+            self.assertIsNone(manifest.section('ks1', 't3-cfid3'))
+            self.assertEqual([SECTIONS[1]], list(manifest.sections({'ks1.t2-cfid2'})))
+        self.assertEqual(2, decode_objects.call_count)
+
+    def test_serialize_manifest(self):
+        self.assertEqual(json.dumps(SECTIONS), serialize_manifest(SECTIONS, 'json'))
+        self.assertEqual(encode_manifest(SECTIONS), serialize_manifest(SECTIONS, 'compact'))
+        self.assertRaises(ValueError, serialize_manifest, SECTIONS, 'xml')
+
+    def test_unknown_version(self):
+        content = bytearray(encode_manifest(SECTIONS))
+        content[4] = 42
+        self.assertRaises(ValueError, Manifest, bytes(content))
+
+    def test_truncated_manifest(self):
+        content = encode_manifest(SECTIONS)
+        self.assertRaises(ValueError, Manifest, content[:-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,17 +12,22 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
 import base64
 import datetime
 import hashlib
 import json
 import os
+import time
 import unittest
 import tempfile
+import threading
 
-from unittest.mock import patch, MagicMock, mock_open
+from unittest.mock import patch, AsyncMock, MagicMock, mock_open
 import botocore.utils
+from botocore.exceptions import ClientError
 
+from medusa.storage.abstract_storage import AbstractBlob, ManifestObject
 from medusa.storage.s3_base_storage import S3BaseStorage
 from tests.storage.abstract_storage_test import AttributeDict
 
@@ -510,6 +515,240 @@ class S3StorageTest(unittest.TestCase):
                     self.assertEqual('when_required', boto_config.request_checksum_calculation)
                     self.assertEqual('when_required', boto_config.response_checksum_validation)
 
+    def test_delete_objects_uses_bulk_requests(self):
+        with patch(BOTOCORE_HTTPSESSION_PATH, return_value=_make_instance_metadata_mock()):
+            with tempfile.NamedTemporaryFile() as empty_file:
+                config = AttributeDict({
+                    'storage_provider': 's3_us_west_oregon',
+                    'region': 'default',
+                    'key_file': empty_file.name,
+                    'api_profile': None,
+                    'kms_id': None,
+                    'sse_c_key': None,
+                    'transfer_max_bandwidth': None,
+                    'bucket_name': 'whatever-bucket',
+                    'secure': 'True',
+                    'ssl_verify': 'False',
+                    'host': None,
+                    'port': None,
+                    'concurrent_transfers': '1',
+                    'multipart_chunksize': '5MB',
+                    'multipart_max_concurrency': '5',
+                    'multi_part_upload_threshold': str(20 * 1024 * 1024),
+                })
+                s3_storage = S3BaseStorage(config)
+                s3_storage.s3_client = MagicMock()
+                s3_storage.s3_client.delete_objects.side_effect = [
+                    {},
+                    {'Errors': [{'Key': 'key-1000', 'Code': 'AccessDenied', 'Message': 'Access Denied'}]},
+                ]
+                objects = [AbstractBlob('key-{}'.format(i), 1, 'hash', None, None) for i in range(1001)]
+
+                failures = s3_storage.delete_objects(objects)
+
+                # 1001 keys do not fit in a single DeleteObjects request
+                self.assertEqual(2, s3_storage.s3_client.delete_objects.call_count)
+                deleted_keys = [
+                    len(call.kwargs['Delete']['Objects']) for call in s3_storage.s3_client.delete_objects.call_args_list
+                ]
+                self.assertEqual([1000, 1], deleted_keys)
+                self.assertEqual({'key-1000': 'AccessDenied: Access Denied'}, failures)
+
+    def _delete_test_storage(self, concurrent_transfers):
+        config = AttributeDict({
+            'storage_provider': 's3_us_west_oregon',
+            'region': 'default',
+            'key_file': None,
+            'api_profile': None,
+            'kms_id': None,
+            'sse_c_key': None,
+            'transfer_max_bandwidth': None,
+            'bucket_name': 'whatever-bucket',
+            'secure': 'True',
+            'ssl_verify': 'False',
+            'host': None,
+            'port': None,
+            'concurrent_transfers': str(concurrent_transfers),
+            'multipart_chunksize': '5MB',
+            'multipart_max_concurrency': '5',
+            'multi_part_upload_threshold': str(20 * 1024 * 1024),
+        })
+        s3_storage = S3BaseStorage(config)
+        s3_storage.s3_client = MagicMock()
+        return s3_storage
+
+    def test_delete_objects_bounds_concurrent_batches(self):
+        with patch(BOTOCORE_HTTPSESSION_PATH, return_value=_make_instance_metadata_mock()):
+            s3_storage = self._delete_test_storage(concurrent_transfers=1)
+            lock = threading.Lock()
+            running = []
+            most_running = []
+
+            def delete_objects(**kwargs):
+                with lock:
+                    running.append(kwargs)
+                    most_running.append(len(running))
+                time.sleep(0.01)
+                with lock:
+                    running.remove(kwargs)
+                return {}
+
+            s3_storage.s3_client.delete_objects.side_effect = delete_objects
+            objects = [AbstractBlob('key-{}'.format(i), 1, 'hash', None, None) for i in range(1000 * 10)]
+
+            self.assertEqual({}, s3_storage.delete_objects(objects, concurrent_transfers=3))
+            self.assertEqual(10, s3_storage.s3_client.delete_objects.call_count)
+            self.assertEqual(3, max(most_running))
+
+    def test_delete_objects_retries_throttled_batches(self):
+        with patch(BOTOCORE_HTTPSESSION_PATH, return_value=_make_instance_metadata_mock()):
+            s3_storage = self._delete_test_storage(concurrent_transfers=1)
+            s3_storage.s3_client.delete_objects.side_effect = [
+                {'Errors': [{'Key': 'key-1', 'Code': 'SlowDown', 'Message': 'Please reduce your request rate.'}]},
+                ClientError({'Error': {'Code': 'InternalError', 'Message': 'Internal Error'}}, 'DeleteObjects'),
+                {},
+            ]
+            objects = [AbstractBlob('key-{}'.format(i), 1, 'hash', None, None) for i in range(2)]
+
+            with patch.object(S3BaseStorage._delete_keys.retry, 'sleep', new=AsyncMock()), \
+                    patch.object(s3_storage.transfer_concurrency, 'throttled') as throttled:
+                failures = s3_storage.delete_objects(objects)
+
+            self.assertEqual({}, failures)
+            self.assertEqual(3, s3_storage.s3_client.delete_objects.call_count)
+            throttled.assert_called_once()
+            # storages without DeleteObjects get their objects deleted one by one, without retrying the batch
+            s3_storage.s3_client.delete_objects.reset_mock()
+            s3_storage.s3_client.delete_objects.side_effect = ClientError(
+                {'Error': {'Code': 'NotImplemented', 'Message': 'Not Implemented'}}, 'DeleteObjects'
+            )
+            self.assertEqual({}, s3_storage.delete_objects(objects))
+            self.assertEqual(1, s3_storage.s3_client.delete_objects.call_count)
+            self.assertEqual(2, s3_storage.s3_client.delete_object.call_count)
+
+    def test_upload_blob_skips_head_once_etags_are_known_to_be_md5s(self):
+        with patch(BOTOCORE_HTTPSESSION_PATH, return_value=_make_instance_metadata_mock()):
+            with tempfile.NamedTemporaryFile() as empty_file, tempfile.TemporaryDirectory() as src_dir:
+                config = AttributeDict({
+                    'storage_provider': 's3_us_west_oregon',
+                    'region': 'default',
+                    'key_file': empty_file.name,
+                    'api_profile': None,
+                    'kms_id': None,
+                    'sse_c_key': None,
+                    'transfer_max_bandwidth': None,
+                    'bucket_name': 'whatever-bucket',
+                    'secure': 'True',
+                    'ssl_verify': 'False',
+                    'host': None,
+                    'port': None,
+                    'concurrent_transfers': '1',
+                    'multipart_chunksize': '5MB',
+                    'multipart_max_concurrency': '5',
+                    'multi_part_upload_threshold': str(20 * 1024 * 1024),
+                    'storage_class': None,
+                })
+                s3_storage = S3BaseStorage(config)
+                s3_storage.s3_client = MagicMock()
+                content = b'some sstable content'
+                etag = hashlib.md5(content, usedforsecurity=False).hexdigest()
+                s3_storage.s3_client.head_object.return_value = {'ContentLength': len(content), 'ETag': f'"{etag}"'}
+
+                srcs = []
+                for i in range(3):
+                    srcs.append(os.path.join(src_dir, 'nb-{}-big-Data.db'.format(i)))
+                    with open(srcs[-1], 'wb') as f:
+                        f.write(content)
+                uploaded = s3_storage.upload_blobs(srcs, 'fqdn/data/ks/tbl')
+
+                # only the first upload asks S3 for the ETag, to find out it is the MD5 of the content
+                self.assertEqual(1, s3_storage.s3_client.head_object.call_count)
+                self.assertEqual(3, s3_storage.s3_client.upload_file.call_count)
+                expected = [
+                    ManifestObject('fqdn/data/ks/tbl/nb-{}-big-Data.db'.format(i), len(content), etag) for i in range(3)
+                ]
+                self.assertEqual(expected, uploaded)
+
+    def test_metadata_requests_run_concurrently(self):
+        with patch(BOTOCORE_HTTPSESSION_PATH, return_value=_make_instance_metadata_mock()):
+            with tempfile.NamedTemporaryFile() as empty_file:
+                config = AttributeDict({
+                    'storage_provider': 's3_us_west_oregon',
+                    'region': 'default',
+                    'key_file': empty_file.name,
+                    'api_profile': None,
+                    'kms_id': None,
+                    'sse_c_key': None,
+                    'transfer_max_bandwidth': None,
+                    'bucket_name': 'whatever-bucket',
+                    'secure': 'True',
+                    'ssl_verify': 'False',
+                    'host': None,
+                    'port': None,
+                    'concurrent_transfers': '1',
+                    'multipart_chunksize': '5MB',
+                    'multipart_max_concurrency': '5',
+                    'multi_part_upload_threshold': str(20 * 1024 * 1024),
+                })
+                s3_storage = S3BaseStorage(config)
+
+                def slow_head_object(Bucket, Key):
+                    time.sleep(0.2)
+                    return {'ContentLength': 1, 'ETag': '"abc"', 'LastModified': None}
+
+                s3_storage.s3_client = MagicMock()
+                s3_storage.s3_client.head_object.side_effect = slow_head_object
+
+                async def stat_blobs():
+                    return await asyncio.gather(*(s3_storage._stat_blob('key-{}'.format(i)) for i in range(5)))
+
+                start = time.monotonic()
+                blobs = asyncio.run(stat_blobs())
+                elapsed = time.monotonic() - start
+
+                self.assertEqual(['key-{}'.format(i) for i in range(5)], [blob.name for blob in blobs])
+                # blocking the event loop would make the HEAD requests run one after the other, taking 1s
+                self.assertLess(elapsed, 0.6)
+
+    def test_throttled_requests_reach_the_concurrency_controller(self):
+        with patch(BOTOCORE_HTTPSESSION_PATH, return_value=_make_instance_metadata_mock()):
+            with tempfile.NamedTemporaryFile() as empty_file:
+                config = AttributeDict({
+                    'storage_provider': 's3_us_west_oregon',
+                    'region': 'default',
+                    'key_file': empty_file.name,
+                    'api_profile': None,
+                    'kms_id': None,
+                    'sse_c_key': None,
+                    'transfer_max_bandwidth': None,
+                    'bucket_name': 'whatever-bucket',
+                    'secure': 'True',
+                    'ssl_verify': 'False',
+                    'host': None,
+                    'port': None,
+                    'concurrent_transfers': '1',
+                    'multipart_chunksize': '5MB',
+                    'multipart_max_concurrency': '5',
+                    'multi_part_upload_threshold': str(20 * 1024 * 1024),
+                })
+                s3_storage = S3BaseStorage(config)
+
+                with patch.object(s3_storage.transfer_concurrency, 'throttled') as throttled:
+                    s3_storage._note_throttled_request(response=None, caught_exception=ConnectionError())
+                    s3_storage._note_throttled_request(response=(MagicMock(status_code=200), {}))
+                    s3_storage._note_throttled_request(
+                        response=(MagicMock(status_code=404), {'Error': {'Code': 'NoSuchKey'}})
+                    )
+                    throttled.assert_not_called()
+
+                    s3_storage._note_throttled_request(
+                        response=(MagicMock(status_code=503), {'Error': {'Code': 'SlowDown'}})
+                    )
+                    s3_storage._note_throttled_request(
+                        response=(MagicMock(status_code=400), {'Error': {'Code': 'RequestLimitExceeded'}})
+                    )
+                    self.assertEqual(2, throttled.call_count)
+
     def test_compare_with_manifest_matches_single_part(self):
         digest = hashlib.md5(b"some file content", usedforsecurity=False).digest()
         actual_hash = digest.hex()
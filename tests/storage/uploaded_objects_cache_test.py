@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import pathlib
+import tempfile
+import unittest
+
+from medusa.storage.abstract_storage import AbstractBlob, ManifestObject
+from medusa.storage.uploaded_objects_cache import UploadedObjectsCache
+
+
+class UploadedObjectsCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_file = pathlib.Path(self.tmp_dir.name) / 'medusa' / 'uploaded_objects.db'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _cache(self, scope='s3://bucket/fqdn/data/'):
+        return UploadedObjectsCache(self.cache_file, scope, reconcile_interval_seconds=3600)
+
+    def test_cache_is_not_fresh_until_reconciled(self):
+        cache = self._cache()
+        self.assertFalse(cache.is_fresh(now=1000))
+
+        blobs = [AbstractBlob('fqdn/data/ks/t/nb-1-big-Data.db', 10, 'h1', None, None)]
+        self.assertEqual(blobs, list(cache.reconcile(blobs, now=1000)))
+
+        self.assertTrue(cache.is_fresh(now=1000 + 3599))
+        self.assertFalse(cache.is_fresh(now=1000 + 3600))
+        # a cache filled for another bucket or node must not be used
+        self.assertFalse(self._cache(scope='s3://other-bucket/fqdn/data/').is_fresh(now=1000))
+
+    def test_interrupted_reconcile_leaves_cache_untouched(self):
+        cache = self._cache()
+        list(cache.reconcile([AbstractBlob('fqdn/data/ks/t/nb-1-big-Data.db', 10, 'h1', None, None)], now=1000))
+
+        def failing_listing():
+            yield AbstractBlob('fqdn/data/ks/t/nb-2-big-Data.db', 20, 'h2', None, None)
+            raise IOError('listing failed')
+
+        with self.assertRaises(IOError):
+            list(cache.reconcile(failing_listing(), now=2000))
+
+        self.assertEqual([ManifestObject('fqdn/data/ks/t/nb-1-big-Data.db', 10, 'h1')], cache.objects())
+        self.assertTrue(cache.is_fresh(now=1000))
+
+    def test_cache_can_be_updated_while_reconciling(self):
+        cache = self._cache()
+        cache.add([ManifestObject('fqdn/data/ks/t/nb-1-big-Data.db', 10, 'h1')])
+
+        def listing():
+            yield AbstractBlob('fqdn/data/ks/t/nb-2-big-Data.db', 20, 'h2', None, None)
+            # a purge or a backup running meanwhile, through their own connection
+            self._cache().forget(['fqdn/data/ks/t/nb-1-big-Data.db'])
+            self._cache().add([ManifestObject('fqdn/data/ks/t/nb-3-big-Data.db', 30, 'h3')])
+            yield AbstractBlob('fqdn/data/ks/t/nb-3-big-Data.db', 30, 'h3', None, None)
+
+        self.assertEqual(2, len(list(cache.reconcile(listing(), now=1000))))
+
+        self.assertEqual(
+            [
+                ManifestObject('fqdn/data/ks/t/nb-2-big-Data.db', 20, 'h2'),
+                ManifestObject('fqdn/data/ks/t/nb-3-big-Data.db', 30, 'h3'),
+            ],
+            sorted(cache.objects())
+        )
+        self.assertTrue(cache.is_fresh(now=1000))
+
+    def test_add_and_forget_objects(self):
+        cache = self._cache()
+        list(cache.reconcile([AbstractBlob('fqdn/data/ks/t/nb-1-big-Data.db', 10, 'h1', None, None)], now=1000))
+
+        cache.add([ManifestObject('fqdn/data/ks/t/nb-2-big-Data.db', 20, 'h2')])
+        cache.forget(['fqdn/data/ks/t/nb-1-big-Data.db'])
+
+        self.assertEqual([ManifestObject('fqdn/data/ks/t/nb-2-big-Data.db', 20, 'h2')], cache.objects())
+
+    def test_reconcile_drops_objects_missing_from_storage(self):
+        cache = self._cache()
+        cache.add([
+            ManifestObject('fqdn/data/ks/t/nb-1-big-Data.db', 10, 'h1'),
+            ManifestObject('fqdn/data/ks/t/nb-2-big-Data.db', 20, 'h2'),
+        ])
+
+        listed = [
+            AbstractBlob('fqdn/data/ks/t/nb-1-big-Data.db', 10, 'h1', None, None),
+            AbstractBlob('fqdn/data/ks/t/nb-3-big-Data.db', 30, 'h3', None, None),
+        ]
+        list(cache.reconcile(listed, now=1000))
+
+        self.assertEqual(
+            [
+                ManifestObject('fqdn/data/ks/t/nb-1-big-Data.db', 10, 'h1'),
+                ManifestObject('fqdn/data/ks/t/nb-3-big-Data.db', 30, 'h3'),
+            ],
+            sorted(cache.objects())
+        )
+
+    def test_reconcile_updates_rewritten_objects(self):
+        cache = self._cache()
+        cache.add([ManifestObject('fqdn/data/ks/t/nb-1-big-Data.db', 10, 'h1')])
+
+        # rewritten with another content of the same size
+        list(cache.reconcile([AbstractBlob('fqdn/data/ks/t/nb-1-big-Data.db', 10, 'h2', None, None)], now=1000))
+
+        self.assertEqual([ManifestObject('fqdn/data/ks/t/nb-1-big-Data.db', 10, 'h2')], cache.objects())
+
+
+if __name__ == '__main__':
+    unittest.main()
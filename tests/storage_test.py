@@ -16,23 +16,29 @@
 import base64
 import configparser
 import hashlib
+import json
 import os
 import pathlib
 import shutil
 import tempfile
+import time
 import unittest
 
-from datetime import datetime
+from datetime import datetime, timezone
 from random import randrange
 from unittest.mock import patch
 
 import medusa.storage.abstract_storage
+import medusa.storage.backup_catalog
 
 from medusa.storage import NodeBackup, ClusterBackup
 from medusa.storage.abstract_storage import AbstractStorage, AbstractBlob, ManifestObject
 from medusa.config import MedusaConfig, StorageConfig, _namedtuple_from_dict, CassandraConfig
-from medusa.index import build_indices
+from medusa.index import add_backup_finish_to_index, build_indices, clean_backup_from_index
 from medusa.storage import Storage
+from medusa.storage.backup_stats import BackupStats, KeyspaceStats
+from medusa.storage.manifest import encode_manifest
+from medusa.storage.reference_index import ObjectReferences, ReferenceIndex
 
 
 class AttributeDict(dict):
@@ -91,6 +97,91 @@ class StorageTest(unittest.TestCase):
         self.storage.storage_driver.upload_blob_from_string("test1/file.txt", file_content)
         self.assertEqual(self.storage.storage_driver.get_blob_content_as_string("test1/file.txt"), file_content)
 
+    def test_node_backup_reads_both_manifest_formats(self):
+        sections = [{
+            'keyspace': 'ks1',
+            'columnfamily': 't1-cfid1',
+            'objects': [
+                {'path': 'node1/backup1/data/ks1/t1-cfid1/nb-1-big-Data.db', 'MD5': 'sZRqySSS0jR8YjW00mERhA==',
+                 'size': 10},
+                {'path': 'node1/backup1/data/ks1/t1-cfid1/nb-1-big-Index.db', 'MD5': 'sZRqySSS0jR8YjW00mERhA==',
+                 'size': 5},
+            ]
+        }]
+        for content in [json.dumps(sections), encode_manifest(sections)]:
+            self.storage.get_node_backup(fqdn='node1', name='backup1').manifest = content
+            node_backup = self.storage.get_node_backup(fqdn='node1', name='backup1')
+            self.assertEqual(content, node_backup.manifest_content)
+            self.assertEqual(sections, list(node_backup.read_manifest()))
+            self.assertEqual(sections, json.loads(node_backup.manifest))
+            self.assertEqual(15, node_backup.size())
+            self.assertEqual(2, node_backup.num_objects())
+
+        self.assertIsNone(self.storage.get_node_backup(fqdn='node1', name='backup2').read_manifest())
+
+    def test_node_backup_stats_come_from_the_index(self):
+        sections = [
+            {'keyspace': 'ks1', 'columnfamily': 't1-cfid1', 'objects': [
+                {'path': 'node1/data/ks1/t1-cfid1/nb-1-big-Data.db', 'MD5': 'sZRqySSS0jR8YjW00mERhA==', 'size': 10},
+                {'path': 'node1/data/ks1/t1-cfid1/nb-2-big-Data.db', 'MD5': 'sZRqySSS0jR8YjW00mERhA==', 'size': 5},
+            ]},
+            {'keyspace': 'ks2', 'columnfamily': 't2-cfid2', 'objects': [
+                {'path': 'node1/data/ks2/t2-cfid2/nb-1-big-Data.db', 'MD5': 'sZRqySSS0jR8YjW00mERhA==', 'size': 7},
+            ]},
+        ]
+        node_backup = self._take_backup("node1", "backup1", 100, 200)
+        node_backup.manifest = encode_manifest(sections)
+
+        # backups taken by older versions of Medusa only have a manifest
+        stats = self.storage.get_node_backup(fqdn="node1", name="backup1").stats
+        self.assertEqual((22, 3, None, None), (stats.size, stats.num_objects, stats.new_size, stats.reused_size))
+        self.assertEqual(KeyspaceStats(15, 2), stats.keyspaces['ks1'])
+
+        node_backup.cached_stats = BackupStats.from_manifest(node_backup.read_manifest(), reused_size=5)
+        add_backup_finish_to_index(self.storage, node_backup)
+        node_backup = self.storage.get_node_backup(fqdn="node1", name="backup1")
+        with patch.object(NodeBackup, 'read_manifest', side_effect=AssertionError('manifest was read')):
+            self.assertEqual(22, node_backup.size())
+            self.assertEqual(3, node_backup.num_objects())
+            self.assertEqual((17, 5), (node_backup.stats.new_size, node_backup.stats.reused_size))
+            self.assertEqual(KeyspaceStats(7, 1), node_backup.stats.keyspaces['ks2'])
+
+        clean_backup_from_index(self.storage, node_backup)
+        self.assertIsNone(self.storage.storage_driver.get_blob(node_backup.stats_path))
+
+    def test_prefetch_node_backups(self):
+        sections = [{'keyspace': 'ks1', 'columnfamily': 't1-cfid1', 'objects': [
+            {'path': 'node1/data/ks1/t1-cfid1/nb-1-big-Data.db', 'MD5': 'sZRqySSS0jR8YjW00mERhA==', 'size': 10},
+        ]}]
+        node_backups = []
+        for fqdn in ["node1", "node2"]:
+            node_backup = self._take_backup(fqdn, "backup1", 100, 200)
+            node_backup.manifest = encode_manifest(sections)
+            node_backup.tokenmap = json.dumps({fqdn: {"tokens": [1]}})
+            node_backup.server_version = json.dumps({"server_type": "cassandra", "release_version": "4.1.0"})
+            node_backups.append(node_backup)
+        # node2 was backed up by a version of Medusa which did not write the stats
+        add_backup_finish_to_index(self.storage, node_backups[0])
+
+        node_backups = [self.storage.get_node_backup(fqdn=fqdn, name="backup1") for fqdn in ["node1", "node2"]]
+        driver = self.storage.storage_driver
+        with patch.object(driver, 'get_blobs_contents', wraps=driver.get_blobs_contents) as get_blobs_contents:
+            self.storage.prefetch_node_backups(node_backups, tokenmap=True, server_version=True, stats=True)
+        # the manifest of node2 comes in a second round, once we know it has no stats
+        self.assertEqual([6, 1], [len(c.args[0]) for c in get_blobs_contents.call_args_list])
+
+        with patch.object(driver, 'get_blob', side_effect=AssertionError('blob fetched')), \
+                patch.object(driver, 'read_blob_as_bytes', side_effect=AssertionError('blob read')):
+            self.assertEqual([10, 10], [node_backup.size() for node_backup in node_backups])
+            self.assertEqual({"node2": {"tokens": [1]}}, json.loads(node_backups[1].tokenmap))
+            self.assertEqual("4.1.0", node_backups[0].release_version)
+            self.assertEqual(sections, list(node_backups[1].read_manifest()))
+
+        # nothing cached gets read again
+        with patch.object(driver, 'get_blobs_contents', wraps=driver.get_blobs_contents) as get_blobs_contents:
+            self.storage.prefetch_node_backups(node_backups, manifest=True, tokenmap=True, stats=True)
+        self.assertEqual([1], [len(c.args[0]) for c in get_blobs_contents.call_args_list])
+
     def test_download_blobs(self):
         files_to_download = list()
         file1_content = self.TEST_FILE_CONTENT
@@ -115,6 +206,17 @@ class StorageTest(unittest.TestCase):
         one_object = self.storage.storage_driver.list_objects("test_download_blobs2")
         self.assertEqual(len(one_object), 1)
 
+    def test_iter_blobs(self):
+        for i in range(5):
+            self.storage.storage_driver.upload_blob_from_string("test_iter_blobs/file{}.txt".format(i), str(i))
+        self.storage.storage_driver.upload_blob_from_string("test_other_blobs/file.txt", "other")
+        with patch('medusa.storage.abstract_storage.LIST_PAGE_SIZE', 2):
+            blobs = self.storage.storage_driver.iter_blobs("test_iter_blobs")
+            self.assertEqual(
+                ["test_iter_blobs/file{}.txt".format(i) for i in range(5)],
+                sorted(blob.name for blob in blobs)
+            )
+
     def test_read_blob(self):
         file1_content = self.TEST_FILE_CONTENT
         self.storage.storage_driver.upload_blob_from_string("test_download_blobs1/file1.txt", file1_content)
@@ -300,6 +402,152 @@ class StorageTest(unittest.TestCase):
         self.assertTrue("node1" in blobs_by_backup["backup2"])
         self.assertFalse("node2" in blobs_by_backup["backup2"])
 
+    def _take_backup(self, fqdn, name, started, finished):
+        self.storage.storage_driver.upload_blob_from_string(
+            "{}{}/{}/meta/schema.cql".format(self.storage.prefix_path, fqdn, name), "schema")
+        node_backup = NodeBackup(storage=self.storage, fqdn=fqdn, name=name,
+                                 started_timestamp=started, finished_timestamp=finished)
+        self.storage.backup_catalog.record_started(node_backup)
+        self.storage.backup_catalog.record_finished(node_backup)
+        return node_backup
+
+    def test_list_node_backups_from_catalog(self):
+        # written by an older Medusa, which only knows about the backup index
+        self.storage.storage_driver.upload_blob_from_string(
+            "{}node1/backup1/meta/schema.cql".format(self.storage.prefix_path), "schema")
+        for index_blob in ["tokenmap_node1.json", "schema_node1.cql", "manifest_node1.json",
+                           "started_node1_100.timestamp", "finished_node1_200.timestamp"]:
+            self.storage.storage_driver.upload_blob_from_string(
+                "{}index/backup_index/backup1/{}".format(self.storage.prefix_path, index_blob), "content")
+
+        self._take_backup("node1", "backup2", 300, 400)
+        self._take_backup("node_2", "backup2", 310, 410)
+
+        # there is no catalog until build-index compacts it, so the segments are not used yet
+        self.storage.backup_catalog.maybe_compact()
+        self.assertFalse(self.storage.backup_catalog.exists())
+        self.assertEqual([("backup1", "node1")], [(b.name, b.fqdn) for b in self.storage.list_node_backups()])
+
+        self.storage.backup_catalog.compact(import_backup_index=True)
+        with patch.object(Storage, 'list_backup_index_blobs', side_effect=AssertionError('index was listed')):
+            backups = [(b.name, b.fqdn, b.started, b.finished) for b in self.storage.list_node_backups()]
+            self.assertEqual(
+                [("backup1", "node1", 100, 200), ("backup2", "node1", 300, 400), ("backup2", "node_2", 310, 410)],
+                backups
+            )
+
+            # segments written after the compaction are picked up too
+            node_backup = self._take_backup("node1", "backup3", 500, None)
+            self.assertEqual(
+                ["backup1", "backup2", "backup3"],
+                [b.name for b in self.storage.list_node_backups(fqdn="node1")]
+            )
+            self.storage.remove_backup_from_index(node_backup)
+            self.assertEqual(
+                ["backup1", "backup2"], [b.name for b in self.storage.list_node_backups(fqdn="node1")]
+            )
+            self.assertEqual(["backup1", "backup2"], [b.name for b in self.storage.list_cluster_backups()])
+
+    def test_list_node_backups_checks_existence_by_batches(self):
+        self.storage.backup_catalog.compact()
+        for i in range(25):
+            self._take_backup("node1", "backup{:02d}".format(i), 100 + i, 200 + i)
+        # the data of the oldest backups expired without the index being updated
+        for i in range(15):
+            os.remove(os.path.join(self.storage.storage_driver.root_dir,
+                                   "node1/backup{:02d}/meta/schema.cql".format(i)))
+
+        driver = self.storage.storage_driver
+        with patch.object(driver, 'get_object', wraps=driver.get_object) as get_object, \
+                patch.object(driver, 'get_blobs', wraps=driver.get_blobs) as get_blobs:
+            backups = [b.name for b in self.storage.list_node_backups(fqdn="node1")]
+
+        self.assertEqual(["backup{:02d}".format(i) for i in range(15, 25)], backups)
+        # a first batch of 10, then a batch going past the first existing backup
+        self.assertEqual([10, 15], [len(c.args[0]) for c in get_blobs.call_args_list])
+        # the existence checks did not fall back to one request per backup
+        self.assertFalse([c for c in get_object.call_args_list if str(c.args[0]).endswith("schema.cql")])
+        self.assertEqual(10, len(list(self.storage.list_node_backups(fqdn="node1"))))
+
+    def test_get_blobs(self):
+        self.storage.storage_driver.upload_blob_from_string("test_get_blobs/file1.txt", "content")
+        blobs = self.storage.storage_driver.get_blobs(["test_get_blobs/file1.txt", "test_get_blobs/file2.txt"])
+        self.assertEqual("test_get_blobs/file1.txt", blobs["test_get_blobs/file1.txt"].name)
+        self.assertIsNone(blobs["test_get_blobs/file2.txt"])
+
+    def test_catalog_compaction_only_deletes_old_segments(self):
+        catalog = self.storage.backup_catalog
+        catalog.compact()
+        self._take_backup("node1", "backup1", 100, 200)
+        catalog.compact()
+        # too recent to be deleted
+        self.assertEqual(2, len(catalog._list_segments()))
+
+        later = datetime.now().timestamp() + medusa.storage.backup_catalog.SEGMENT_RETENTION + 1
+        with patch.object(catalog, '_clock', return_value=later):
+            catalog.compact()
+        self.assertEqual([], catalog._list_segments())
+        self.assertEqual(
+            [("backup1", "node1", 100, 200, False)], [tuple(entry) for entry in catalog.entries()]
+        )
+
+    def test_catalog_compaction_with_naive_utc_blob_times(self):
+        # GCS lists objects with naive UTC times, which must not be read as local ones
+        catalog = self.storage.backup_catalog
+        driver = self.storage.storage_driver
+        now = datetime.now().timestamp()
+
+        def naive_utc(timestamp):
+            return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+
+        young = AbstractBlob("young", 1, None, naive_utc(now - 60), None)
+        old = AbstractBlob("old", 1, None, naive_utc(now - medusa.storage.backup_catalog.SEGMENT_RETENTION - 60), None)
+        previous_tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'Asia/Tokyo'
+        time.tzset()
+        try:
+            self.assertAlmostEqual(now - 60, AbstractStorage.get_object_datetime(driver, young).timestamp(), delta=1)
+            with patch.object(driver, 'get_object_datetime',
+                              side_effect=lambda blob: AbstractStorage.get_object_datetime(driver, blob)), \
+                    patch.object(catalog, '_clock', return_value=now):
+                self.assertEqual([old], catalog._compactable_segments([young, old]))
+        finally:
+            if previous_tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = previous_tz
+            time.tzset()
+
+    def test_reference_index(self):
+        index = ReferenceIndex(self.storage, "node1")
+        index.record_added("backup1", ["data/a", "data/b"])
+        index.record_added("backup2", ["data/b"])
+        references, segments = index.read()
+        self.assertEqual({"backup1", "backup2"}, references.backups)
+        self.assertEqual({"data/a": {"backup1"}, "data/b": {"backup1", "backup2"}}, dict(references.objects))
+        self.assertEqual(2, len(segments))
+
+        # too recent to be deleted, but written to the snapshot anyway
+        index.compact(references, segments)
+        self.assertEqual(2, len(index._list_segments()))
+        later = datetime.now().timestamp() + medusa.storage.backup_catalog.SEGMENT_RETENTION + 1
+        with patch.object(index, '_clock', return_value=later):
+            index.record_removed("backup1")
+            index.record_added("backup3", [])
+            references, segments = index.read()
+            index.compact(references, segments)
+        self.assertEqual([], index._list_segments())
+
+        references, _ = ReferenceIndex(self.storage, "node1").read()
+        self.assertEqual({"backup2", "backup3"}, references.backups)
+        self.assertEqual({"data/b"}, references.referenced_paths())
+        self.assertEqual(references.objects, ObjectReferences.from_json(references.to_json()).objects)
+
+        # compactions give up when the references got read too long ago
+        with patch.object(index, '_clock', return_value=later + medusa.storage.backup_catalog.SEGMENT_RETENTION):
+            index.compact(ObjectReferences(), [])
+        self.assertEqual({"backup2", "backup3"}, ReferenceIndex(self.storage, "node1").read()[0].backups)
+
     def test_parse_backup_index_with_wrong_names(self):
         file_content = "content of the test file"
         prefix_path = self.storage.prefix_path
@@ -379,7 +627,11 @@ class StorageTest(unittest.TestCase):
             'prefix': 'test-prefix',
             'fqdn': 'test-fqdn',
             'k8s_mode': False,
-            'storage_provider': 'local'
+            'storage_provider': 'local',
+            'uploaded_objects_cache_file': None,
+            'transfer_max_bandwidth': None,
+            'transfer_max_upload_bandwidth': None,
+            'transfer_max_download_bandwidth': None,
         })
         s = Storage(config=config)
         listed_files = [
@@ -426,9 +678,53 @@ class StorageTest(unittest.TestCase):
             },
 
         }
-        with patch('medusa.storage.local_storage.LocalStorage._list_blobs', return_value=listed_files):
+
+        async def fake_iter_blobs(_self, prefix=None):
+            for blob in listed_files:
+                yield blob
+
+        with patch('medusa.storage.local_storage.LocalStorage._iter_blobs', new=fake_iter_blobs):
             self.assertEqual(expected_grouping, s.list_files_per_table())
 
+    def test_list_files_per_table_uses_uploaded_objects_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            config = AttributeDict({
+                'bucket_name': 'test-bucket',
+                'base_path': 'test-path',
+                'prefix': None,
+                'fqdn': 'test-fqdn',
+                'k8s_mode': False,
+                'storage_provider': 'local',
+                'uploaded_objects_cache_file': os.path.join(cache_dir, 'uploaded_objects.db'),
+                'uploaded_objects_cache_reconcile_interval_in_hours': '24',
+                'transfer_max_bandwidth': None,
+                'transfer_max_upload_bandwidth': None,
+                'transfer_max_download_bandwidth': None,
+            })
+            s = Storage(config=config)
+            listings = []
+
+            async def fake_iter_blobs(_self, prefix=None):
+                listings.append(prefix)
+                if prefix == 'test-fqdn/data/':
+                    yield AbstractBlob('test-fqdn/data/ks/t/nb-1-big-Data.db', 10, 'h1', datetime.now(), None)
+
+            with patch('medusa.storage.local_storage.LocalStorage._iter_blobs', new=fake_iter_blobs):
+                s.list_files_per_table()
+                s.record_uploaded_objects([ManifestObject('test-fqdn/data/ks/t/nb-2-big-Data.db', 20, 'h2')])
+                files = s.list_files_per_table()
+
+            # only the first call lists the data folder, the second one reads the cache updated by the upload once it
+            # checked no purge happened since
+            self.assertEqual(['test-fqdn/data/', 'index/references/test-fqdn/segments/'], listings)
+            self.assertEqual(
+                {
+                    'nb-1-big-Data.db': ManifestObject('test-fqdn/data/ks/t/nb-1-big-Data.db', 10, 'h1'),
+                    'nb-2-big-Data.db': ManifestObject('test-fqdn/data/ks/t/nb-2-big-Data.db', 20, 'h2'),
+                },
+                files['ks']['t']
+            )
+
     def test_saniitize_keyspace_and_table_name(self):
         p = pathlib.Path('/some/path/keyspace/table-cfid/snapshots/snapshot-name/nb-5-big-CompressionInfo.db')
         self.assertEqual(
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021- Datastax, Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import base64
+import configparser
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+from medusa.config import StorageConfig, _namedtuple_from_dict
+from medusa.deep_verify import (
+    DeepVerification, DeepVerificationProgress, ObjectChecksums, parse_compression_info
+)
+from medusa.storage import Storage
+from medusa.storage.abstract_storage import AbstractBlob, AbstractStorage
+from medusa.verify import NodeVerification, validate_node_backups
+
+
+def compressed_sstable(chunks, chunk_length=16, with_max_compressed_length=True):
+    """
+    Builds the Data.db and CompressionInfo.db of a compressed SSTable, chunks being already "compressed".
+    """
+    data, offsets = b'', []
+    for chunk in chunks:
+        offsets.append(len(data))
+        data += chunk + struct.pack('>I', zlib.crc32(chunk))
+    compressor = b'org.apache.cassandra.io.compress.LZ4Compressor'
+    info = struct.pack('>H', len(compressor)) + compressor + struct.pack('>i', 0) + struct.pack('>i', chunk_length)
+    if with_max_compressed_length:
+        info += struct.pack('>i', chunk_length)
+    info += struct.pack('>qi', chunk_length * len(chunks), len(chunks))
+    info += b''.join(struct.pack('>q', offset) for offset in offsets)
+    return data, info
+
+
+class VerifyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        config = configparser.ConfigParser(interpolation=None)
+        config['storage'] = {
+            'host_file_separator': ',',
+            'bucket_name': 'medusa_test_bucket',
+            'storage_provider': 'local',
+            'fqdn': '127.0.0.1',
+            'base_path': self.base_path,
+            'concurrent_transfers': 1,
+        }
+        self.storage = Storage(config=_namedtuple_from_dict(StorageConfig, config['storage']))
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def _make_backup(self, fqdn, files, differential=False, with_md5=False):
+        node_backup = self.storage.get_node_backup(fqdn=fqdn, name='backup1', differential_mode=differential)
+        objects = []
+        for name, content in files.items():
+            path = '{}/ks1/t1-cfid1/{}'.format(node_backup.data_path, name)
+            self.storage.storage_driver.upload_blob_from_string(path, content)
+            content = content.encode() if isinstance(content, str) else content
+            md5 = base64.b64encode(hashlib.md5(content).digest()).decode() if with_md5 else None
+            objects.append({'path': path, 'MD5': md5, 'size': len(content)})
+        node_backup.manifest = json.dumps([{'keyspace': 'ks1', 'columnfamily': 't1-cfid1', 'objects': objects}])
+        return node_backup
+
+    def _remove(self, node_backup, name):
+        os.remove(os.path.join(
+            self.storage.storage_driver.root_dir, '{}/ks1/t1-cfid1/{}'.format(node_backup.data_path, name)
+        ))
+
+    def test_validate_node_backups(self):
+        files = {'nb-{}-big-Data.db'.format(i): 'content {}'.format(i) for i in range(5)}
+        node1 = self._make_backup('node1', files)
+        node2 = self._make_backup('node2', files)
+        self._remove(node1, 'nb-0-big-Data.db')
+        self._remove(node1, 'nb-4-big-Data.db')
+        self.storage.storage_driver.upload_blob_from_string(
+            '{}/ks1/t1-cfid1/nb-2-big-Data.db'.format(node2.data_path), 'different content')
+        self.storage.storage_driver.upload_blob_from_string(
+            '{}/ks1/t1-cfid1/nb-9-big-Data.db'.format(node2.data_path), 'not in the manifest')
+        # those never get verified
+        self.storage.storage_driver.upload_blob_from_string(
+            '{}/ks1/t1-cfid1/nb-9-big-Statistics.db'.format(node2.data_path), 'statistics')
+
+        errors, done = {}, []
+        for verification, error in validate_node_backups(self.storage, [node1, node2], False):
+            if error is None:
+                done.append((verification.fqdn, verification.num_objects, verification.num_errors))
+                self.assertIsNotNone(verification.duration)
+            else:
+                errors.setdefault(verification.fqdn, []).append(error.strip())
+
+        self.assertEqual([('node1', 3, 2), ('node2', 6, 2)], sorted(done))
+        self.assertEqual([
+            "- [{}/ks1/t1-cfid1/nb-0-big-Data.db] Doesn't exists".format(node1.data_path),
+            "- [{}/ks1/t1-cfid1/nb-4-big-Data.db] Doesn't exists".format(node1.data_path),
+        ], errors['node1'])
+        self.assertEqual([
+            "- [{}/ks1/t1-cfid1/nb-2-big-Data.db] Blob different".format(node2.data_path),
+            "- [{}/ks1/t1-cfid1/nb-9-big-Data.db] exists in storage, but not in manifest".format(node2.data_path),
+        ], errors['node2'])
+
+    def test_differential_backups_can_have_more_files(self):
+        node1 = self._make_backup('node1', {'nb-1-big-Data.db': 'content'}, differential=True)
+        self.storage.storage_driver.upload_blob_from_string(
+            '{}/ks1/t1-cfid1/nb-0-big-Data.db'.format(node1.data_path), 'from another backup')
+        errors = [error for _, error in validate_node_backups(self.storage, [node1], False) if error is not None]
+        self.assertEqual([], errors)
+
+    def test_unsorted_listing_fails(self):
+        node1 = self._make_backup('node1', {'nb-1-big-Data.db': 'content'})
+        verification = NodeVerification(self.storage, node1, False)
+        blobs = [AbstractBlob('{}/b'.format(node1.data_path), 1, None, None, None),
+                 AbstractBlob('{}/a'.format(node1.data_path), 1, None, None, None)]
+        with self.assertRaises(RuntimeError):
+            list(verification.add_blobs(blobs))
+
+    def test_deep_verification(self):
+        node1 = self._make_backup('node1', {'nb-1-big-Data.db': 'content', 'nb-2-big-Data.db': 'other content'},
+                                  with_md5=True)
+        # same size, so only reading the object back tells it changed
+        self.storage.storage_driver.upload_blob_from_string(
+            '{}/ks1/t1-cfid1/nb-2-big-Data.db'.format(node1.data_path), 'OTHER content')
+        self.assertEqual([], [error for _, error in validate_node_backups(self.storage, [node1], False) if error])
+
+        deep_verification = DeepVerification(self.storage, DeepVerificationProgress())
+        errors = [error for _, error in deep_verification.verify([node1])]
+        self.assertEqual(1, len(errors))
+        self.assertIn('nb-2-big-Data.db] MD5 is', errors[0])
+        self.assertTrue(deep_verification.complete)
+        self.assertEqual(2, deep_verification.num_objects)
+
+    def test_deep_verification_resumes(self):
+        files = {'nb-{}-big-Data.db'.format(i): 'content {}'.format(i) for i in range(5)}
+        node1 = self._make_backup('node1', files, with_md5=True)
+        progress_file = os.path.join(self.base_path, 'progress.json')
+
+        def run(max_size):
+            deep_verification = DeepVerification(
+                self.storage, DeepVerificationProgress(progress_file), max_size=max_size
+            )
+            self.assertEqual([], list(deep_verification.verify([node1])))
+            return deep_verification.num_objects, deep_verification.complete
+
+        # each object is 9 bytes
+        self.assertEqual((2, False), run(15))
+        self.assertEqual(2, DeepVerificationProgress(progress_file).num_done('backup1'))
+        self.assertEqual((2, False), run(15))
+        self.assertEqual((1, True), run(15))
+        # the backup got verified entirely, the next round starts over
+        self.assertEqual(0, DeepVerificationProgress(progress_file).num_done('backup1'))
+        self.assertEqual((5, True), run(None))
+
+    def test_multipart_md5(self):
+        for size in [2500, 2048]:
+            content = os.urandom(size)
+            path = os.path.join(self.base_path, 'file')
+            with open(path, 'wb') as f:
+                f.write(content)
+            expected = AbstractStorage.md5_multipart(path, 1024)
+
+            checksums = ObjectChecksums(size, expected, configured_part_size=1024)
+            for i in range(0, size, 100):
+                checksums.update(content[i:i + 100])
+            self.assertEqual([], checksums.errors())
+
+            checksums = ObjectChecksums(size, expected, configured_part_size=1024)
+            checksums.update(content[:-1] + b'x')
+            self.assertEqual(1, len(checksums.errors()))
+
+    def test_sstable_checksums(self):
+        for with_max_compressed_length in [True, False]:
+            data, info = compressed_sstable(
+                [b'first chunk', b'second chunk', b'last'], with_max_compressed_length=with_max_compressed_length
+            )
+            compression_info = parse_compression_info(info)
+            self.assertEqual(48, compression_info.data_length)
+            self.assertEqual([0, 15, 31], compression_info.offsets)
+
+            checksums = ObjectChecksums(len(data), None, expected_crc32=zlib.crc32(data),
+                                        compression_info=compression_info)
+            for i in range(0, len(data), 7):
+                checksums.update(data[i:i + 7])
+            self.assertEqual([], checksums.errors())
+
+        corrupted = data.replace(b'second', b'SECOND')
+        checksums = ObjectChecksums(len(data), None, expected_crc32=zlib.crc32(data),
+                                    compression_info=compression_info)
+        checksums.update(corrupted)
+        errors = checksums.errors()
+        self.assertEqual(2, len(errors))
+        self.assertIn('CRC32 is', errors[0])
+        self.assertIn('compressed chunk at offset 15', errors[1])
+
+        self.assertRaises(ValueError, parse_compression_info, info[:-1])
+
+    def test_deep_verification_checks_sstables(self):
+        data, info = compressed_sstable([b'first chunk', b'second chunk'])
+        node1 = self._make_backup('node1', {
+            'nb-1-big-Data.db': data.replace(b'second', b'SECOND'),
+            'nb-1-big-CompressionInfo.db': info,
+            'nb-1-big-Digest.crc32': str(zlib.crc32(data)),
+        })
+        deep_verification = DeepVerification(self.storage, DeepVerificationProgress(), check_sstables=True)
+        errors = [error for _, error in deep_verification.verify([node1])]
+        self.assertEqual(2, len(errors))
+        self.assertTrue(all('nb-1-big-Data.db]' in error for error in errors))
+
+
+if __name__ == '__main__':
+    unittest.main()